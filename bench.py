@@ -0,0 +1,380 @@
+"""
+Microbenchmarks for the bot's hot paths, run against lightweight fake
+discord objects (no token, no network).
+
+    python bench.py                                  # full run, JSON on stdout
+    python bench.py --sizes 1000,10000 -o bench.json
+    python bench.py --baseline bench.json            # fail on regressions
+
+Everything runs inside a temporary directory, so the bot's orders.csv /
+*.db / snapshot files are never touched.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import discord
+
+# melisse opens its data files relative to the working directory on import
+_START_DIR = os.getcwd()
+_BENCH_DIR = tempfile.mkdtemp(prefix="melisse-bench-")
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _REPO_DIR)
+os.chdir(_BENCH_DIR)
+import melisse  # noqa: E402
+
+
+# -------------------------
+# Fake discord objects
+# -------------------------
+
+class FakePermissions:
+    administrator = True
+
+
+class FakeMember:
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.guild_permissions = FakePermissions()
+        self.display_avatar = type("Avatar", (), {"url": "https://cdn.example/avatar.png"})()
+        self.bot = False
+
+    async def send(self, *args, **kwargs):
+        return FakeMessage(random.getrandbits(60), None)
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, channel, content: str = "", embeds=None):
+        self.id = message_id
+        self.channel = channel
+        self.content = content
+        self.embeds = embeds or []
+        self.attachments = []
+
+    async def edit(self, **kwargs):
+        return self
+
+    async def delete(self):
+        pass
+
+
+class FakeTextChannel(discord.TextChannel):
+    """
+    Passes isinstance(..., discord.TextChannel) checks without a gateway
+    payload; only the bits the bot touches are implemented.
+    """
+
+    overwrites = {}
+
+    def __init__(self, channel_id: int, name: str, guild: "FakeGuild"):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self._next_message_id = channel_id * 1000
+
+    async def send(self, content=None, **kwargs):
+        self._next_message_id += 1
+        return FakeMessage(self._next_message_id, self, content or "", [kwargs["embed"]] if "embed" in kwargs else [])
+
+    def get_partial_message(self, message_id: int):
+        return FakeMessage(message_id, self)
+
+    async def edit(self, **kwargs):
+        self.name = kwargs.get("name", self.name)
+
+    async def delete(self):
+        self.guild.channels.pop(self.id, None)
+
+
+class FakeThread:
+    def __init__(self, thread_id: int, guild: "FakeGuild"):
+        self.id = thread_id
+        self.guild = guild
+        self.name = f"product-{thread_id}"
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int = 1):
+        self.id = guild_id
+        self.channels = {}
+        self.default_role = object()
+        self.forums = []
+        self._next_channel_id = 10_000
+
+    @property
+    def text_channels(self):
+        return list(self.channels.values())
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+    async def create_text_channel(self, name: str, **kwargs):
+        self._next_channel_id += 1
+        channel = FakeTextChannel(self._next_channel_id, name, self)
+        self.channels[channel.id] = channel
+        return channel
+
+    async def fetch_member(self, user_id: int):
+        return FakeMember(user_id, f"user{user_id}")
+
+
+class FakeResponse:
+    def __init__(self):
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+    async def send_message(self, *args, **kwargs):
+        self._done = True
+
+    async def send_modal(self, modal):
+        self._done = True
+
+
+class FakeFollowup:
+    async def send(self, *args, **kwargs):
+        return FakeMessage(random.getrandbits(60), None)
+
+
+class FakeInteraction:
+    def __init__(self, user: FakeMember, guild: FakeGuild, channel, message=None):
+        self.id = random.getrandbits(60)
+        self.user = user
+        self.guild = guild
+        self.channel = channel
+        self.message = message
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+        self.type = discord.InteractionType.component
+        self.data = {}
+
+
+# -------------------------
+# Harness
+# -------------------------
+
+async def measure(fn, iterations: int) -> dict:
+    """
+    Await fn() `iterations` times; per-call latencies in microseconds.
+    """
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter_ns()
+        await fn()
+        samples.append((time.perf_counter_ns() - started) / 1000)
+    samples.sort()
+    return {
+        "n": iterations,
+        "mean_us": round(statistics.fmean(samples), 2),
+        "p50_us": round(samples[len(samples) // 2], 2),
+        "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2),
+        "min_us": round(samples[0], 2),
+    }
+
+
+def reset_state():
+    melisse.cart_registries.clear()
+    melisse.product_catalog._products.clear()
+    melisse.state_store._pending.clear()
+
+
+def write_orders_csv(path: str, rows: int, users: int = 5000, products: int = 500):
+    rng = random.Random(rows)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(melisse.ORDER_CSV_HEADER)
+        for _ in range(rows):
+            items = [(f"Product {rng.randrange(products)}", rng.randrange(500, 10000)) for _ in range(rng.randint(1, 3))]
+            writer.writerow(melisse.order_csv_row({
+                "guild_id": 1,
+                "user_id": rng.randrange(1, users + 1),
+                "username": "bench",
+                "created_at": datetime.now(timezone.utc),
+                "channel": "order-bench",
+                "items": items,
+            }))
+
+
+# -------------------------
+# Benchmarks
+# -------------------------
+
+async def bench_cart(results: dict, iterations: int, cart_size: int):
+    reset_state()
+    guild = FakeGuild()
+    user = FakeMember(42, "bench")
+    products = [FakeThread(1_000_000 + i, guild) for i in range(cart_size + iterations)]
+    for thread in products:
+        melisse.product_catalog._products[thread.id] = melisse.Product(
+            thread.id, guild.id, f"Product {thread.id}", 1999, ["https://cdn.example/p.png"]
+        )
+
+    view = melisse.AddToCartView()
+    pending = iter(products)
+
+    # Fill the cart to `cart_size` first so we measure the steady state
+    for _ in range(cart_size):
+        await view.add_to_cart.callback(FakeInteraction(user, guild, next(pending)))
+
+    results[f"add_to_cart[cart={cart_size}]"] = await measure(
+        lambda: view.add_to_cart.callback(FakeInteraction(user, guild, next(pending))), iterations
+    )
+
+    results[f"cart_total[cart={cart_size + iterations}]"] = await measure(
+        lambda: _summary_embed(guild.id, user.id), iterations
+    )
+
+    channel = guild.get_channel(melisse.carts_for(guild.id).channel_of(user.id))
+    item_ids = iter([item.product_id for item in melisse.carts_for(guild.id).items(user.id)])
+
+    async def remove_one():
+        button = melisse.RemoveFromCartButton(user.id, next(item_ids))
+        message = FakeMessage(0, channel)
+        await button.callback(FakeInteraction(user, guild, channel, message))
+
+    results[f"remove_item[cart={cart_size + iterations}]"] = await measure(remove_one, iterations)
+
+
+async def bench_owner_lookup(results: dict, iterations: int, carts: int):
+    reset_state()
+    guild = FakeGuild()
+    for user_id in range(carts):
+        melisse.carts_for(guild.id).set_channel(user_id, 10_000_000 + user_id)
+    channel_ids = [10_000_000 + random.randrange(carts) for _ in range(iterations)]
+    lookups = iter(channel_ids)
+    results[f"infer_cart_owner_id_by_channel_id[carts={carts}]"] = await measure(
+        lambda: melisse.infer_cart_owner_id_by_channel_id(guild.id, next(lookups)), iterations
+    )
+
+
+async def bench_stats(results: dict, iterations: int, rows: int):
+    path = os.path.join(_BENCH_DIR, f"orders-{rows}.csv")
+    write_orders_csv(path, rows)
+
+    started = time.perf_counter()
+    aggregates = melisse.SalesAggregates()
+    aggregates.catch_up(path)
+    results[f"sales_aggregates_rebuild[rows={rows}]"] = {"n": 1, "total_s": round(time.perf_counter() - started, 3)}
+
+    ledger_path = os.path.join(_BENCH_DIR, f"orders-{rows}.db")
+    ledger = melisse.OrderLedger(ledger_path)
+    started = time.perf_counter()
+    ledger.import_csv(path)
+    results[f"ledger_import[rows={rows}]"] = {"n": 1, "total_s": round(time.perf_counter() - started, 3)}
+
+    melisse.sales_aggregates = aggregates
+    melisse.order_ledger = ledger
+
+    guild = FakeGuild()
+    admin = FakeMember(1, "admin")
+    results[f"server_stats[rows={rows}]"] = await measure(
+        lambda: melisse.server_stats.callback(FakeInteraction(admin, guild, None)), iterations
+    )
+
+    users = [FakeMember(random.randint(1, 5000), "customer") for _ in range(iterations)]
+    targets = iter(users)
+    results[f"user_stats[rows={rows}]"] = await measure(
+        lambda: melisse.user_stats.callback(FakeInteraction(admin, guild, None), next(targets)), iterations
+    )
+    ledger.conn.close()
+
+
+async def _summary_embed(guild_id: int, user_id: int):
+    melisse.build_cart_summary_embed(*await melisse.cart_state.summary(guild_id, user_id))
+
+
+async def run(args) -> dict:
+    results = {}
+    melisse.mutations.start()
+
+    for cart_size in (0, 100, 1000):
+        await bench_cart(results, args.iterations, cart_size)
+    for carts in (100, 10_000, 100_000):
+        await bench_owner_lookup(results, args.iterations * 10, carts)
+    for rows in args.sizes:
+        print(f"… order history with {rows} rows", file=sys.stderr)
+        await bench_stats(results, args.iterations, rows)
+    return results
+
+
+# -------------------------
+# Baseline comparison
+# -------------------------
+
+# Differences smaller than this are timer noise, whatever the ratio
+NOISE_FLOOR = {"p50_us": 10.0, "total_s": 0.05}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Benchmarks whose p50 (or total_s) grew by more than `threshold` (0.2 = 20%).
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        metric = "p50_us" if "p50_us" in current else "total_s"
+        old, new = previous.get(metric), current.get(metric)
+        if old and new and new > old * (1 + threshold) and new - old > NOISE_FLOOR[metric]:
+            regressions.append((name, metric, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                        help="comma-separated order history sizes (rows)")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("-o", "--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="previous JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown vs baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes.split(",") if s]
+
+    results = asyncio.run(run(args))
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "discord.py": discord.__version__,
+            "machine": platform.machine(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(os.path.join(_START_DIR, args.output), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(os.path.join(_START_DIR, args.baseline), encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, old, new in regressions:
+            print(f"REGRESSION {name}: {metric} {old} -> {new}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
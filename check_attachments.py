@@ -0,0 +1,97 @@
+"""
+Runs the attachment pipeline's in-flight deduplication through concurrent
+fetches of one URL, including a shared download that fails, with downloads
+replaced by an in-process stand-in so no network is needed.
+
+    python check_attachments.py
+
+Exits non-zero on the first mismatch. Everything runs inside a temporary
+directory, so the bot's own data files and image cache are never touched.
+"""
+
+import asyncio
+import io
+import os
+import sys
+import tempfile
+
+# melisse opens its data files relative to DATA_DIR on import
+_CHECK_DIR = tempfile.mkdtemp(prefix="melisse-attachments-")
+os.environ["DATA_DIR"] = _CHECK_DIR
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import melisse  # noqa: E402
+from melisse import discord  # noqa: E402
+
+
+class DownloadStandIn:
+    """
+    Replaces AttachmentPipeline._download: counts calls, takes a moment so
+    fetches overlap, and fails the first `failures` calls.
+    """
+
+    def __init__(self, failures: int = 0):
+        self.calls = 0
+        self.failures = failures
+
+    async def __call__(self, url: str):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(0.05)
+        if call <= self.failures:
+            raise RuntimeError(f"download {call} failed")
+        data = f"image bytes for {url}".encode()
+        return io.BytesIO(data), melisse.hashlib.sha256(data).hexdigest()
+
+
+def check(condition: bool, what: str):
+    if not condition:
+        raise AssertionError(what)
+
+
+async def fetch_many(pipeline: melisse.AttachmentPipeline, url: str, count: int) -> list:
+    return await asyncio.gather(*(pipeline.fetch(url, "a.png") for _ in range(count)), return_exceptions=True)
+
+
+async def shared_download_fails():
+    pipeline = melisse.AttachmentPipeline(melisse.state_store, os.path.join(_CHECK_DIR, "cache-fail"))
+    pipeline._download = stand_in = DownloadStandIn(failures=1)
+    results = await fetch_many(pipeline, "https://x/a.png", 4)
+
+    failed = [r for r in results if isinstance(r, BaseException)]
+    check(len(failed) == 1 and isinstance(failed[0], RuntimeError), f"only the leader fails: {results}")
+    check(all(isinstance(r, discord.File) for r in results[1:]), f"waiters get files: {results}")
+    check(stand_in.calls == 2, f"one retry after the failure, got {stand_in.calls} downloads")
+    check(not pipeline._inflight, f"in-flight entries left behind: {pipeline._inflight}")
+    for r in results[1:]:
+        r.close()
+
+
+async def shared_download_succeeds():
+    pipeline = melisse.AttachmentPipeline(melisse.state_store, os.path.join(_CHECK_DIR, "cache-ok"))
+    pipeline._download = stand_in = DownloadStandIn()
+    results = await fetch_many(pipeline, "https://x/b.png?ex=1", 5)
+    check(all(isinstance(r, discord.File) for r in results), f"all fetches succeed: {results}")
+    check(stand_in.calls == 1, f"one download for five fetches, got {stand_in.calls}")
+    for r in results:
+        r.close()
+
+    results = await fetch_many(pipeline, "https://x/b.png?ex=2", 3)
+    check(stand_in.calls == 1 and pipeline.cache_hits == 7, "later fetches come from the cache")
+    for r in results:
+        r.close()
+
+
+async def main() -> int:
+    failed = 0
+    for case in (shared_download_fails, shared_download_succeeds):
+        try:
+            await case()
+            print(f"✅ {case.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {case.__name__}: {e}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
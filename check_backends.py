@@ -0,0 +1,243 @@
+"""
+Runs every cart state backend through the same cart and lease sequence:
+in-process, SQLite (two connections to one file, as two workers would
+have) and the Redis-protocol client against a local stand-in server.
+
+    python check_backends.py                          # all three
+    python check_backends.py --redis redis://localhost:6379/15   # also a real server
+
+Exits non-zero on the first mismatch. Everything runs inside a temporary
+directory, so the bot's own data files are never touched.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# melisse opens its data files relative to DATA_DIR on import
+_BENCH_DIR = tempfile.mkdtemp(prefix="melisse-backends-")
+os.environ["DATA_DIR"] = _BENCH_DIR
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import melisse  # noqa: E402
+from melisse import CartItem  # noqa: E402
+
+
+# -------------------------
+# Redis-protocol stand-in
+# -------------------------
+
+class RespStandIn:
+    """
+    Just enough of a Redis server for RespStateBackend: strings with NX/PX,
+    hashes, DEL and WATCH/MULTI/EXEC. Single-threaded like the real thing, so
+    every command is atomic.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}   # key -> unix time
+        self.versions = {}  # key -> write counter, for WATCH
+
+    def _touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _get(self, key):
+        if key in self.expires and self.expires[key] <= time.time():
+            self.data.pop(key, None)
+            del self.expires[key]
+            self._touch(key)
+        return self.data.get(key)
+
+    def run(self, args: list, session: dict):
+        command = args[0].upper()
+        if command in ("AUTH", "SELECT"):
+            return "+OK"
+        if command == "WATCH":
+            for key in args[1:]:
+                self._get(key)
+                session["watched"][key] = self.versions.get(key, 0)
+            return "+OK"
+        if command == "UNWATCH":
+            session["watched"] = {}
+            return "+OK"
+        if command == "MULTI":
+            session["queued"] = []
+            return "+OK"
+        if command == "DISCARD":
+            session["queued"] = None
+            session["watched"] = {}
+            return "+OK"
+        if command == "EXEC":
+            queued, session["queued"] = session["queued"], None
+            dirty = any(self.versions.get(key, 0) != v for key, v in session["watched"].items())
+            session["watched"] = {}
+            return None if dirty else [self.run(queued_args, session) for queued_args in queued]
+        if session["queued"] is not None:
+            session["queued"].append(args)
+            return "+QUEUED"
+
+        if command == "GET":
+            return self._get(args[1])
+        if command == "SET":
+            key, value, options = args[1], args[2], [a.upper() for a in args[3:]]
+            if "NX" in options and self._get(key) is not None:
+                return None
+            self.data[key] = value
+            self.expires.pop(key, None)
+            if "PX" in options:
+                self.expires[key] = time.time() + int(args[3 + options.index("PX") + 1]) / 1000
+            self._touch(key)
+            return "+OK"
+        if command == "DEL":
+            deleted = 0
+            for key in args[1:]:
+                deleted += self.data.pop(key, None) is not None
+                self._touch(key)
+            return deleted
+
+        key = args[1]
+        table = self.data.setdefault(key, {})
+        if command == "HSET":
+            self._touch(key)
+            added = args[2] not in table
+            table[args[2]] = args[3]
+            return int(added)
+        if command == "HGET":
+            return table.get(args[2])
+        if command == "HDEL":
+            self._touch(key)
+            return int(table.pop(args[2], None) is not None)
+        if command == "HEXISTS":
+            return int(args[2] in table)
+        if command == "HLEN":
+            return len(table)
+        if command == "HGETALL":
+            return [x for pair in table.items() for x in pair]
+        if command == "HINCRBY":
+            self._touch(key)
+            table[args[2]] = str(int(table.get(args[2], 0)) + int(args[3]))
+            return int(table[args[2]])
+        return f"-ERR unknown command '{command}'"
+
+    @classmethod
+    def encode(cls, reply) -> bytes:
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(cls.encode(r) for r in reply)
+        if reply[:1] in ("+", "-"):
+            return reply.encode() + b"\r\n"
+        data = reply.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    async def handle(self, reader, writer):
+        session = {"watched": {}, "queued": None}
+        while line := await reader.readline():
+            args = []
+            for _ in range(int(line[1:])):
+                length = int((await reader.readline())[1:])
+                args.append((await reader.readexactly(length + 2))[:-2].decode())
+            writer.write(self.encode(self.run(args, session)))
+            await writer.drain()
+        writer.close()
+
+    async def start(self):
+        server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return server, server.sockets[0].getsockname()[1]
+
+
+# -------------------------
+# Sequence
+# -------------------------
+
+def check(condition: bool, what: str):
+    if not condition:
+        raise AssertionError(what)
+
+
+async def run_sequence(a: melisse.StateBackend, b: melisse.StateBackend):
+    """
+    `a` and `b` are two handles on the same state (two workers).
+    """
+    guild_id, user_id, other_id = 7, 42, 43
+    await a.clear(guild_id, user_id)
+    await a.clear(guild_id, other_id)
+
+    # Atomic add: ten racing adds of one product from two workers, one wins
+    added = await asyncio.gather(*[
+        backend.add_item(guild_id, user_id, CartItem(1, "Alpha", 100, "https://cdn.example/a.png"))
+        for backend in (a, b) * 5
+    ])
+    check(sum(added) == 1, f"racing adds: {added}")
+    check(not await b.add_item(guild_id, user_id, CartItem(2, "Alpha", 100, "u")), "duplicate title accepted")
+    check(await b.add_item(guild_id, user_id, CartItem(3, "Beta", 250, "u")), "second item rejected")
+    check([i.title for i in await a.items(guild_id, user_id)] == ["Alpha", "Beta"], "items / order")
+    check(tuple(await a.summary(guild_id, user_id)) == (2, 350), "summary after adds")
+    check(await a.remove_item(guild_id, user_id, 1), "remove")
+    check(not await b.remove_item(guild_id, user_id, 1), "double remove")
+    check(tuple(await b.summary(guild_id, user_id)) == (1, 250), "summary after remove")
+
+    # Channels: mapping both ways, and a channel moving to another cart
+    await a.set_channel(guild_id, user_id, 900)
+    check(await b.owner_of(guild_id, 900) == user_id and await b.channel_of(guild_id, user_id) == 900, "set_channel")
+    await b.set_channel(guild_id, other_id, 900)
+    check(await a.owner_of(guild_id, 900) == other_id, "channel moved")
+    check(await a.channel_of(guild_id, user_id) is None, "old owner still mapped")
+    await a.set_summary_message(guild_id, other_id, 55)
+    check(await b.summary_message_of(guild_id, other_id) == 55, "summary message")
+    await b.forget_channel(guild_id, 900)
+    check(await a.owner_of(guild_id, 900) is None, "forget_channel")
+    check(tuple(await a.summary(guild_id, other_id)) == (0, 0), "cart cleared with its channel")
+
+    # Leases: exclusive across workers, re-entrant for the holder, expire on their own
+    lease = f"check:{time.time()}"
+    check(await a.acquire_lease(lease, "w1", 0.3), "acquire")
+    check(not await b.acquire_lease(lease, "w2", 0.3), "acquired while held")
+    check(await a.acquire_lease(lease, "w1", 0.3), "re-acquire by holder")
+    await b.release_lease(lease, "w2")
+    check(not await b.acquire_lease(lease, "w2", 0.3), "released by non-holder")
+    await a.release_lease(lease, "w1")
+    check(await b.acquire_lease(lease, "w2", 0.2), "acquire after release")
+    await asyncio.sleep(0.3)
+    check(await a.acquire_lease(lease, "w3", 1), "acquire after expiry")
+    await a.release_lease(lease, "w3")
+
+
+async def main(args) -> int:
+    pairs = []
+    memory = melisse.MemoryStateBackend()
+    pairs.append(("memory", memory, memory))
+    path = os.path.join(_BENCH_DIR, "shared_state.db")
+    pairs.append(("sqlite", melisse.SQLiteStateBackend(path), melisse.SQLiteStateBackend(path)))
+
+    stand_in, port = await RespStandIn().start()
+    url = f"redis://127.0.0.1:{port}/1"
+    pairs.append(("resp (stand-in)", melisse.make_state_backend(url), melisse.make_state_backend(url)))
+    if args.redis:
+        pairs.append(("resp", melisse.make_state_backend(args.redis), melisse.make_state_backend(args.redis)))
+
+    failed = 0
+    for name, a, b in pairs:
+        try:
+            await run_sequence(a, b)
+            print(f"✅ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {name}: {e}")
+        finally:
+            await a.close()
+            if b is not a:
+                await b.close()
+    stand_in.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis", help="also run against this redis:// URL (use a scratch database)")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -6,103 +6,3730 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 import asyncio
+import bisect
+import contextlib
+import contextvars
 import csv
-from datetime import datetime, timezone
+import functools
+import hashlib
+import heapq
+import io
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+import abc
+import shutil
+import socket
+import tempfile
+import urllib.parse
+import weakref
+import aiohttp
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, WORKER_DIR is not guarded
+    fcntl = None
 
 # Bot Settings
 intents = discord.Intents.default()
 intents.message_content = True
 intents.guilds = True
-bot = commands.Bot(command_prefix="/", intents=intents)
+# SHARDED=1 runs one process over many storefront guilds with automatic sharding;
+# to split shards over several processes give each SHARD_COUNT and its own SHARD_IDS
+SHARDED = os.environ.get("SHARDED", "") == "1"
+SHARD_COUNT = int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT") else None
+SHARD_IDS = [int(s) for s in os.environ.get("SHARD_IDS", "").split(",") if s.strip()] or None
+if SHARDED:
+    bot = commands.AutoShardedBot(command_prefix="/", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    bot = commands.Bot(command_prefix="/", intents=intents)
 tree = bot.tree
 
+# The original storefront; the IDs below are its defaults and other guilds set
+# theirs with /configure (see GuildConfigCache)
+DEFAULT_GUILD_ID = 1336017250813087877
+
 # Category IDs
 TICKET_CATEGORY_ID = 1365516765152415866
 CART_CATEGORY_ID = 1336017251618263082
 RECEIPT_CATEGORY_ID = 1365680710215667773
 ORDERS_CATEGORY_ID = 1365661620667154502
 
-# Logs / Admin channel
-LOG_CHANNEL_ID = 1365495903758323823
+# Logs / Admin channel
+LOG_CHANNEL_ID = 1365495903758323823
+
+# Data files. Each bot process owns DATA_DIR/<WORKER_NAME>/ (orders, local
+# state, snapshots, image cache, metrics) and refuses to start if another
+# process already holds it; run several workers with distinct WORKER_NAMEs.
+# Only the shared SQLite state backend lives in DATA_DIR itself.
+DATA_DIR = os.environ.get("DATA_DIR", ".")
+WORKER_NAME = os.environ.get("WORKER_NAME", "")
+WORKER_DIR = os.path.join(DATA_DIR, WORKER_NAME)
+os.makedirs(WORKER_DIR, exist_ok=True)
+
+
+def worker_path(name: str) -> str:
+    return os.path.join(WORKER_DIR, name)
+
+
+# CSV (kept for compatibility / download) + indexed order ledger
+ORDER_CSV_PATH = worker_path("orders.csv")
+ORDER_DB_PATH = worker_path("orders.db")
+ORDER_CSV_HEADER = ["User ID", "Username", "Date", "Channel", "Items", "Total", "Guild ID"]
+ORDER_CSV_DATE_FORMAT = "%d/%m/%y %H:%M"
+
+# Running sales aggregates (snapshot of orders.csv up to a byte offset)
+SALES_SNAPSHOT_PATH = worker_path("sales_stats.json")
+SALES_SNAPSHOT_INTERVAL = 60  # seconds between snapshots while exporting
+
+# Durable local state (carts, cart channels, pending products)
+STATE_DB_PATH = worker_path("state.db")
+STATE_GROUP_COMMIT_WINDOW = 0.05  # seconds to gather writes into one transaction
+
+# Cart state shared between bot processes: "memory" (this process only),
+# "sqlite:<path>" (processes on one host) or "redis://host:port/db"
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+SHARED_STATE_DB_PATH = os.path.join(DATA_DIR, "shared_state.db")
+CART_LEASE_TTL = 30     # seconds a worker may take to create a cart channel
+CART_LEASE_POLL = 0.25  # seconds between checks while another worker holds the lease
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Auto-deletion delays
+TICKET_DELETE_AFTER = 10800  # 3 hours after a ticket is closed
+ORDER_DELETE_AFTER = 86400   # 24 hours after an order is approved
+
+# Product catalog warm-up: concurrent starter-message fetches for unknown threads
+CATALOG_WARM_CONCURRENCY = 5
+
+# Product images: downloads are streamed into spooled temp files (kept in
+# memory up to the cap, then spilled to disk) and kept in a content-addressed cache
+ATTACHMENT_SPOOL_MAX = 8 * 1024 * 1024    # bytes in memory per file
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+ATTACHMENT_DOWNLOAD_CONCURRENCY = 4
+MAX_FILES_PER_MESSAGE = 10                # Discord limit
+IMAGE_CACHE_DIR = worker_path("image_cache")
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Guild mutation queue: client-side token buckets per REST route, (requests, per seconds)
+MUTATION_ROUTE_LIMITS = {
+    "channel_create": (5, 5),
+    "channel_rename": (2, 600),  # Discord allows 2 renames per channel per 10 minutes
+    "channel_delete": (5, 5),
+    "thread_create": (5, 5),
+}
+MUTATION_CONCURRENCY = 4
+
+# /import_products: products being prepared (images downloading) at once
+IMPORT_CONCURRENCY = 3
+IMPORT_PROGRESS_INTERVAL = 5  # seconds between progress edits
+
+# Metrics: Prometheus text file, rewritten periodically
+METRICS_PROM_PATH = worker_path("metrics.prom")
+METRICS_WRITE_INTERVAL = 60  # seconds
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Polls: live results are re-rendered at most this often (seconds)
+POLL_RENDER_INTERVAL = 5
+POLL_EMOJIS = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣"]
+
+# Slash commands are synced only when their hash changes. They are registered
+# globally, or, if this lists guild IDs (comma-separated), only in those guilds,
+# where updates show up instantly (development). Never both: a guild that has
+# the global and the guild copy shows every command twice.
+COMMAND_SYNC_GUILD_IDS = [int(g) for g in os.environ.get("COMMAND_SYNC_GUILDS", "").split(",") if g.strip()]
+
+# /clear: history is paged and deleted in chunks of this size (bulk delete takes up to 100)
+CLEAR_CHUNK_SIZE = 100
+CLEAR_PROGRESS_INTERVAL = 3  # seconds between progress edits
+CLEAR_SINGLE_DELETE_LIMIT = (5, 5)  # single deletes of messages too old for bulk delete
+BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(minutes=5)  # margin for clock skew
+
+# Wishlist DMs: clicks within the window are coalesced into one digest
+# message, which keeps being edited while it is recent enough
+WISHLIST_DIGEST_WINDOW = 10     # seconds
+WISHLIST_DIGEST_REUSE = 1800    # seconds
+WISHLIST_PAGE_SIZE = 5
+
+# How long the bot waits for an attachment after a button / modal (seconds)
+PENDING_PRODUCT_TTL = 900
+PENDING_RECEIPT_TTL = 120
+
+
+# -------------------------
+# Helpers
+# -------------------------
+
+def parse_price_to_cents(text: str) -> int:
+    """
+    Accepts strings like '43', '$43', '43€', '43.50€', '43,50', '1,299.00' or
+    '1.299,00' and returns integer cents, so totals can be summed without
+    float drift. Raises ValueError for anything else (signs, exponents, more
+    than two decimals).
+    """
+    if not text:
+        return 0
+    t = str(text).replace("€", "").replace("$", "").replace(" ", "").strip()
+    if not t or t.strip("0123456789.,"):
+        raise ValueError(f"not a price: {text!r}")
+
+    # With both separators the last one is the decimal point. A lone separator
+    # is a decimal point unless it repeats or has three digits after it ('1.299').
+    last = max(t.rfind("."), t.rfind(","))
+    whole, decimals = t, ""
+    if last >= 0 and ("." in t and "," in t or (t.count(t[last]) == 1 and len(t) - last - 1 != 3)):
+        whole, decimals = t[:last], t[last + 1:]
+    groups = whole.replace(",", ".").split(".")
+    valid = (
+        all(g.isdigit() for g in groups[1:]) and (groups[0].isdigit() or groups[0] == "" and len(groups) == 1)
+        and (len(groups) == 1 or len(groups[0]) <= 3 and all(len(g) == 3 for g in groups[1:]))
+        and (decimals == "" or decimals.isdigit() and len(decimals) <= 2)
+        and (whole or decimals)
+    )
+    if not valid:
+        raise ValueError(f"not a price: {text!r}")
+    return int("".join(groups) or 0) * 100 + int(decimals.ljust(2, "0"))
+
+def format_eur(value: float) -> str:
+    return f"{value:.2f}€"
+
+def format_cents(cents: int) -> str:
+    return format_eur(cents / 100)
+
+# The event loop only holds weak references to tasks; fire-and-forget ones live here
+background_tasks = set()
+
+def spawn(coro) -> asyncio.Task:
+    """
+    Run a coroutine in the background without it being garbage-collected
+    mid-flight, and log its exception instead of losing it.
+    """
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+def _background_task_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[background] {task.get_coro().__qualname__} failed: {task.exception()!r}")
+
+async def clear_user_cart(guild_id: int, user_id: int):
+    await cart_state.clear(guild_id, user_id)
+
+async def infer_cart_owner_id_by_channel_id(guild_id: int, channel_id: int):
+    return await cart_state.owner_of(guild_id, channel_id)
+
+async def ensure_cart_channel_mapping_valid(guild: discord.Guild, user_id: int):
+    """
+    If we think the user has a cart channel but it was deleted, clear their cart
+    so they can add items again.
+    """
+    cid = await cart_state.channel_of(guild.id, user_id)
+    if not cid:
+        return
+    ch = guild.get_channel(cid)
+    if ch is None:
+        await clear_user_cart(guild.id, user_id)
+
+
+# -------------------------
+# Metrics
+# -------------------------
+
+# The REST-call counter of the handler currently running (a 1-item list), if any
+_rest_calls = contextvars.ContextVar("_rest_calls", default=None)
+
+
+class HandlerMetrics:
+    __slots__ = ("count", "errors", "rest_calls", "latency_sum", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rest_calls = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(METRICS_LATENCY_BUCKETS) + 1)  # last one is +Inf
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the histogram bucket holding the q-th quantile.
+        """
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(METRICS_LATENCY_BUCKETS, self.buckets):
+            seen += n
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Per-handler latency histograms, error counts and Discord REST call counts.
+    Cheap enough to wrap every handler: a perf_counter pair, a contextvar set
+    and a bisect per call.
+    """
+
+    def __init__(self):
+        self.handlers = {}  # name -> HandlerMetrics
+        self.rest_calls = 0
+        self.started = time.time()
+
+    def observe(self, name: str, seconds: float, rest_calls: int, error: bool):
+        h = self.handlers.get(name)
+        if h is None:
+            h = self.handlers[name] = HandlerMetrics()
+        h.count += 1
+        h.errors += error
+        h.rest_calls += rest_calls
+        h.latency_sum += seconds
+        h.buckets[bisect.bisect_left(METRICS_LATENCY_BUCKETS, seconds)] += 1
+
+    def render_prometheus(self) -> str:
+        lines = [
+            "# HELP melisse_handler_latency_seconds Handler latency.",
+            "# TYPE melisse_handler_latency_seconds histogram",
+        ]
+        for name, h in sorted(self.handlers.items()):
+            cumulative = 0
+            for bound, n in zip(METRICS_LATENCY_BUCKETS + ("+Inf",), h.buckets):
+                cumulative += n
+                lines.append(f'melisse_handler_latency_seconds_bucket{{handler="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'melisse_handler_latency_seconds_sum{{handler="{name}"}} {h.latency_sum:.6f}')
+            lines.append(f'melisse_handler_latency_seconds_count{{handler="{name}"}} {h.count}')
+
+        lines += ["# HELP melisse_handler_errors_total Handler invocations that raised.",
+                  "# TYPE melisse_handler_errors_total counter"]
+        lines += [f'melisse_handler_errors_total{{handler="{name}"}} {h.errors}' for name, h in sorted(self.handlers.items())]
+
+        lines += ["# HELP melisse_handler_rest_calls_total Discord REST calls made by a handler.",
+                  "# TYPE melisse_handler_rest_calls_total counter"]
+        lines += [f'melisse_handler_rest_calls_total{{handler="{name}"}} {h.rest_calls}' for name, h in sorted(self.handlers.items())]
+
+        lines += ["# HELP melisse_rest_calls_total All Discord REST calls.",
+                  "# TYPE melisse_rest_calls_total counter",
+                  f"melisse_rest_calls_total {self.rest_calls}"]
+
+        queue = mutations.stats()
+        lines += ["# HELP melisse_mutation_queue_depth Guild mutations waiting to run.",
+                  "# TYPE melisse_mutation_queue_depth gauge",
+                  f"melisse_mutation_queue_depth {queue['depth']}",
+                  "# HELP melisse_mutation_queue_wait_seconds_max Longest wait before a mutation ran.",
+                  "# TYPE melisse_mutation_queue_wait_seconds_max gauge",
+                  f"melisse_mutation_queue_wait_seconds_max {queue['wait_max']:.6f}"]
+
+        flights = (cart_channel_flight, ticket_channel_flight)
+        lines += ["# HELP melisse_single_flight_calls_total Calls to a single-flight helper.",
+                  "# TYPE melisse_single_flight_calls_total counter"]
+        lines += [f'melisse_single_flight_calls_total{{flight="{f.name}"}} {f.calls}' for f in flights]
+        lines += ["# HELP melisse_single_flight_merged_total Calls that joined a flight already in progress.",
+                  "# TYPE melisse_single_flight_merged_total counter"]
+        lines += [f'melisse_single_flight_merged_total{{flight="{f.name}"}} {f.merged}' for f in flights]
+        lines += ["# HELP melisse_cart_locks Per-cart locks currently alive.",
+                  "# TYPE melisse_cart_locks gauge",
+                  f"melisse_cart_locks {len(cart_locks)}",
+                  "# HELP melisse_cart_lock_contended_total Cart lock acquisitions that had to wait.",
+                  "# TYPE melisse_cart_lock_contended_total counter",
+                  f"melisse_cart_lock_contended_total {cart_locks.contended}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, text: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    async def run_writer(self):
+        while True:
+            await asyncio.sleep(METRICS_WRITE_INTERVAL)
+            try:
+                await asyncio.to_thread(self.write, METRICS_PROM_PATH, self.render_prometheus())
+            except OSError as e:
+                print(f"[metrics] failed to write {METRICS_PROM_PATH}: {e}")
+
+
+metrics = Metrics()
+
+
+def instrumented(name: str):
+    """
+    Record latency, errors and REST calls of a view callback or slash command.
+    Goes directly above the `async def`, under the discord.py decorators.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            counter = [0]
+            token = _rest_calls.set(counter)
+            started = time.perf_counter()
+            error = False
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                _rest_calls.reset(token)
+                metrics.observe(name, time.perf_counter() - started, counter[0], error)
+        return wrapper
+    return decorator
+
+
+def _count_rest_calls(cls):
+    """
+    Count every request made through `cls.request` (bot HTTP client and the
+    webhook adapter used for interaction responses / followups).
+    """
+    original = cls.request
+
+    @functools.wraps(original)
+    async def request(self, *args, **kwargs):
+        metrics.rest_calls += 1
+        counter = _rest_calls.get()
+        if counter is not None:
+            counter[0] += 1
+        return await original(self, *args, **kwargs)
+
+    cls.request = request
+
+
+_count_rest_calls(discord.http.HTTPClient)
+_count_rest_calls(discord.webhook.async_.AsyncWebhookAdapter)
+
+
+# -------------------------
+# Cart registry
+# -------------------------
+
+class CartItem:
+    """
+    One product in a cart. Embeds are only built when a message is sent.
+    """
+    __slots__ = ("product_id", "title", "price_cents", "image_url")
+
+    def __init__(self, product_id: int, title: str, price_cents: int, image_url: str):
+        self.product_id = product_id
+        self.title = title
+        self.price_cents = price_cents
+        self.image_url = image_url
+
+    def to_embed(self) -> discord.Embed:
+        embed = discord.Embed(title=self.title, color=discord.Color.orange())
+        embed.set_image(url=self.image_url)
+        embed.add_field(name="💰 Price", value=format_cents(self.price_cents))
+        return embed
+
+
+class Cart:
+    """
+    A user's items keyed by product ID, with the title set used for duplicate
+    checks and a running total, so add/remove/summary never rescan the cart.
+    """
+    __slots__ = ("items", "titles", "total_cents", "summary_message_id")
+
+    def __init__(self):
+        self.items = {}  # product_id -> CartItem (insertion ordered)
+        self.titles = set()
+        self.total_cents = 0
+        self.summary_message_id = None
+
+    def add(self, item: CartItem) -> bool:
+        if item.title in self.titles or item.product_id in self.items:
+            return False
+        self.items[item.product_id] = item
+        self.titles.add(item.title)
+        self.total_cents += item.price_cents
+        return True
+
+    def remove(self, product_id: int):
+        item = self.items.pop(product_id, None)
+        if item is not None:
+            self.titles.discard(item.title)
+            self.total_cents -= item.price_cents
+        return item
+
+    def __len__(self):
+        return len(self.items)
+
+
+class CartRegistry:
+    """
+    Every open cart of one guild: the user's items plus their cart channel,
+    indexed both user -> channel and channel -> user so lookups either way
+    are O(1). Backs MemoryStateBackend; views go through `cart_state`
+    rather than using a registry directly.
+    """
+
+    def __init__(self, store=None, guild_id: int = 0):
+        self._carts = {}             # user_id -> Cart
+        self._channel_by_user = {}   # user_id -> channel_id
+        self._owner_by_channel = {}  # channel_id -> user_id
+        self.store = store           # StateStore journal, if any
+        self.guild_id = guild_id
+
+    # --- items ---
+
+    def items(self, user_id: int) -> list:
+        cart = self._carts.get(user_id)
+        return list(cart.items.values()) if cart else []
+
+    def add_item(self, user_id: int, item: CartItem) -> bool:
+        """
+        False if an item with the same title or product is already in the cart.
+        """
+        cart = self._carts.get(user_id)
+        if cart is None:
+            cart = self._carts[user_id] = Cart()
+        if not cart.add(item):
+            return False
+        if self.store:
+            self.store.put_cart_item(self.guild_id, user_id, item)
+        return True
+
+    def remove_item(self, user_id: int, product_id: int) -> bool:
+        cart = self._carts.get(user_id)
+        if cart is None or cart.remove(product_id) is None:
+            return False
+        if self.store:
+            self.store.delete_cart_item(self.guild_id, user_id, product_id)
+        return True
+
+    def summary(self, user_id: int):
+        """
+        (item count, total in cents) for the user's cart.
+        """
+        cart = self._carts.get(user_id)
+        return (len(cart), cart.total_cents) if cart else (0, 0)
+
+    def summary_message_of(self, user_id: int):
+        cart = self._carts.get(user_id)
+        return cart.summary_message_id if cart is not None else None
+
+    def set_summary_message(self, user_id: int, message_id: int):
+        cart = self._carts.get(user_id)
+        if cart is None:
+            cart = self._carts[user_id] = Cart()
+        cart.summary_message_id = message_id
+        if self.store:
+            self.store.put_summary_message(self.guild_id, user_id, message_id)
+
+    # --- channels ---
+
+    def channel_of(self, user_id: int):
+        return self._channel_by_user.get(user_id)
+
+    def owner_of(self, channel_id: int):
+        return self._owner_by_channel.get(channel_id)
+
+    def set_channel(self, user_id: int, channel_id: int):
+        old_channel_id = self._channel_by_user.get(user_id)
+        if old_channel_id is not None and old_channel_id != channel_id:
+            self._owner_by_channel.pop(old_channel_id, None)
+        old_owner_id = self._owner_by_channel.get(channel_id)
+        if old_owner_id is not None and old_owner_id != user_id:
+            self._channel_by_user.pop(old_owner_id, None)
+            if self.store:
+                self.store.put_cart_channel(self.guild_id, old_owner_id, None)
+        self._channel_by_user[user_id] = channel_id
+        self._owner_by_channel[channel_id] = user_id
+        if self.store:
+            self.store.put_cart_channel(self.guild_id, user_id, channel_id)
+
+    # --- teardown ---
+
+    def clear(self, user_id: int):
+        self._carts.pop(user_id, None)
+        channel_id = self._channel_by_user.pop(user_id, None)
+        if channel_id is not None:
+            self._owner_by_channel.pop(channel_id, None)
+        if self.store:
+            self.store.delete_cart(self.guild_id, user_id)
+
+    def restore(self, user_id: int, channel_id, summary_message_id, items: list):
+        """
+        Rehydrate one cart from the state store (no journaling).
+        """
+        cart = self._carts[user_id] = Cart()
+        cart.items = {item.product_id: item for item in items}
+        cart.titles = {item.title for item in items}
+        cart.total_cents = sum(item.price_cents for item in items)
+        cart.summary_message_id = summary_message_id
+        if channel_id is not None:
+            self._channel_by_user[user_id] = channel_id
+            self._owner_by_channel[channel_id] = user_id
+
+    def forget_channel(self, channel_id: int):
+        """
+        Cart channel was deleted: drop the owner's cart with it.
+        """
+        owner_id = self._owner_by_channel.get(channel_id)
+        if owner_id is not None:
+            self.clear(owner_id)
+
+
+def build_cart_summary_embed(item_count: int, total_cents: int) -> discord.Embed:
+    summary_embed = discord.Embed(
+        title="🧾 Cart Summary",
+        description=f"Total items: {item_count}",
+        color=discord.Color.blue()
+    )
+    summary_embed.add_field(name="Total", value=format_cents(total_cents))
+    return summary_embed
+
+
+async def refresh_cart_summary(channel: discord.TextChannel, user_id: int):
+    """
+    Edit the cart's summary message in place (one API call); only re-send it
+    if it has been deleted or was never posted. Serialized per cart, so two
+    quick adds never both post a summary.
+    """
+    guild_id = channel.guild.id
+    async with cart_locks.lock((guild_id, user_id)):
+        summary_embed = build_cart_summary_embed(*await cart_state.summary(guild_id, user_id))
+        message_id = await cart_state.summary_message_of(guild_id, user_id)
+        if message_id:
+            try:
+                await channel.get_partial_message(message_id).edit(embed=summary_embed)
+                return
+            except discord.NotFound:
+                pass
+        msg = await channel.send(embed=summary_embed, view=SummaryView(user_id=user_id))
+        await cart_state.set_summary_message(guild_id, user_id, msg.id)
+
+
+# -------------------------
+# Durable state store
+# -------------------------
+
+class StateStore:
+    """
+    SQLite (WAL) copy of open carts, cart channels and pending products.
+
+    Mutations are queued in memory and written by a single background task:
+    everything queued within STATE_GROUP_COMMIT_WINDOW goes into one
+    transaction (group commit), executed off the event loop. On startup the
+    tables are read back in a handful of bulk queries.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS carts (
+            guild_id           INTEGER NOT NULL,
+            user_id            INTEGER NOT NULL,
+            channel_id         INTEGER,
+            summary_message_id INTEGER,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS cart_items (
+            guild_id    INTEGER NOT NULL,
+            user_id     INTEGER NOT NULL,
+            product_id  INTEGER NOT NULL,
+            title       TEXT    NOT NULL,
+            price_cents INTEGER NOT NULL,
+            image_url   TEXT    NOT NULL,
+            PRIMARY KEY (guild_id, user_id, product_id)
+        );
+        CREATE TABLE IF NOT EXISTS guild_config (
+            guild_id            INTEGER PRIMARY KEY,
+            ticket_category_id  INTEGER,
+            cart_category_id    INTEGER,
+            receipt_category_id INTEGER,
+            orders_category_id  INTEGER,
+            log_channel_id      INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS pending_products (
+            user_id INTEGER PRIMARY KEY,
+            data    TEXT    NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS products (
+            product_id  INTEGER PRIMARY KEY,  -- forum thread ID
+            guild_id    INTEGER NOT NULL,
+            name        TEXT    NOT NULL,
+            price_cents INTEGER NOT NULL,
+            image_urls  TEXT    NOT NULL      -- JSON list
+        );
+        CREATE TABLE IF NOT EXISTS polls (
+            message_id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            question   TEXT    NOT NULL,
+            author     TEXT    NOT NULL,
+            options    TEXT    NOT NULL,  -- JSON list
+            closes_at  REAL,              -- unix timestamp, NULL = open-ended
+            closed     INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS poll_votes (
+            message_id INTEGER NOT NULL,
+            user_id    INTEGER NOT NULL,
+            option     INTEGER NOT NULL,
+            PRIMARY KEY (message_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS wishlist (
+            user_id    INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            added_at   REAL    NOT NULL,  -- unix timestamp
+            PRIMARY KEY (user_id, product_id)
+        );
+        CREATE TABLE IF NOT EXISTS image_cache (
+            url    TEXT PRIMARY KEY,  -- without the CDN query string
+            sha256 TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            row_hash  TEXT PRIMARY KEY,  -- sha256 of the normalised manifest row
+            thread_id INTEGER            -- NULL while the post is in flight
+        );
+        CREATE TABLE IF NOT EXISTS command_sync (
+            scope TEXT PRIMARY KEY,  -- "global" or a guild ID
+            hash  TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS timers (
+            key     TEXT PRIMARY KEY,
+            due     REAL NOT NULL,  -- unix timestamp
+            action  TEXT NOT NULL,
+            payload TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._pending = []  # queued (sql, params) not yet handed to the writer
+        self._wakeup = asyncio.Event()
+
+    # --- journal (called from the event loop, never blocks) ---
+
+    def _submit(self, sql: str, params: tuple):
+        self._pending.append((sql, params))
+        self._wakeup.set()
+
+    def put_cart_item(self, guild_id: int, user_id: int, item: CartItem):
+        self._submit(
+            "INSERT OR REPLACE INTO cart_items (guild_id, user_id, product_id, title, price_cents, image_url) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (guild_id, user_id, item.product_id, item.title, item.price_cents, item.image_url)
+        )
+
+    def delete_cart_item(self, guild_id: int, user_id: int, product_id: int):
+        self._submit(
+            "DELETE FROM cart_items WHERE guild_id = ? AND user_id = ? AND product_id = ?",
+            (guild_id, user_id, product_id)
+        )
+
+    def put_cart_channel(self, guild_id: int, user_id: int, channel_id):
+        self._submit(
+            "INSERT INTO carts (guild_id, user_id, channel_id) VALUES (?, ?, ?) "
+            "ON CONFLICT(guild_id, user_id) DO UPDATE SET channel_id = excluded.channel_id",
+            (guild_id, user_id, channel_id)
+        )
+
+    def put_summary_message(self, guild_id: int, user_id: int, message_id: int):
+        self._submit(
+            "INSERT INTO carts (guild_id, user_id, summary_message_id) VALUES (?, ?, ?) "
+            "ON CONFLICT(guild_id, user_id) DO UPDATE SET summary_message_id = excluded.summary_message_id",
+            (guild_id, user_id, message_id)
+        )
+
+    def delete_cart(self, guild_id: int, user_id: int):
+        self._submit("DELETE FROM cart_items WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+        self._submit("DELETE FROM carts WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+
+    def put_guild_config(self, config: "GuildConfig"):
+        self._submit(
+            "INSERT OR REPLACE INTO guild_config (guild_id, ticket_category_id, cart_category_id, "
+            "receipt_category_id, orders_category_id, log_channel_id) VALUES (?, ?, ?, ?, ?, ?)",
+            tuple(getattr(config, field) for field in GuildConfig.__slots__)
+        )
+
+    def put_pending_product(self, user_id: int, data: dict):
+        self._submit(
+            "INSERT OR REPLACE INTO pending_products (user_id, data) VALUES (?, ?)",
+            (user_id, json.dumps(data))
+        )
+
+    def delete_pending_product(self, user_id: int):
+        self._submit("DELETE FROM pending_products WHERE user_id = ?", (user_id,))
+
+    def put_product(self, product: "Product"):
+        self._submit(
+            "INSERT OR REPLACE INTO products (product_id, guild_id, name, price_cents, image_urls) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (product.product_id, product.guild_id, product.name, product.price_cents, json.dumps(product.image_urls))
+        )
+
+    def delete_product(self, product_id: int):
+        self._submit("DELETE FROM products WHERE product_id = ?", (product_id,))
+
+    def put_timer(self, key: str, due: float, action: str, payload: dict):
+        self._submit(
+            "INSERT OR REPLACE INTO timers (key, due, action, payload) VALUES (?, ?, ?, ?)",
+            (key, due, action, json.dumps(payload))
+        )
+
+    def delete_timer(self, key: str):
+        self._submit("DELETE FROM timers WHERE key = ?", (key,))
+
+    def put_poll(self, poll: "Poll"):
+        self._submit(
+            "INSERT OR REPLACE INTO polls (message_id, channel_id, question, author, options, closes_at, closed) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (poll.message_id, poll.channel_id, poll.question, poll.author, json.dumps(poll.options),
+             poll.closes_at, int(poll.closed))
+        )
+
+    def put_poll_vote(self, message_id: int, user_id: int, option: int):
+        self._submit(
+            "INSERT OR REPLACE INTO poll_votes (message_id, user_id, option) VALUES (?, ?, ?)",
+            (message_id, user_id, option)
+        )
+
+    def delete_poll_vote(self, message_id: int, user_id: int):
+        self._submit("DELETE FROM poll_votes WHERE message_id = ? AND user_id = ?", (message_id, user_id))
+
+    def delete_poll(self, message_id: int):
+        self._submit("DELETE FROM poll_votes WHERE message_id = ?", (message_id,))
+        self._submit("DELETE FROM polls WHERE message_id = ?", (message_id,))
+
+    def put_wishlist_item(self, user_id: int, product_id: int, added_at: float):
+        self._submit(
+            "INSERT OR IGNORE INTO wishlist (user_id, product_id, added_at) VALUES (?, ?, ?)",
+            (user_id, product_id, added_at)
+        )
+
+    def put_image_hash(self, url: str, sha256: str):
+        self._submit("INSERT OR REPLACE INTO image_cache (url, sha256) VALUES (?, ?)", (url, sha256))
+
+    def put_import_checkpoint(self, row_hash: str, thread_id):
+        self._submit(
+            "INSERT OR REPLACE INTO import_checkpoints (row_hash, thread_id) VALUES (?, ?)",
+            (row_hash, thread_id)
+        )
+
+    def load_import_checkpoints(self) -> dict:
+        return dict(self.conn.execute("SELECT row_hash, thread_id FROM import_checkpoints"))
+
+    def put_command_hash(self, scope: str, digest: str):
+        self._submit("INSERT OR REPLACE INTO command_sync (scope, hash) VALUES (?, ?)", (scope, digest))
+
+    # --- writer ---
+
+    def _write_batch(self, batch: list):
+        with self.conn:
+            for sql, params in batch:
+                self.conn.execute(sql, params)
+
+    def flush(self):
+        """
+        Synchronously write everything still queued (shutdown path).
+        """
+        batch, self._pending = self._pending, []
+        if batch:
+            self._write_batch(batch)
+
+    async def run(self):
+        while True:
+            await self._wakeup.wait()
+            # Let a burst of mutations pile up so they share one commit
+            await asyncio.sleep(STATE_GROUP_COMMIT_WINDOW)
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            if not batch:
+                continue
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                print(f"[state store] failed to write {len(batch)} mutations: {e}")
+
+    # --- rehydration ---
+
+    def load_into(self, registry_for) -> int:
+        """
+        Restore carts into registry_for(guild_id). Returns the number of cart items.
+        """
+        items_by_cart = {}
+        for guild_id, user_id, product_id, title, price_cents, image_url in self.conn.execute(
+            "SELECT guild_id, user_id, product_id, title, price_cents, image_url FROM cart_items ORDER BY rowid"
+        ):
+            items_by_cart.setdefault((guild_id, user_id), []).append(CartItem(product_id, title, price_cents, image_url))
+
+        cart_rows = {
+            (guild_id, user_id): (channel_id, summary_message_id)
+            for guild_id, user_id, channel_id, summary_message_id in self.conn.execute(
+                "SELECT guild_id, user_id, channel_id, summary_message_id FROM carts"
+            )
+        }
+        for guild_id, user_id in cart_rows.keys() | items_by_cart.keys():
+            channel_id, summary_message_id = cart_rows.get((guild_id, user_id), (None, None))
+            registry_for(guild_id).restore(
+                user_id, channel_id, summary_message_id, items_by_cart.get((guild_id, user_id), [])
+            )
+
+        return sum(len(items) for items in items_by_cart.values())
+
+    def load_guild_configs(self) -> list:
+        return [
+            GuildConfig(*row)
+            for row in self.conn.execute(
+                "SELECT guild_id, ticket_category_id, cart_category_id, receipt_category_id, "
+                "orders_category_id, log_channel_id FROM guild_config"
+            )
+        ]
+
+    def load_products(self) -> list:
+        return [
+            Product(product_id, guild_id, name, price_cents, json.loads(image_urls))
+            for product_id, guild_id, name, price_cents, image_urls in self.conn.execute(
+                "SELECT product_id, guild_id, name, price_cents, image_urls FROM products"
+            )
+        ]
+
+    def load_pending_products(self) -> list:
+        return [
+            (user_id, json.loads(data))
+            for user_id, data in self.conn.execute("SELECT user_id, data FROM pending_products")
+        ]
+
+    def load_polls(self) -> list:
+        """
+        Open polls as (Poll, {user_id: option}).
+        """
+        open_polls = {
+            message_id: Poll(message_id, channel_id, question, author, json.loads(options), closes_at)
+            for message_id, channel_id, question, author, options, closes_at in self.conn.execute(
+                "SELECT message_id, channel_id, question, author, options, closes_at FROM polls WHERE closed = 0"
+            )
+        }
+        votes = {message_id: {} for message_id in open_polls}
+        for message_id, user_id, option in self.conn.execute("SELECT message_id, user_id, option FROM poll_votes"):
+            if message_id in votes:
+                votes[message_id][user_id] = option
+        return [(poll, votes[message_id]) for message_id, poll in open_polls.items()]
+
+    def load_wishlists(self) -> list:
+        return self.conn.execute("SELECT user_id, product_id FROM wishlist ORDER BY added_at").fetchall()
+
+    def load_image_hashes(self) -> dict:
+        return dict(self.conn.execute("SELECT url, sha256 FROM image_cache"))
+
+    def load_command_hashes(self) -> dict:
+        return dict(self.conn.execute("SELECT scope, hash FROM command_sync"))
+
+    def load_timers(self) -> list:
+        return [
+            (key, due, action, json.loads(payload))
+            for key, due, action, payload in self.conn.execute("SELECT key, due, action, payload FROM timers")
+        ]
+
+
+state_store = StateStore(STATE_DB_PATH)
+
+# Guild ID -> that guild's CartRegistry
+cart_registries = {}
+
+
+def carts_for(guild_id: int) -> CartRegistry:
+    registry = cart_registries.get(guild_id)
+    if registry is None:
+        registry = cart_registries[guild_id] = CartRegistry(state_store, guild_id)
+    return registry
+
+
+# -------------------------
+# Guild config
+# -------------------------
+
+class GuildConfig:
+    __slots__ = ("guild_id", "ticket_category_id", "cart_category_id", "receipt_category_id",
+                 "orders_category_id", "log_channel_id")
+
+    def __init__(self, guild_id: int, ticket_category_id=None, cart_category_id=None, receipt_category_id=None,
+                 orders_category_id=None, log_channel_id=None):
+        self.guild_id = guild_id
+        self.ticket_category_id = ticket_category_id
+        self.cart_category_id = cart_category_id
+        self.receipt_category_id = receipt_category_id
+        self.orders_category_id = orders_category_id
+        self.log_channel_id = log_channel_id
+
+
+class GuildConfigCache:
+    """
+    Per-guild categories and log channel, read from the state store once at
+    startup. Guilds that were never configured get an empty config (channels
+    are created outside any category and nothing is logged); the original
+    storefront falls back to the IDs hard-coded at the top of this file.
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self._configs = {}  # guild_id -> GuildConfig
+
+    def load(self) -> int:
+        for config in self.store.load_guild_configs():
+            self._configs[config.guild_id] = config
+        return len(self._configs)
+
+    def get(self, guild_id: int) -> GuildConfig:
+        config = self._configs.get(guild_id)
+        if config is None:
+            if guild_id == DEFAULT_GUILD_ID:
+                config = GuildConfig(guild_id, TICKET_CATEGORY_ID, CART_CATEGORY_ID, RECEIPT_CATEGORY_ID,
+                                     ORDERS_CATEGORY_ID, LOG_CHANNEL_ID)
+            else:
+                config = GuildConfig(guild_id)
+            self._configs[guild_id] = config
+        return config
+
+    def update(self, guild_id: int, **fields) -> GuildConfig:
+        config = self.get(guild_id)
+        for field, value in fields.items():
+            setattr(config, field, value)
+        self.store.put_guild_config(config)
+        return config
+
+
+guild_configs = GuildConfigCache(state_store)
+
+
+def log_channel_for(guild: discord.Guild):
+    return guild.get_channel(guild_configs.get(guild.id).log_channel_id)
+
+
+# -------------------------
+# Keyed locks / single-flight
+# -------------------------
+
+class KeyedLocks:
+    """
+    One asyncio.Lock per key (e.g. a user's cart), created on first use:
+
+        async with cart_locks.lock(key):
+            ...
+
+    The table holds locks weakly: the `async with` keeps its lock alive, and
+    once nobody holds or waits on it the entry disappears, so per-user keys
+    never pile up.
+    """
+
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()  # key -> asyncio.Lock
+        self.acquired = 0
+        self.contended = 0  # acquisitions that had to wait
+
+    def lock(self, key) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self.acquired += 1
+        if lock.locked():
+            self.contended += 1
+        return lock
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution: the first caller
+    runs it inline, later callers await its result (or exception) through a
+    future. Nothing is cached once it finishes. If the first caller is
+    cancelled, the callers waiting on it are cancelled too.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}  # key -> asyncio.Future
+        self.calls = 0
+        self.merged = 0     # calls that joined a flight already in progress
+
+    async def do(self, key, fn, *args):
+        """
+        (result, shared): shared is True if this call joined another's flight.
+        """
+        self.calls += 1
+        future = self._flights.get(key)
+        if future is not None:
+            self.merged += 1
+            # Shielded: one waiter giving up must not cancel it for the rest
+            return await asyncio.shield(future), True
+
+        future = self._flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn(*args)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved, nobody may be waiting
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._flights[key]
+
+    def __len__(self):
+        return len(self._flights)
+
+
+cart_locks = KeyedLocks()
+cart_channel_flight = SingleFlight("cart_channel")
+ticket_channel_flight = SingleFlight("ticket_channel")
+
+
+# -------------------------
+# Shared state backends
+# -------------------------
+
+class StateBackend(abc.ABC):
+    """
+    Where carts and cart channels live. Every method is a coroutine and every
+    cart operation is atomic on its own, so several bot processes (one per
+    shard range) can point at the same backend without losing updates.
+
+    Leases are named, expiring locks: a holder that crashes loses its lease
+    after `ttl` seconds instead of blocking everyone forever.
+    """
+
+    # --- items ---
+
+    @abc.abstractmethod
+    async def add_item(self, guild_id: int, user_id: int, item: CartItem) -> bool:
+        """
+        False if an item with the same title or product is already in the cart.
+        """
+
+    @abc.abstractmethod
+    async def remove_item(self, guild_id: int, user_id: int, product_id: int) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def items(self, guild_id: int, user_id: int) -> list:
+        ...
+
+    @abc.abstractmethod
+    async def summary(self, guild_id: int, user_id: int):
+        """
+        (item count, total in cents) for the user's cart.
+        """
+
+    @abc.abstractmethod
+    async def summary_message_of(self, guild_id: int, user_id: int):
+        ...
+
+    @abc.abstractmethod
+    async def set_summary_message(self, guild_id: int, user_id: int, message_id: int):
+        ...
+
+    # --- channels ---
+
+    @abc.abstractmethod
+    async def channel_of(self, guild_id: int, user_id: int):
+        ...
+
+    @abc.abstractmethod
+    async def owner_of(self, guild_id: int, channel_id: int):
+        ...
+
+    @abc.abstractmethod
+    async def set_channel(self, guild_id: int, user_id: int, channel_id: int):
+        ...
+
+    # --- teardown ---
+
+    @abc.abstractmethod
+    async def clear(self, guild_id: int, user_id: int):
+        ...
+
+    async def forget_channel(self, guild_id: int, channel_id: int):
+        """
+        Cart channel was deleted: drop the owner's cart with it.
+        """
+        owner_id = await self.owner_of(guild_id, channel_id)
+        if owner_id is not None:
+            await self.clear(guild_id, owner_id)
+
+    # --- leases ---
+
+    @abc.abstractmethod
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def release_lease(self, name: str, holder: str):
+        """
+        Release the lease if `holder` still owns it (it may have expired and moved on).
+        """
+
+    async def close(self):
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """
+    Single process: the per-guild CartRegistry objects, journaled to the
+    local StateStore. The default, and the fastest.
+    """
+
+    def __init__(self):
+        self._leases = {}  # name -> (holder, expires_at)
+
+    async def add_item(self, guild_id, user_id, item):
+        return carts_for(guild_id).add_item(user_id, item)
+
+    async def remove_item(self, guild_id, user_id, product_id):
+        return carts_for(guild_id).remove_item(user_id, product_id)
+
+    async def items(self, guild_id, user_id):
+        return carts_for(guild_id).items(user_id)
+
+    async def summary(self, guild_id, user_id):
+        return carts_for(guild_id).summary(user_id)
+
+    async def summary_message_of(self, guild_id, user_id):
+        return carts_for(guild_id).summary_message_of(user_id)
+
+    async def set_summary_message(self, guild_id, user_id, message_id):
+        carts_for(guild_id).set_summary_message(user_id, message_id)
+
+    async def channel_of(self, guild_id, user_id):
+        return carts_for(guild_id).channel_of(user_id)
+
+    async def owner_of(self, guild_id, channel_id):
+        return carts_for(guild_id).owner_of(channel_id)
+
+    async def set_channel(self, guild_id, user_id, channel_id):
+        carts_for(guild_id).set_channel(user_id, channel_id)
+
+    async def clear(self, guild_id, user_id):
+        carts_for(guild_id).clear(user_id)
+
+    async def forget_channel(self, guild_id, channel_id):
+        carts_for(guild_id).forget_channel(channel_id)
+
+    async def acquire_lease(self, name, holder, ttl):
+        now = time.monotonic()
+        current = self._leases.get(name)
+        if current is not None and current[0] != holder and current[1] > now:
+            return False
+        self._leases[name] = (holder, now + ttl)
+        return True
+
+    async def release_lease(self, name, holder):
+        current = self._leases.get(name)
+        if current is not None and current[0] == holder:
+            del self._leases[name]
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    Several processes on one host sharing a SQLite (WAL) file. Each operation
+    is a single statement or an IMMEDIATE transaction, run off the event loop.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS shared_carts (
+            guild_id           INTEGER NOT NULL,
+            user_id            INTEGER NOT NULL,
+            channel_id         INTEGER,
+            summary_message_id INTEGER,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS shared_carts_channel ON shared_carts (guild_id, channel_id);
+        CREATE TABLE IF NOT EXISTS shared_cart_items (
+            guild_id    INTEGER NOT NULL,
+            user_id     INTEGER NOT NULL,
+            product_id  INTEGER NOT NULL,
+            title       TEXT    NOT NULL,
+            price_cents INTEGER NOT NULL,
+            image_url   TEXT    NOT NULL,
+            PRIMARY KEY (guild_id, user_id, product_id),
+            UNIQUE (guild_id, user_id, title)
+        );
+        CREATE TABLE IF NOT EXISTS leases (
+            name       TEXT PRIMARY KEY,
+            holder     TEXT NOT NULL,
+            expires_at REAL NOT NULL  -- unix timestamp
+        );
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()  # one statement/transaction at a time on the shared connection
+
+    def _run(self, fn, *args):
+        def locked():
+            with self._lock:
+                return fn(*args)
+        return asyncio.to_thread(locked)
+
+    def _execute(self, sql: str, params=()):
+        """
+        Number of rows changed.
+        """
+        return self._run(lambda: self.conn.execute(sql, params).rowcount)
+
+    def _query(self, sql: str, params=()):
+        return self._run(lambda: self.conn.execute(sql, params).fetchall())
+
+    def _transaction(self, fn, *args):
+        def run():
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(*args)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+        return self._run(run)
+
+    async def add_item(self, guild_id, user_id, item):
+        changed = await self._execute(
+            "INSERT OR IGNORE INTO shared_cart_items (guild_id, user_id, product_id, title, price_cents, image_url) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (guild_id, user_id, item.product_id, item.title, item.price_cents, item.image_url)
+        )
+        return changed == 1
+
+    async def remove_item(self, guild_id, user_id, product_id):
+        changed = await self._execute(
+            "DELETE FROM shared_cart_items WHERE guild_id = ? AND user_id = ? AND product_id = ?",
+            (guild_id, user_id, product_id)
+        )
+        return changed == 1
+
+    async def items(self, guild_id, user_id):
+        rows = await self._query(
+            "SELECT product_id, title, price_cents, image_url FROM shared_cart_items "
+            "WHERE guild_id = ? AND user_id = ? ORDER BY rowid",
+            (guild_id, user_id)
+        )
+        return [CartItem(*row) for row in rows]
+
+    async def summary(self, guild_id, user_id):
+        rows = await self._query(
+            "SELECT COUNT(*), COALESCE(SUM(price_cents), 0) FROM shared_cart_items WHERE guild_id = ? AND user_id = ?",
+            (guild_id, user_id)
+        )
+        return rows[0]
+
+    async def _cart_column(self, column: str, guild_id: int, user_id: int):
+        rows = await self._query(
+            f"SELECT {column} FROM shared_carts WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)
+        )
+        return rows[0][0] if rows else None
+
+    async def summary_message_of(self, guild_id, user_id):
+        return await self._cart_column("summary_message_id", guild_id, user_id)
+
+    async def set_summary_message(self, guild_id, user_id, message_id):
+        await self._execute(
+            "INSERT INTO shared_carts (guild_id, user_id, summary_message_id) VALUES (?, ?, ?) "
+            "ON CONFLICT(guild_id, user_id) DO UPDATE SET summary_message_id = excluded.summary_message_id",
+            (guild_id, user_id, message_id)
+        )
+
+    async def channel_of(self, guild_id, user_id):
+        return await self._cart_column("channel_id", guild_id, user_id)
+
+    async def owner_of(self, guild_id, channel_id):
+        rows = await self._query(
+            "SELECT user_id FROM shared_carts WHERE guild_id = ? AND channel_id = ?", (guild_id, channel_id)
+        )
+        return rows[0][0] if rows else None
+
+    async def set_channel(self, guild_id, user_id, channel_id):
+        def move():
+            # A channel belongs to one cart at a time
+            self.conn.execute(
+                "UPDATE shared_carts SET channel_id = NULL WHERE guild_id = ? AND channel_id = ? AND user_id != ?",
+                (guild_id, channel_id, user_id)
+            )
+            self.conn.execute(
+                "INSERT INTO shared_carts (guild_id, user_id, channel_id) VALUES (?, ?, ?) "
+                "ON CONFLICT(guild_id, user_id) DO UPDATE SET channel_id = excluded.channel_id",
+                (guild_id, user_id, channel_id)
+            )
+        await self._transaction(move)
+
+    async def clear(self, guild_id, user_id):
+        def clear():
+            self.conn.execute(
+                "DELETE FROM shared_cart_items WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)
+            )
+            self.conn.execute("DELETE FROM shared_carts WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+        await self._transaction(clear)
+
+    async def forget_channel(self, guild_id, channel_id):
+        def forget():
+            row = self.conn.execute(
+                "SELECT user_id FROM shared_carts WHERE guild_id = ? AND channel_id = ?", (guild_id, channel_id)
+            ).fetchone()
+            if row:
+                self.conn.execute(
+                    "DELETE FROM shared_cart_items WHERE guild_id = ? AND user_id = ?", (guild_id, row[0])
+                )
+                self.conn.execute("DELETE FROM shared_carts WHERE guild_id = ? AND user_id = ?", (guild_id, row[0]))
+        await self._transaction(forget)
+
+    async def acquire_lease(self, name, holder, ttl):
+        now = time.time()
+        changed = await self._execute(
+            "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE leases.expires_at <= ? OR leases.holder = excluded.holder",
+            (name, holder, now + ttl, now)
+        )
+        return changed == 1
+
+    async def release_lease(self, name, holder):
+        await self._execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+    async def close(self):
+        await self._run(self.conn.close)
+
+
+class RespError(Exception):
+    """
+    Error reply from a Redis-protocol server.
+    """
+
+
+class RespStateBackend(StateBackend):
+    """
+    Any server speaking the Redis protocol (RESP2): Redis, Valkey, KeyDB or a
+    local stand-in. One connection, one command in flight at a time;
+    multi-key updates are WATCH/MULTI/EXEC transactions retried on conflict.
+
+    Keys, under `prefix`:
+        cart:{guild}:{user}        hash   channel, summary, total
+        cart:{guild}:{user}:items  hash   product_id -> JSON item
+        cart:{guild}:{user}:titles hash   title -> product_id
+        owners:{guild}             hash   channel_id -> user_id
+        lease:{name}               string holder, with a TTL
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0, password: str = None,
+                 prefix: str = "melisse"):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_url(cls, url: str) -> "RespStateBackend":
+        parts = urllib.parse.urlsplit(url)
+        return cls(
+            host=parts.hostname or "localhost",
+            port=parts.port or 6379,
+            db=int(parts.path.strip("/") or 0),
+            password=parts.password,
+        )
+
+    # --- protocol ---
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._call("AUTH", self.password)
+        if self.db:
+            await self._call("SELECT", self.db)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis-protocol server closed the connection")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            length = int(rest)
+            if length == -1:
+                return None
+            replies = []
+            for _ in range(length):
+                try:
+                    replies.append(await self._read_reply())
+                except RespError as e:
+                    # Errors inside an EXEC reply belong to that command only
+                    replies.append(e)
+            return replies
+        raise ConnectionError(f"Unexpected RESP reply: {line!r}")
+
+    async def _call(self, *args):
+        """
+        Send one command and read its reply. Caller holds self._lock.
+        """
+        if self._writer is None:
+            await self._connect()
+        encoded = [str(arg).encode() for arg in args]
+        payload = b"".join(
+            [f"*{len(encoded)}\r\n".encode()]
+            + [b"$%d\r\n%s\r\n" % (len(arg), arg) for arg in encoded]
+        )
+        try:
+            self._writer.write(payload)
+            await self._writer.drain()
+            return await self._read_reply()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # Reconnect on the next command; WATCHes died with the connection
+            self._writer.close()
+            self._reader = self._writer = None
+            raise
+
+    async def command(self, *args):
+        async with self._lock:
+            return await self._call(*args)
+
+    async def transaction(self, keys: list, prepare):
+        """
+        Optimistic transaction: WATCH `keys`, let `prepare(call)` read through
+        `call` and return the commands to run (or None to abort), then EXEC.
+        Retried until no watched key changed in between. Returns EXEC's replies.
+        """
+        async with self._lock:
+            while True:
+                await self._call("WATCH", *keys)
+                commands = await prepare(self._call)
+                if commands is None:
+                    await self._call("UNWATCH")
+                    return None
+                await self._call("MULTI")
+                try:
+                    for args in commands:
+                        await self._call(*args)
+                except RespError:
+                    await self._call("DISCARD")
+                    raise
+                replies = await self._call("EXEC")
+                if replies is not None:
+                    return replies
+
+    # --- keys ---
+
+    def _cart(self, guild_id, user_id):
+        return f"{self.prefix}:cart:{guild_id}:{user_id}"
+
+    def _owners(self, guild_id):
+        return f"{self.prefix}:owners:{guild_id}"
+
+    # --- carts ---
+
+    async def add_item(self, guild_id, user_id, item):
+        cart = self._cart(guild_id, user_id)
+        value = json.dumps({
+            "title": item.title, "price_cents": item.price_cents, "image_url": item.image_url, "added_at": time.time()
+        })
+
+        async def prepare(call):
+            if await call("HEXISTS", f"{cart}:items", item.product_id) or await call("HEXISTS", f"{cart}:titles", item.title):
+                return None
+            return [
+                ("HSET", f"{cart}:items", item.product_id, value),
+                ("HSET", f"{cart}:titles", item.title, item.product_id),
+                ("HINCRBY", cart, "total", item.price_cents),
+            ]
+
+        return await self.transaction([f"{cart}:items", f"{cart}:titles"], prepare) is not None
+
+    async def remove_item(self, guild_id, user_id, product_id):
+        cart = self._cart(guild_id, user_id)
+
+        async def prepare(call):
+            raw = await call("HGET", f"{cart}:items", product_id)
+            if raw is None:
+                return None
+            item = json.loads(raw)
+            return [
+                ("HDEL", f"{cart}:items", product_id),
+                ("HDEL", f"{cart}:titles", item["title"]),
+                ("HINCRBY", cart, "total", -item["price_cents"]),
+            ]
+
+        return await self.transaction([f"{cart}:items"], prepare) is not None
+
+    async def items(self, guild_id, user_id):
+        flat = await self.command("HGETALL", f"{self._cart(guild_id, user_id)}:items")
+        rows = sorted(
+            ((json.loads(value), int(product_id)) for product_id, value in zip(flat[::2], flat[1::2])),
+            key=lambda row: row[0]["added_at"]
+        )
+        return [CartItem(product_id, item["title"], item["price_cents"], item["image_url"]) for item, product_id in rows]
+
+    async def summary(self, guild_id, user_id):
+        cart = self._cart(guild_id, user_id)
+        async with self._lock:
+            count = await self._call("HLEN", f"{cart}:items")
+            total = await self._call("HGET", cart, "total")
+        return count, int(total or 0)
+
+    async def summary_message_of(self, guild_id, user_id):
+        message_id = await self.command("HGET", self._cart(guild_id, user_id), "summary")
+        return int(message_id) if message_id else None
+
+    async def set_summary_message(self, guild_id, user_id, message_id):
+        await self.command("HSET", self._cart(guild_id, user_id), "summary", message_id)
+
+    async def channel_of(self, guild_id, user_id):
+        channel_id = await self.command("HGET", self._cart(guild_id, user_id), "channel")
+        return int(channel_id) if channel_id else None
+
+    async def owner_of(self, guild_id, channel_id):
+        owner_id = await self.command("HGET", self._owners(guild_id), channel_id)
+        return int(owner_id) if owner_id else None
+
+    async def set_channel(self, guild_id, user_id, channel_id):
+        cart, owners = self._cart(guild_id, user_id), self._owners(guild_id)
+
+        async def prepare(call):
+            commands = []
+            old_channel_id = await call("HGET", cart, "channel")
+            if old_channel_id is not None and int(old_channel_id) != channel_id:
+                commands.append(("HDEL", owners, old_channel_id))
+            old_owner_id = await call("HGET", owners, channel_id)
+            if old_owner_id is not None and int(old_owner_id) != user_id:
+                commands.append(("HDEL", self._cart(guild_id, old_owner_id), "channel"))
+            commands.append(("HSET", cart, "channel", channel_id))
+            commands.append(("HSET", owners, channel_id, user_id))
+            return commands
+
+        await self.transaction([cart, owners], prepare)
+
+    async def clear(self, guild_id, user_id):
+        cart, owners = self._cart(guild_id, user_id), self._owners(guild_id)
+
+        async def prepare(call):
+            commands = [("DEL", cart, f"{cart}:items", f"{cart}:titles")]
+            channel_id = await call("HGET", cart, "channel")
+            if channel_id is not None:
+                commands.append(("HDEL", owners, channel_id))
+            return commands
+
+        await self.transaction([cart], prepare)
+
+    # --- leases ---
+
+    async def acquire_lease(self, name, holder, ttl):
+        key = f"{self.prefix}:lease:{name}"
+        if await self.command("SET", key, holder, "NX", "PX", int(ttl * 1000)) == "OK":
+            return True
+        # Re-entrant for the same holder: extend instead
+        return await self.transaction(
+            [key],
+            lambda call: self._extend_lease(call, key, holder, ttl)
+        ) is not None
+
+    @staticmethod
+    async def _extend_lease(call, key, holder, ttl):
+        if await call("GET", key) != holder:
+            return None
+        return [("SET", key, holder, "PX", int(ttl * 1000))]
+
+    async def release_lease(self, name, holder):
+        key = f"{self.prefix}:lease:{name}"
+
+        async def prepare(call):
+            if await call("GET", key) != holder:
+                return None
+            return [("DEL", key)]
+
+        await self.transaction([key], prepare)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._reader = self._writer = None
+
+
+def make_state_backend(spec: str) -> StateBackend:
+    """
+    "memory", "sqlite:<path>" or "redis://[:password@]host[:port][/db]".
+    """
+    if spec == "memory":
+        return MemoryStateBackend()
+    if spec.startswith("sqlite:"):
+        return SQLiteStateBackend(spec.removeprefix("sqlite:") or SHARED_STATE_DB_PATH)
+    if spec.startswith("redis://"):
+        return RespStateBackend.from_url(spec)
+    raise ValueError(f"Unknown STATE_BACKEND {spec!r}")
+
+
+cart_state = make_state_backend(STATE_BACKEND)
+
+
+async def open_cart_channel(guild: discord.Guild, member: discord.Member, holder: str):
+    """
+    The member's cart channel, creating it if needed. Creation happens under a
+    lease on the cart, so two workers (or two clicks) never both create one;
+    the others wait for the mapping to appear. None if the lease holder did
+    not finish within CART_LEASE_TTL.
+    """
+    lease = f"cart-channel:{guild.id}:{member.id}"
+    deadline = time.monotonic() + CART_LEASE_TTL
+    while True:
+        channel = await _existing_cart_channel(guild, member.id)
+        if channel is not None:
+            break
+        if await cart_state.acquire_lease(lease, holder, CART_LEASE_TTL):
+            try:
+                # It may have appeared while we were waiting for the lease
+                channel = await _existing_cart_channel(guild, member.id)
+                if channel is None:
+                    overwrites = {
+                        guild.default_role: discord.PermissionOverwrite(read_messages=False),
+                        member: discord.PermissionOverwrite(read_messages=True),
+                    }
+                    channel = await mutations.create_text_channel(
+                        guild,
+                        name=f"cart-{member.name}",
+                        category=guild.get_channel(guild_configs.get(guild.id).cart_category_id),
+                        overwrites=overwrites
+                    )
+                # Map it before releasing, so waiters find it instead of creating another
+                await cart_state.set_channel(guild.id, member.id, channel.id)
+                return channel
+            finally:
+                await cart_state.release_lease(lease, holder)
+        if time.monotonic() > deadline:
+            return None
+        await asyncio.sleep(CART_LEASE_POLL)
+
+    if await cart_state.channel_of(guild.id, member.id) != channel.id:
+        await cart_state.set_channel(guild.id, member.id, channel.id)
+    return channel
+
+
+async def _existing_cart_channel(guild: discord.Guild, user_id: int):
+    # Prefer the mapping; fall back to a cart channel the user already has
+    mapped_id = await cart_state.channel_of(guild.id, user_id)
+    if mapped_id:
+        channel = guild.get_channel(mapped_id)
+        if isinstance(channel, discord.TextChannel):
+            return channel
+    return channel_index.get(guild, "cart", user_id)
+
+
+# -------------------------
+# Pending inputs
+# -------------------------
+
+class PendingInput:
+    __slots__ = ("kind", "expires_at", "data", "future")
+
+    def __init__(self, kind: str, expires_at: float, data: dict = None, future: asyncio.Future = None):
+        self.kind = kind              # "product" or "receipt"
+        self.expires_at = expires_at  # unix timestamp
+        self.data = data
+        self.future = future          # resolved with the message (receipt flow)
+
+
+class PendingInputs:
+    """
+    Flows waiting for a user to post an attachment, keyed by (user_id,
+    channel_id), so on_message finds the waiter with one dict lookup instead
+    of discord.py running a check closure per bot.wait_for listener.
+
+    Entries expire after their TTL; an expiry min-heap is drained lazily
+    whenever the registry is touched. Product entries are mirrored into the
+    state store so an admin can still finish posting after a restart.
+    """
+
+    # What a receipt wait returns when a newer click in the same channel replaced it
+    SUPERSEDED = object()
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self._entries = {}  # (user_id, channel_id) -> PendingInput
+        self._heap = []     # (expires_at, key)
+
+    def load(self) -> int:
+        now = time.time()
+        for user_id, data in self.store.load_pending_products():
+            if data["expires_at"] <= now:
+                self.store.delete_pending_product(user_id)
+                continue
+            self._put((user_id, data["channel_id"]), PendingInput("product", data["expires_at"], data))
+        return len(self._entries)
+
+    def _put(self, key: tuple, entry: PendingInput):
+        previous = self._entries.get(key)
+        if previous is not None:
+            if previous.kind == "product":
+                self.store.delete_pending_product(key[0])
+            if previous.future is not None and not previous.future.done():
+                previous.future.set_result(self.SUPERSEDED)
+        self._entries[key] = entry
+        heapq.heappush(self._heap, (entry.expires_at, key))
+
+    def _evict_expired(self):
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at != expires_at:
+                continue  # already taken or replaced
+            self._drop(key, entry)
+
+    def _drop(self, key: tuple, entry: PendingInput):
+        del self._entries[key]
+        if entry.kind == "product":
+            self.store.delete_pending_product(key[0])
+        if entry.future is not None and not entry.future.done():
+            entry.future.set_result(None)
+
+    def expect_product(self, user_id: int, channel_id: int, data: dict):
+        # pending_products is keyed by user, so a new modal replaces any other channel's entry
+        for key in [k for k, e in self._entries.items() if k[0] == user_id and e.kind == "product"]:
+            self._drop(key, self._entries[key])
+        self._evict_expired()
+        data = dict(data, channel_id=channel_id, expires_at=time.time() + PENDING_PRODUCT_TTL)
+        self._put((user_id, channel_id), PendingInput("product", data["expires_at"], data))
+        self.store.put_pending_product(user_id, data)
+
+    async def wait_for_receipt(self, user_id: int, channel_id: int):
+        """
+        The user's next message with attachments in the channel, None on
+        timeout, or SUPERSEDED when a newer click replaced this one.
+        """
+        self._evict_expired()
+        key = (user_id, channel_id)
+        entry = PendingInput(
+            "receipt", time.time() + PENDING_RECEIPT_TTL, future=asyncio.get_running_loop().create_future()
+        )
+        self._put(key, entry)
+        try:
+            return await asyncio.wait_for(entry.future, PENDING_RECEIPT_TTL)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if self._entries.get(key) is entry:
+                self._drop(key, entry)
+
+    def dispatch(self, message: discord.Message):
+        """
+        Hand the message to whatever is waiting on its author in its channel.
+        Returns the product data if a product flow consumed it.
+        """
+        self._evict_expired()
+        key = (message.author.id, message.channel.id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.kind == "receipt":
+            if message.attachments:  # keep waiting through plain chatter
+                entry.future.set_result(message)
+                self._drop(key, entry)
+            return None
+        self._drop(key, entry)
+        return entry.data
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+pending_inputs = PendingInputs(state_store)
+
+
+# -------------------------
+# Guild mutation queue
+# -------------------------
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: int, per: float):
+        self.capacity = capacity
+        self.rate = capacity / per
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """
+        Seconds until a token is available (0 if one is available now).
+        """
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class MutationJob:
+    __slots__ = ("route", "fn", "args", "future", "enqueued_at", "rest_calls")
+
+    def __init__(self, route: tuple, fn, args: tuple):
+        self.route = route
+        self.fn = fn
+        self.args = args
+        # Attribute the REST call to the handler that queued it
+        self.rest_calls = _rest_calls.get()
+        self.future = asyncio.get_running_loop().create_future()
+        # Fire-and-forget callers never look at the result; don't warn about it
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.enqueued_at = time.monotonic()
+
+
+class GuildMutationQueue:
+    """
+    Central queue for channel create / rename / delete calls.
+
+    Jobs are grouped by route (kind + guild or channel ID). Each route has its
+    own token bucket and runs one job at a time; a route only becomes ready for
+    the worker pool once its bucket has a token, so a channel waiting out the
+    rename limit never blocks a worker. Pending renames of the same channel are
+    coalesced into the final name. Callers get a future and can choose not to
+    wait on it.
+    """
+
+    def __init__(self, concurrency: int = MUTATION_CONCURRENCY):
+        self.concurrency = concurrency
+        self._routes = {}           # route -> deque[MutationJob]
+        self._buckets = {}          # route -> TokenBucket
+        self._scheduled = set()     # routes queued/timed for the workers or in flight
+        self._ready = asyncio.Queue()
+        self._pending_renames = {}  # channel_id -> MutationJob not yet started
+        self.depth = 0
+        self.completed = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def start(self):
+        for _ in range(self.concurrency):
+            asyncio.create_task(self._worker())
+
+    # --- submission ---
+
+    def _submit(self, kind: str, scope_id: int, fn, *args) -> MutationJob:
+        route = (kind, scope_id)
+        job = MutationJob(route, fn, args)
+        self._routes.setdefault(route, deque()).append(job)
+        self.depth += 1
+        if route not in self._scheduled:
+            self._schedule(route)
+        return job
+
+    def _schedule(self, route: tuple):
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            bucket = self._buckets[route] = TokenBucket(*MUTATION_ROUTE_LIMITS[route[0]])
+        self._scheduled.add(route)
+        delay = bucket.delay()
+        if delay:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, route)
+        else:
+            self._ready.put_nowait(route)
+
+    def create_text_channel(self, guild: discord.Guild, **kwargs) -> asyncio.Future:
+        async def create():
+            channel = await guild.create_text_channel(**kwargs)
+            # Index now rather than waiting for the gateway create event
+            channel_index.add(channel)
+            return channel
+
+        return self._submit("channel_create", guild.id, create).future
+
+    def rename(self, channel: discord.abc.GuildChannel, name: str) -> asyncio.Future:
+        job = self._pending_renames.get(channel.id)
+        if job is not None:
+            # Not started yet: just make it use the newest name
+            job.args = (name,)
+            self.coalesced += 1
+            return job.future
+
+        async def apply(new_name: str):
+            # A rename coalesced back to the current name costs nothing
+            if channel.name != new_name:
+                await channel.edit(name=new_name)
+
+        job = self._submit("channel_rename", channel.id, apply, name)
+        self._pending_renames[channel.id] = job
+        return job.future
+
+    def delete(self, channel: discord.abc.GuildChannel) -> asyncio.Future:
+        return self._submit("channel_delete", channel.guild.id, channel.delete).future
+
+    def create_thread(self, forum: discord.ForumChannel, **kwargs) -> asyncio.Future:
+        return self._submit("thread_create", forum.guild.id, functools.partial(forum.create_thread, **kwargs)).future
+
+    # --- workers ---
+
+    async def _worker(self):
+        while True:
+            route = await self._ready.get()
+            jobs = self._routes.get(route)
+            if not jobs:
+                self._scheduled.discard(route)
+                continue
+            job = jobs.popleft()
+            if job.route[0] == "channel_rename":
+                self._pending_renames.pop(job.route[1], None)
+            self.depth -= 1
+            waited = time.monotonic() - job.enqueued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self._buckets[route].take()
+
+            token = _rest_calls.set(job.rest_calls)
+            try:
+                result = await job.fn(*job.args)
+                self.completed += 1
+                # The caller may have stopped waiting (cancelled its future)
+                if not job.future.done():
+                    job.future.set_result(result)
+            except BaseException as e:
+                self.failed += 1
+                print(f"[mutations] {route[0]} {route[1]} failed: {e!r}")
+                if job.future.done():
+                    pass
+                elif isinstance(e, asyncio.CancelledError):
+                    job.future.cancel()
+                else:
+                    job.future.set_exception(e)
+                    job.future.exception()  # mark retrieved, fire-and-forget callers never await it
+                # Only stop if this worker itself is being cancelled, not because a job raised CancelledError
+                if isinstance(e, asyncio.CancelledError) and asyncio.current_task().cancelling():
+                    raise
+            finally:
+                _rest_calls.reset(token)
+                # Always hand the route back, so one bad job can't stall the jobs queued behind it
+                self._release(route, jobs)
+
+    def _release(self, route: tuple, jobs: deque):
+        if jobs:
+            self._schedule(route)
+        else:
+            self._routes.pop(route, None)
+            self._scheduled.discard(route)
+            if self._buckets[route].is_full():
+                del self._buckets[route]
+            elif len(self._buckets) > 4096:
+                self._prune_buckets()
+
+    def _prune_buckets(self):
+        for route in [r for r, b in self._buckets.items() if r not in self._routes and b.is_full()]:
+            del self._buckets[route]
+
+    def stats(self) -> dict:
+        started = self.completed + self.failed
+        return {
+            "depth": self.depth,
+            "completed": self.completed,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "wait_avg": self.wait_total / started if started else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+
+mutations = GuildMutationQueue()
+
+
+# -------------------------
+# Channel index
+# -------------------------
+
+class ChannelIndex:
+    """
+    (guild, channel prefix, owner user ID) -> channel ID for the bot's
+    per-user channels, so lookups don't scan guild.text_channels.
+
+    The prefix comes from the channel name (`closed-ticket-alice` ->
+    'closed-ticket'); the owner is the member granted read access in the
+    channel's permission overwrites, so renamed users still resolve.
+    """
+
+    # Longest first so 'closed-ticket' wins over 'ticket'
+    PREFIXES = ("closed-ticket", "✅-receipt", "✅-order", "receipt", "ticket", "order", "cart")
+
+    def __init__(self):
+        self._channels = {}  # guild_id -> {(prefix, owner_id): channel_id}
+        self._keys = {}      # channel_id -> (guild_id, prefix, owner_id)
+
+    @classmethod
+    def key_for(cls, channel: discord.abc.GuildChannel):
+        if not isinstance(channel, discord.TextChannel):
+            return None
+        prefix = next((p for p in cls.PREFIXES if channel.name.startswith(f"{p}-")), None)
+        if prefix is None:
+            return None
+        for target, overwrite in channel.overwrites.items():
+            if isinstance(target, discord.Role) or getattr(target, "type", None) is discord.Role:
+                continue
+            if overwrite.read_messages:
+                return (channel.guild.id, prefix, target.id)
+        return None
+
+    def add(self, channel: discord.abc.GuildChannel):
+        key = self.key_for(channel)
+        if key is None:
+            return
+        self._channels.setdefault(key[0], {})[key[1:]] = channel.id
+        self._keys[channel.id] = key
+
+    def remove(self, channel: discord.abc.GuildChannel):
+        key = self._keys.pop(channel.id, None)
+        if key is None:
+            return
+        channels = self._channels.get(key[0], {})
+        if channels.get(key[1:]) == channel.id:
+            del channels[key[1:]]
+
+    def update(self, channel: discord.abc.GuildChannel):
+        self.remove(channel)
+        self.add(channel)
+
+    def forget_guild(self, guild_id: int):
+        for channel_id in self._channels.pop(guild_id, {}).values():
+            self._keys.pop(channel_id, None)
+
+    def rebuild_guild(self, guild: discord.Guild):
+        """
+        Re-index one guild (it became available, e.g. its shard reconnected).
+        """
+        self.forget_guild(guild.id)
+        for channel in guild.text_channels:
+            self.add(channel)
+
+    def get(self, guild: discord.Guild, prefix: str, owner_id: int):
+        channel_id = self._channels.get(guild.id, {}).get((prefix, owner_id))
+        return guild.get_channel(channel_id) if channel_id else None
+
+    def __len__(self):
+        return sum(len(channels) for channels in self._channels.values())
+
+
+channel_index = ChannelIndex()
+
+
+# -------------------------
+# Product catalog
+# -------------------------
+
+class Product:
+    __slots__ = ("product_id", "guild_id", "name", "price_cents", "image_urls")
+
+    def __init__(self, product_id: int, guild_id: int, name: str, price_cents: int, image_urls: list):
+        self.product_id = product_id
+        self.guild_id = guild_id
+        self.name = name
+        self.price_cents = price_cents
+        self.image_urls = image_urls
+
+    @property
+    def jump_url(self) -> str:
+        return f"https://discord.com/channels/{self.guild_id}/{self.product_id}"
+
+
+class ProductCatalog:
+    """
+    Posted products keyed by forum thread ID (which is also the ID of the
+    thread's starter message), so button clicks are a dict lookup instead of
+    re-parsing message content.
+
+    Products are recorded when posted and persisted in the state store.
+    Threads the bot posted before the catalog existed are picked up once at
+    startup (warm) or lazily on first click (resolve).
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self._products = {}  # thread_id -> Product
+        self.warmed = False
+
+    def load(self) -> int:
+        for product in self.store.load_products():
+            self._products[product.product_id] = product
+        return len(self._products)
+
+    def get(self, product_id: int):
+        return self._products.get(product_id)
+
+    def add(self, product: Product):
+        self._products[product.product_id] = product
+        self.store.put_product(product)
+
+    def remove(self, product_id: int):
+        if self._products.pop(product_id, None) is not None:
+            self.store.delete_product(product_id)
+
+    def rename(self, product_id: int, name: str):
+        product = self._products.get(product_id)
+        if product is not None and product.name != name:
+            product.name = name
+            self.store.put_product(product)
+
+    @staticmethod
+    def from_starter_message(thread: discord.Thread, message: discord.Message):
+        """
+        Parse a legacy '<name> - $<price>' product post.
+        """
+        name, sep, price = (message.content or "").rpartition(" - $")
+        if not sep:
+            return None
+        try:
+            price_cents = parse_price_to_cents(price)
+        except ValueError:
+            return None
+        return Product(thread.id, thread.guild.id, name, price_cents, [a.url for a in message.attachments])
+
+    async def _index_thread(self, thread: discord.Thread):
+        try:
+            message = thread.starter_message or await thread.fetch_message(thread.id)
+        except discord.HTTPException:
+            return None
+        product = self.from_starter_message(thread, message)
+        if product is not None:
+            self.add(product)
+        return product
+
+    async def resolve(self, channel):
+        """
+        Product for the thread a button lives in; indexes unknown threads once.
+        """
+        product = self._products.get(channel.id)
+        if product is None and isinstance(channel, discord.Thread) and isinstance(channel.parent, discord.ForumChannel):
+            product = await self._index_thread(channel)
+        return product
+
+    async def warm(self, guilds):
+        """
+        Index every bot-posted forum thread not yet in the catalog.
+        """
+        self.warmed = True
+        semaphore = asyncio.Semaphore(CATALOG_WARM_CONCURRENCY)
+        started = time.perf_counter()
+        indexed = 0
+
+        async def index(thread: discord.Thread):
+            nonlocal indexed
+            async with semaphore:
+                if await self._index_thread(thread) is not None:
+                    indexed += 1
+
+        tasks = []
+        for guild in guilds:
+            for forum in guild.forums:
+                threads = list(forum.threads)
+                try:
+                    threads += [t async for t in forum.archived_threads(limit=None)]
+                except discord.HTTPException as e:
+                    print(f"[catalog] could not list archived threads in {forum.name}: {e}")
+                tasks += [
+                    index(t) for t in threads
+                    if t.owner_id == bot.user.id and t.id not in self._products
+                ]
+        await asyncio.gather(*tasks)
+        print(f"🛍️ Catalog warmed: {indexed} new products in {time.perf_counter() - started:.1f}s ({len(self._products)} total)")
+
+
+product_catalog = ProductCatalog(state_store)
+
+
+# -------------------------
+# Attachment pipeline
+# -------------------------
+
+class AttachmentPipeline:
+    """
+    Downloads images for re-upload without holding whole files in memory.
+
+    Each download is streamed in chunks into a SpooledTemporaryFile (spills
+    to disk past ATTACHMENT_SPOOL_MAX) while being hashed, with at most
+    ATTACHMENT_DOWNLOAD_CONCURRENCY downloads running at once. Content is
+    then stored in IMAGE_CACHE_DIR under its sha256, and the URL -> hash
+    mapping is persisted, so a URL that was already posted is uploaded
+    straight from the cache without downloading it again.
+    """
+
+    def __init__(self, store: StateStore, cache_dir: str):
+        self.store = store
+        self.cache_dir = cache_dir
+        self._hashes = {}    # url (no query string) -> sha256
+        self._inflight = {}  # url -> future resolved once its download is cached
+        self._semaphore = asyncio.Semaphore(ATTACHMENT_DOWNLOAD_CONCURRENCY)
+        self._session = None
+        self.downloads = 0
+        self.cache_hits = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def load(self) -> int:
+        self._hashes.update(self.store.load_image_hashes())
+        return len(self._hashes)
+
+    @staticmethod
+    def _key(url: str) -> str:
+        # Discord CDN links carry expiring signature parameters
+        return url.split("?", 1)[0]
+
+    def _path(self, sha256: str) -> str:
+        return os.path.join(self.cache_dir, sha256)
+
+    async def _download(self, url: str):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        spool = tempfile.SpooledTemporaryFile(max_size=ATTACHMENT_SPOOL_MAX)
+        digest = hashlib.sha256()
+        try:
+            async with self._session.get(url) as resp:
+                resp.raise_for_status()
+                async for chunk in resp.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                    digest.update(chunk)
+                    spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+        self.downloads += 1
+        return spool, digest.hexdigest()
+
+    def _cache(self, spool, sha256: str):
+        path = self._path(sha256)
+        if not os.path.exists(path):
+            spool.seek(0)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(spool, f, ATTACHMENT_CHUNK_SIZE)
+            os.replace(tmp_path, path)
+            self._evict()
+        spool.seek(0)
+
+    def _evict(self):
+        entries = [e for e in os.scandir(self.cache_dir) if e.is_file() and not e.name.endswith(".tmp")]
+        total = sum(e.stat().st_size for e in entries)
+        # Oldest first; cached files are touched whenever they are reused
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            if total <= IMAGE_CACHE_MAX_BYTES:
+                break
+            total -= entry.stat().st_size
+            os.remove(entry.path)
+
+    def _from_cache(self, key: str, filename: str):
+        sha256 = self._hashes.get(key)
+        if sha256 is None:
+            return None
+        path = self._path(sha256)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None  # evicted; download again
+        self.cache_hits += 1
+        return discord.File(path, filename=filename)
+
+    async def fetch(self, url: str, filename: str) -> discord.File:
+        key = self._key(url)
+        # Same URL is already downloading. If that download fails, every waiter
+        # wakes up; the first to get here retries and the rest wait on it again.
+        while (inflight := self._inflight.get(key)) is not None:
+            await asyncio.shield(inflight)
+        file = self._from_cache(key, filename)
+        if file is not None:
+            return file
+
+        done = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            async with self._semaphore:
+                spool, sha256 = await self._download(url)
+            try:
+                await asyncio.to_thread(self._cache, spool, sha256)
+            except OSError as e:
+                print(f"[attachments] could not cache {filename}: {e}")
+                spool.seek(0)
+            self._hashes[key] = sha256
+            self.store.put_image_hash(key, sha256)
+            return discord.File(spool, filename=filename)
+        finally:
+            # Waiters retry from the cache, or download again if this failed
+            if self._inflight.get(key) is done:
+                del self._inflight[key]
+            done.set_result(None)
+
+    async def fetch_all(self, sources: list) -> list:
+        """
+        discord.Files for (url, filename) pairs, downloaded concurrently and
+        returned in order. Nothing is left open if one of them fails.
+        """
+        results = await asyncio.gather(*(self.fetch(url, name) for url, name in sources), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            for r in results:
+                if isinstance(r, discord.File):
+                    r.close()
+            raise errors[0]
+        return results
+
+
+attachments = AttachmentPipeline(state_store, IMAGE_CACHE_DIR)
+
+
+# -------------------------
+# Product posting / catalog import
+# -------------------------
+
+async def publish_product(forum: discord.ForumChannel, name: str, price: str, files: list) -> Product:
+    """
+    Create the product thread (starter post with every image), record it in
+    the catalog and add the shop buttons.
+    """
+    created = await mutations.create_thread(forum, name=name, content=f"{name} - ${price}", files=files)
+    product = Product(
+        created.thread.id,
+        forum.guild.id,
+        name,
+        parse_price_to_cents(price),
+        [a.url for a in created.message.attachments]
+    )
+    product_catalog.add(product)
+    # Clicks go to the AddToCartView registered in setup_hook; a stopped copy isn't kept per message
+    view = AddToCartView()
+    view.stop()
+    await created.thread.send("Use the buttons below:", view=view)
+    return product
+
+
+class ManifestRow:
+    __slots__ = ("line", "name", "price", "forum_id", "image_urls")
+
+    def __init__(self, line: int, name: str, price: str, forum_id: int, image_urls: list):
+        self.line = line
+        self.name = name
+        self.price = price
+        self.forum_id = forum_id
+        self.image_urls = image_urls
+
+    @property
+    def row_hash(self) -> str:
+        payload = json.dumps([self.name, self.price, self.forum_id, self.image_urls])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def parse_manifest(filename: str, raw: bytes):
+    """
+    Rows of a CSV (name, price, forum_id, image_urls separated by spaces, '|'
+    or ';') or JSON (list of objects, image_urls a list or string) manifest.
+    Returns (rows, errors).
+    """
+    text = raw.decode("utf-8-sig")
+    if filename.lower().endswith(".json"):
+        records = json.loads(text)
+        if isinstance(records, dict):
+            records = records.get("products", [])
+        if not isinstance(records, list):
+            return [], ["the JSON must be a list of product objects (or {\"products\": [...]})"]
+        numbered = enumerate(records, start=1)
+    else:
+        numbered = enumerate(csv.DictReader(io.StringIO(text)), start=2)  # line 1 is the header
+
+    rows, errors = [], []
+    for line, record in numbered:
+        if not isinstance(record, dict):
+            errors.append(f"line {line}: expected an object, got {type(record).__name__}")
+            continue
+        try:
+            name = str(record.get("name") or "").strip()
+            price = str(record.get("price") or "").strip()
+            urls = record.get("image_urls") or []
+            if isinstance(urls, str):
+                urls = urls.replace("|", " ").replace(";", " ").split()
+            if not name or not price:
+                raise ValueError("name and price are required")
+            parse_price_to_cents(price)
+            if not urls:
+                raise ValueError("at least one image URL is required")
+            if len(urls) > MAX_FILES_PER_MESSAGE:
+                raise ValueError(f"at most {MAX_FILES_PER_MESSAGE} images per product")
+            rows.append(ManifestRow(line, name, price, int(record.get("forum_id")), [str(u) for u in urls]))
+        except (AttributeError, TypeError, ValueError) as e:
+            errors.append(f"line {line}: {e}")
+    return rows, errors
+
+
+class CatalogImport:
+    """
+    Posts manifest rows as products.
+
+    Up to IMPORT_CONCURRENCY rows are prepared at once (images go through
+    the attachment pipeline); thread creation goes through the guild
+    mutation queue, which keeps it within the rate limit. Every row is
+    checkpointed in the state store by content hash: in flight before the
+    thread is created, done with its thread ID after. Re-running the import
+    skips finished rows, and a row that was in flight when the bot stopped is
+    matched against the forum's threads by name instead of being posted twice.
+    """
+
+    def __init__(self, guild: discord.Guild, rows: list):
+        self.guild = guild
+        self.rows = rows
+        self.posted = 0
+        self.skipped = 0
+        self.failed = []  # "line N: error"
+        self.started = time.monotonic()
+
+    @property
+    def done(self) -> int:
+        return self.posted + self.skipped + len(self.failed)
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.posted / elapsed if elapsed > 0 else 0.0
+
+    def _adopt(self, forum: discord.ForumChannel, row: ManifestRow):
+        """
+        Thread posted by an interrupted run of this row, if any.
+        """
+        for thread in forum.threads:
+            if thread.owner_id == bot.user.id and thread.name == row.name:
+                return thread
+        return None
+
+    async def _import_row(self, row: ManifestRow, checkpoints: dict, semaphore: asyncio.Semaphore):
+        row_hash = row.row_hash
+        if checkpoints.get(row_hash):
+            self.skipped += 1
+            return
+
+        forum = self.guild.get_channel(row.forum_id)
+        if not isinstance(forum, discord.ForumChannel):
+            self.failed.append(f"line {row.line}: {row.forum_id} is not a forum channel here")
+            return
+
+        if row_hash in checkpoints:
+            thread = self._adopt(forum, row)
+            if thread is not None:
+                try:
+                    if thread.last_message_id == thread.id:  # stopped before the buttons were sent
+                        view = AddToCartView()
+                        view.stop()
+                        await thread.send("Use the buttons below:", view=view)
+                    await product_catalog.resolve(thread)
+                except Exception as e:
+                    # The checkpoint stays in flight, so the next run adopts the thread again
+                    self.failed.append(f"line {row.line}: {e}")
+                    return
+                checkpoints[row_hash] = thread.id
+                state_store.put_import_checkpoint(row_hash, thread.id)
+                self.skipped += 1
+                return
+
+        async with semaphore:
+            files = []
+            try:
+                files = await attachments.fetch_all([
+                    (url, os.path.basename(url.split("?", 1)[0]) or f"image{i}.png")
+                    for i, url in enumerate(row.image_urls)
+                ])
+                checkpoints[row_hash] = None
+                state_store.put_import_checkpoint(row_hash, None)
+                product = await publish_product(forum, row.name, row.price, files)
+            except Exception as e:
+                # An in-flight checkpoint stays: the thread may exist even though the call failed
+                self.failed.append(f"line {row.line}: {e}")
+                return
+            finally:
+                for file in files:
+                    file.close()
+
+        checkpoints[row_hash] = product.product_id
+        state_store.put_import_checkpoint(row_hash, product.product_id)
+        self.posted += 1
+
+    async def run(self, progress=None):
+        """
+        Import every row. `progress` is an async fn(import) called every
+        IMPORT_PROGRESS_INTERVAL seconds while rows are being posted.
+        """
+        checkpoints = import_checkpoints
+        semaphore = asyncio.Semaphore(IMPORT_CONCURRENCY)
+        unique = {}
+        for row in self.rows:
+            if row.row_hash in unique:
+                self.skipped += 1  # same product twice in one manifest
+            else:
+                unique[row.row_hash] = row
+        pending = {asyncio.create_task(self._import_row(row, checkpoints, semaphore)) for row in unique.values()}
+        while pending:
+            _, pending = await asyncio.wait(pending, timeout=IMPORT_PROGRESS_INTERVAL)
+            if pending and progress:
+                await progress(self)
 
-# CSV
-ORDER_CSV_PATH = "orders.csv"
 
-# In-memory cart storage
-carts = {}          # user_id -> list[discord.Embed]
-cart_channels = {}  # user_id -> channel_id
+# Manifest row hash -> thread ID (None while in flight), loaded in setup_hook
+import_checkpoints = {}
 
-# Temporary product data storage (admin posting)
-pending_products = {}
+# Guild ID -> running CatalogImport (None while its manifest is read), one per guild
+active_imports = {}
 
 
 # -------------------------
-# Helpers
+# Wishlists
+# -------------------------
+
+class WishlistDigest:
+    __slots__ = ("user", "product_ids", "message", "sent_at", "scheduled")
+
+    def __init__(self, user: discord.abc.User):
+        self.user = user
+        self.product_ids = []  # products this digest message lists
+        self.message = None
+        self.sent_at = 0.0
+        self.scheduled = False
+
+
+class Wishlists:
+    """
+    Saved products per user (insertion ordered, no duplicates), persisted in
+    the state store.
+
+    Adding a product doesn't DM right away: additions within
+    WISHLIST_DIGEST_WINDOW are flushed together, and while the last digest
+    message is recent it is edited to list the new products instead of
+    sending another DM. A burst of clicks costs one API call.
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self._items = {}    # user_id -> {product_id: None}
+        self._digests = {}  # user_id -> WishlistDigest
+
+    def load(self) -> int:
+        for user_id, product_id in self.store.load_wishlists():
+            self._items.setdefault(user_id, {})[product_id] = None
+        return sum(len(items) for items in self._items.values())
+
+    def add(self, user: discord.abc.User, product_id: int) -> bool:
+        """
+        Save a product; False if it was already on the list.
+        """
+        items = self._items.setdefault(user.id, {})
+        if product_id in items:
+            return False
+        items[product_id] = None
+        self.store.put_wishlist_item(user.id, product_id, time.time())
+        self._queue_digest(user, product_id)
+        return True
+
+    def items(self, user_id: int) -> list:
+        return list(self._items.get(user_id, ()))
+
+    # --- DM digests ---
+
+    def _queue_digest(self, user: discord.abc.User, product_id: int):
+        digest = self._digests.get(user.id)
+        if digest is None or (not digest.scheduled and time.time() - digest.sent_at > WISHLIST_DIGEST_REUSE):
+            digest = self._digests[user.id] = WishlistDigest(user)
+        digest.product_ids.append(product_id)
+        if not digest.scheduled:
+            digest.scheduled = True
+            asyncio.get_running_loop().call_later(
+                WISHLIST_DIGEST_WINDOW, lambda: spawn(self._flush(digest))
+            )
+
+    async def _flush(self, digest: WishlistDigest):
+        digest.scheduled = False
+        embed = build_wishlist_digest_embed(digest.product_ids)
+        try:
+            if digest.message is not None:
+                try:
+                    await digest.message.edit(embed=embed)
+                except discord.NotFound:
+                    digest.message = None
+            if digest.message is None:
+                digest.message = await digest.user.send(embed=embed)
+            digest.sent_at = time.time()
+        except discord.HTTPException as e:
+            print(f"[wishlist] could not DM {digest.user.id}: {e}")
+        # Forget digests nobody will edit again
+        now = time.time()
+        for user_id in [u for u, d in self._digests.items() if not d.scheduled and now - d.sent_at > WISHLIST_DIGEST_REUSE]:
+            del self._digests[user_id]
+
+
+def wishlist_line(product_id: int) -> str:
+    product = product_catalog.get(product_id)
+    if product is None:
+        return "• *(no longer available)*"
+    return f"• [{product.name}]({product.jump_url}) — {format_cents(product.price_cents)}"
+
+
+def build_wishlist_digest_embed(product_ids: list) -> discord.Embed:
+    lines = [wishlist_line(pid) for pid in product_ids]
+    if len(lines) > 20:
+        lines = lines[-20:] + [f"…and {len(lines) - 20} more"]
+    embed = discord.Embed(title="💖 Added to your wishlist", description="\n".join(lines), color=discord.Color.pink())
+    latest = product_catalog.get(product_ids[-1])
+    if latest is not None and latest.image_urls:
+        embed.set_thumbnail(url=latest.image_urls[0])
+    embed.set_footer(text="Use /wishlist to see everything you saved")
+    return embed
+
+
+def build_wishlist_page_embed(user: discord.abc.User, product_ids: list, page: int) -> discord.Embed:
+    pages = max(1, -(-len(product_ids) // WISHLIST_PAGE_SIZE))
+    start = page * WISHLIST_PAGE_SIZE
+    lines = [wishlist_line(pid) for pid in product_ids[start:start + WISHLIST_PAGE_SIZE]]
+    embed = discord.Embed(
+        title=f"💖 {user.display_name}'s Wishlist",
+        description="\n".join(lines) or "Your wishlist is empty.",
+        color=discord.Color.pink()
+    )
+    embed.set_footer(text=f"Page {page + 1}/{pages} · {len(product_ids)} items")
+    return embed
+
+
+wishlists = Wishlists(state_store)
+
+
+# -------------------------
+# Timer scheduler
 # -------------------------
 
-def parse_price_to_float(text: str) -> float:
+class TimerScheduler:
     """
-    Accepts strings like '43', '$43', '43€', '43.50€' and returns float.
+    Durable one-shot timers (channel auto-deletion etc.).
+
+    A single task sleeps until the earliest deadline of an in-memory min-heap;
+    each timer is a key, a unix deadline, an action name and a small JSON
+    payload, mirrored into the state store so pending timers resume after a
+    restart. Scheduling again under the same key replaces the timer; cancelled
+    heap entries are skipped lazily when they surface.
     """
-    if not text:
-        return 0.0
-    t = str(text).replace("€", "").replace("$", "").strip()
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self._heap = []     # (due, key)
+        self._timers = {}   # key -> (due, action, payload)
+        self._actions = {}  # action name -> async fn(payload)
+        self._wakeup = asyncio.Event()
+
+    def action(self, name: str):
+        def decorator(fn):
+            self._actions[name] = fn
+            return fn
+        return decorator
+
+    def load(self) -> int:
+        for key, due, action, payload in self.store.load_timers():
+            self._timers[key] = (due, action, payload)
+            self._heap.append((due, key))
+        heapq.heapify(self._heap)
+        return len(self._timers)
+
+    def schedule(self, key: str, delay: float, action: str, **payload):
+        due = time.time() + delay
+        self._timers[key] = (due, action, payload)
+        heapq.heappush(self._heap, (due, key))
+        self.store.put_timer(key, due, action, payload)
+        self._wakeup.set()
+
+    def cancel(self, key: str) -> bool:
+        if self._timers.pop(key, None) is None:
+            return False
+        self.store.delete_timer(key)
+        # Drop dead entries once they dominate the heap
+        if len(self._heap) > 2 * len(self._timers) + 64:
+            self._heap = [(due, k) for due, k in self._heap if self._timers.get(k, (None,))[0] == due]
+            heapq.heapify(self._heap)
+        return True
+
+    async def _fire(self, key: str, action: str, payload: dict):
+        handler = self._actions.get(action)
+        if handler is None:
+            print(f"[scheduler] no handler for {action} ({key})")
+            return
+        try:
+            await handler(payload)
+        except Exception as e:
+            print(f"[scheduler] {key} failed: {e}")
+
+    async def run(self):
+        await bot.wait_until_ready()
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                due, key = heapq.heappop(self._heap)
+                timer = self._timers.get(key)
+                if timer is None or timer[0] != due:
+                    continue  # cancelled or rescheduled
+                del self._timers[key]
+                self.store.delete_timer(key)
+                spawn(self._fire(key, timer[1], timer[2]))
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+scheduler = TimerScheduler(state_store)
+
+
+@scheduler.action("delete_channel")
+async def _delete_channel_timer(payload: dict):
+    channel = bot.get_channel(payload["channel_id"])
+    if channel is None:
+        return  # already gone
+    if payload.get("log"):
+        log_channel = log_channel_for(channel.guild)
+        if log_channel:
+            await log_channel.send(payload["log"].replace("{name}", channel.name))
+    await mutations.delete(channel)
+
+
+async def close_interaction_channel(interaction: discord.Interaction, reply: str):
+    """
+    Answer the click, then wait for the queued delete; if it fails the user
+    hears about it instead of the button just hanging.
+    """
+    await interaction.response.send_message(reply, ephemeral=True)
     try:
-        return float(t)
-    except ValueError:
-        return 0.0
+        await mutations.delete(interaction.channel)
+    except discord.NotFound:
+        pass  # already gone
+    except Exception as e:
+        print(f"Failed to delete channel {interaction.channel.name}: {e}")
+        with contextlib.suppress(discord.HTTPException):
+            await interaction.followup.send(f"❌ Couldn't delete this channel: {e}", ephemeral=True)
 
-def format_eur(value: float) -> str:
-    return f"{value:.2f}€"
 
-def clear_user_cart(user_id: int):
-    carts.pop(user_id, None)
-    cart_channels.pop(user_id, None)
+# -------------------------
+# Polls
+# -------------------------
+
+class Poll:
+    __slots__ = ("message_id", "channel_id", "question", "author", "options", "closes_at",
+                 "closed", "votes", "counts")
+
+    def __init__(self, message_id: int, channel_id: int, question: str, author: str, options: list,
+                 closes_at: float = None):
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.question = question
+        self.author = author
+        self.options = options  # option texts, POLL_EMOJIS[i] votes for options[i]
+        self.closes_at = closes_at
+        self.closed = False
+        self.votes = {}  # user_id -> option index
+        self.counts = [0] * len(options)
+
+
+def build_poll_embed(poll: Poll) -> discord.Embed:
+    total = sum(poll.counts)
+    lines = []
+    for i, (text, count) in enumerate(zip(poll.options, poll.counts)):
+        share = count / total if total else 0.0
+        bar = "▰" * round(share * 10) + "▱" * (10 - round(share * 10))
+        lines.append(f"{POLL_EMOJIS[i]} {text}\n{bar} {share:.0%} ({count})")
+
+    if poll.closed:
+        status = "🔒 Poll closed"
+    elif poll.closes_at:
+        status = f"⏳ Closes <t:{int(poll.closes_at)}:R>"
+    else:
+        status = ""
+
+    embed = discord.Embed(
+        title="🗳️ Poll",
+        description=f"**{poll.question}**\n\n" + "\n".join(lines) + (f"\n\n{status}" if status else ""),
+        color=discord.Color.dark_grey() if poll.closed else discord.Color.teal()
+    )
+    embed.set_footer(text=f"Poll by {poll.author} · {total} vote{'s' if total != 1 else ''}")
+    return embed
 
-def infer_cart_owner_id_by_channel_id(channel_id: int):
-    return next((uid for uid, cid in cart_channels.items() if cid == channel_id), None)
 
-def ensure_cart_channel_mapping_valid(guild: discord.Guild, user_id: int):
+class PollEngine:
     """
-    If we think the user has a cart channel but it was deleted, clear their cart
-    so they can add items again.
+    Live poll tallies kept from raw reaction events.
+
+    Each user has at most one vote: reacting with another option moves the
+    vote and removes the old reaction. Votes are mirrored into the state store
+    so results survive a restart without re-reading reactions from the API.
+    The embed is re-rendered at most every POLL_RENDER_INTERVAL seconds per
+    poll, however many reactions arrive in between.
     """
-    cid = cart_channels.get(user_id)
-    if not cid:
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self._polls = {}      # message_id -> Poll
+        self._dirty = set()   # message_ids with a render scheduled
+
+    def load(self) -> int:
+        for poll, votes in self.store.load_polls():
+            poll.votes = votes
+            for option in votes.values():
+                if option < len(poll.counts):
+                    poll.counts[option] += 1
+            self._polls[poll.message_id] = poll
+        return len(self._polls)
+
+    def open(self, poll: Poll):
+        self._polls[poll.message_id] = poll
+        self.store.put_poll(poll)
+        if poll.closes_at:
+            scheduler.schedule(f"poll:{poll.message_id}", poll.closes_at - time.time(), "close_poll",
+                               message_id=poll.message_id)
+
+    def _option_of(self, poll: Poll, emoji: discord.PartialEmoji):
+        try:
+            option = POLL_EMOJIS.index(str(emoji))
+        except ValueError:
+            return None
+        return option if option < len(poll.options) else None
+
+    async def on_add(self, payload: discord.RawReactionActionEvent):
+        poll = self._polls.get(payload.message_id)
+        if poll is None or poll.closed or payload.user_id == bot.user.id:
+            return
+        option = self._option_of(poll, payload.emoji)
+        if option is None:
+            return
+
+        previous = poll.votes.get(payload.user_id)
+        if previous == option:
+            return
+        poll.votes[payload.user_id] = option
+        poll.counts[option] += 1
+        self.store.put_poll_vote(poll.message_id, payload.user_id, option)
+        self._schedule_render(poll)
+
+        if previous is not None:
+            poll.counts[previous] -= 1
+            # The raw remove event this triggers no longer matches the vote, so it's ignored
+            try:
+                message = bot.get_partial_messageable(poll.channel_id).get_partial_message(poll.message_id)
+                await message.remove_reaction(POLL_EMOJIS[previous], discord.Object(id=payload.user_id))
+            except discord.HTTPException as e:
+                print(f"[polls] failed to remove old vote on {poll.message_id}: {e}")
+
+    def on_remove(self, payload: discord.RawReactionActionEvent):
+        poll = self._polls.get(payload.message_id)
+        if poll is None or poll.closed:
+            return
+        option = self._option_of(poll, payload.emoji)
+        if option is None or poll.votes.get(payload.user_id) != option:
+            return
+        del poll.votes[payload.user_id]
+        poll.counts[option] -= 1
+        self.store.delete_poll_vote(poll.message_id, payload.user_id)
+        self._schedule_render(poll)
+
+    def forget(self, message_id: int):
+        if self._polls.pop(message_id, None) is not None:
+            self.store.delete_poll(message_id)
+            scheduler.cancel(f"poll:{message_id}")
+
+    async def close(self, message_id: int):
+        poll = self._polls.pop(message_id, None)
+        if poll is None:
+            return
+        poll.closed = True
+        self.store.put_poll(poll)
+        await self._render(poll)
+
+    def _schedule_render(self, poll: Poll):
+        if poll.message_id in self._dirty:
+            return
+        self._dirty.add(poll.message_id)
+        asyncio.get_running_loop().call_later(
+            POLL_RENDER_INTERVAL, lambda: spawn(self._flush(poll))
+        )
+
+    async def _flush(self, poll: Poll):
+        self._dirty.discard(poll.message_id)
+        if not poll.closed:  # close() renders the final state itself
+            await self._render(poll)
+
+    async def _render(self, poll: Poll):
+        try:
+            message = bot.get_partial_messageable(poll.channel_id).get_partial_message(poll.message_id)
+            await message.edit(embed=build_poll_embed(poll))
+        except discord.NotFound:
+            self.forget(poll.message_id)
+        except discord.HTTPException as e:
+            print(f"[polls] failed to update {poll.message_id}: {e}")
+
+
+polls = PollEngine(state_store)
+
+
+@scheduler.action("close_poll")
+async def _close_poll_timer(payload: dict):
+    await polls.close(payload["message_id"])
+
+
+# -------------------------
+# Order ledger
+# -------------------------
+
+class OrderLedger:
+    """
+    SQLite-backed order history: one row per order and one row per line item,
+    indexed on guild + user, guild + date and product so the stats commands
+    are indexed lookups instead of full re-parses of orders.csv.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS orders (
+            id          INTEGER PRIMARY KEY,
+            guild_id    INTEGER NOT NULL,
+            user_id     INTEGER NOT NULL,
+            username    TEXT    NOT NULL,
+            created_at  TEXT    NOT NULL,  -- ISO-8601 UTC, sortable
+            channel     TEXT    NOT NULL,
+            total_cents INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_orders_guild_user ON orders(guild_id, user_id);
+        CREATE INDEX IF NOT EXISTS idx_orders_guild_date ON orders(guild_id, created_at);
+
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_id    INTEGER NOT NULL REFERENCES orders(id),
+            product     TEXT    NOT NULL,
+            price_cents INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id);
+        CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items(product);
+    """
+
+    def __init__(self, path: str):
+        # Written from the order writer thread, read from stats worker threads
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(self.SCHEMA)
+        self.lock = threading.Lock()
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM orders LIMIT 1").fetchone() is None
+
+    def record_order(self, guild_id: int, user_id: int, username: str, created_at: datetime, channel: str,
+                     items: list, commit: bool = True) -> int:
+        """
+        items: list of (product name, price in cents).
+        """
+        total_cents = sum(price for _, price in items)
+        cur = self.conn.execute(
+            "INSERT INTO orders (guild_id, user_id, username, created_at, channel, total_cents) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (guild_id, user_id, username, created_at.strftime("%Y-%m-%dT%H:%M:%S"), channel, total_cents)
+        )
+        order_id = cur.lastrowid
+        self.conn.executemany(
+            "INSERT INTO order_items (order_id, product, price_cents) VALUES (?, ?, ?)",
+            [(order_id, name, price) for name, price in items]
+        )
+        if commit:
+            self.conn.commit()
+        return order_id
+
+    def import_csv(self, path: str) -> int:
+        """
+        One-off migration of the legacy orders.csv into the ledger.
+        """
+        imported = 0
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    user_id = int(row.get("User ID") or 0)
+                    guild_id = int(row.get("Guild ID") or DEFAULT_GUILD_ID)
+                except ValueError:
+                    continue
+                try:
+                    created_at = datetime.strptime(row.get("Date") or "", ORDER_CSV_DATE_FORMAT)
+                except ValueError:
+                    created_at = datetime.fromtimestamp(0, timezone.utc)
+                self.record_order(
+                    guild_id,
+                    user_id,
+                    row.get("Username") or "",
+                    created_at,
+                    row.get("Channel") or "",
+                    parse_order_items(row.get("Items")),
+                    commit=False
+                )
+                imported += 1
+        self.conn.commit()
+        return imported
+
+    def user_stats(self, guild_id: int, user_id: int):
+        """
+        Orders, items, spend and top product for one customer, read together so
+        they always describe the same set of orders. None if the guild has no orders.
+        """
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM orders WHERE guild_id = ? LIMIT 1", (guild_id,)).fetchone() is None:
+                return None
+            orders, spent_cents = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(total_cents), 0) FROM orders WHERE guild_id = ? AND user_id = ?",
+                (guild_id, user_id)
+            ).fetchone()
+            items = self.conn.execute(
+                "SELECT COUNT(*) FROM orders o JOIN order_items oi ON oi.order_id = o.id "
+                "WHERE o.guild_id = ? AND o.user_id = ?",
+                (guild_id, user_id)
+            ).fetchone()[0]
+            top = self.conn.execute(
+                "SELECT oi.product FROM orders o JOIN order_items oi ON oi.order_id = o.id "
+                "WHERE o.guild_id = ? AND o.user_id = ? GROUP BY oi.product ORDER BY COUNT(*) DESC LIMIT 1",
+                (guild_id, user_id)
+            ).fetchone()
+        return {"orders": orders, "items": items, "spent_cents": spent_cents, "top_product": top[0] if top else None}
+
+
+def parse_order_items(items_text: str) -> list:
+    """
+    Split a legacy 'Name - 43€ | Other - 10€' Items cell into (name, cents) pairs.
+    """
+    items = []
+    for item in (items_text or "").split(" | "):
+        if not item.strip():
+            continue
+        name, _, price = item.partition(" - ")
+        try:
+            items.append((name, parse_price_to_cents(price)))
+        except ValueError:
+            items.append((name, 0))  # hand-edited row; keep the order, not the price
+    return items
+
+
+def migrate_orders_csv(path: str):
+    """
+    Add the Guild ID column to an orders.csv written before it existed; every
+    old row belongs to the original storefront.
+    """
+    if not os.path.isfile(path):
         return
-    ch = guild.get_channel(cid)
-    if ch is None:
-        clear_user_cart(user_id)
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    if not rows or rows[0] == ORDER_CSV_HEADER:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(ORDER_CSV_HEADER)
+        writer.writerows(row + [str(DEFAULT_GUILD_ID)] for row in rows[1:] if row)
+    os.replace(tmp_path, path)
+    print(f"📒 Added guild IDs to {len(rows) - 1} rows of {path}")
+
+
+def open_order_ledger() -> OrderLedger:
+    migrate_orders_csv(ORDER_CSV_PATH)
+    ledger = OrderLedger(ORDER_DB_PATH)
+    if ledger.is_empty() and os.path.isfile(ORDER_CSV_PATH):
+        count = ledger.import_csv(ORDER_CSV_PATH)
+        print(f"📒 Imported {count} orders from {ORDER_CSV_PATH} into the ledger")
+    return ledger
+
+
+order_ledger = open_order_ledger()
 
 
 # -------------------------
-# Global interaction hook (for close cart)
+# Running sales aggregates
 # -------------------------
 
-@bot.event
-async def on_interaction(interaction: discord.Interaction):
-    # Let discord.py process interactions normally too
+class GuildSales:
+    """
+    One guild's running totals: overall and per product. Per-customer
+    stats come from the order ledger.
+    """
+    __slots__ = ("orders", "items", "revenue_cents", "products", "top_product")
 
-    # Handle persistent close cart button (admin)
-    try:
-        if (
-            interaction.type == discord.InteractionType.component
-            and interaction.data
-            and interaction.data.get("custom_id") == "persistent_close_cart"
-        ):
-            if interaction.user.guild_permissions.administrator:
-                owner_id = infer_cart_owner_id_by_channel_id(interaction.channel.id)
-                if owner_id:
-                    clear_user_cart(owner_id)
-                await interaction.channel.delete()
+    def __init__(self, data: dict = None):
+        data = data or {}
+        self.orders = data.get("orders", 0)
+        self.items = data.get("items", 0)
+        self.revenue_cents = data.get("revenue_cents", 0)
+        self.products = data.get("products", {})  # product name -> units sold
+        self.top_product = data.get("top_product")
+
+    def apply(self, items: list):
+        self.orders += 1
+        self.items += len(items)
+        self.revenue_cents += sum(price for _, price in items)
+
+        for name, _ in items:
+            count = self.products.get(name, 0) + 1
+            self.products[name] = count
+            if self.top_product is None or count > self.products.get(self.top_product, 0):
+                self.top_product = name
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class SalesAggregates:
+    """
+    Per-guild and per-product totals folded in as rows are appended
+    to orders.csv, so /server_stats never recomputes from scratch.
+
+    The snapshot records how far into orders.csv it has read (byte offset) plus
+    a checksum of the bytes just before that offset. On startup we only fold in
+    the CSV tail past the offset; if the checksum no longer matches (file
+    replaced or truncated) we rebuild once.
+    """
+
+    CHECKSUM_WINDOW = 4096
+    SNAPSHOT_VERSION = 2  # 2: totals keyed by guild
+
+    def __init__(self):
+        self.csv_offset = 0
+        self.csv_checksum = ""
+        self.guilds = {}  # guild_id -> GuildSales
+        self._last_snapshot = 0.0
+
+    def for_guild(self, guild_id: int) -> GuildSales:
+        return self.guilds.get(guild_id) or GuildSales()
+
+    # --- updates ---
+
+    def apply_row(self, row: list):
+        """
+        Fold one orders.csv row (ORDER_CSV_HEADER layout) in. O(items).
+        """
+        items = parse_order_items(row[4] if len(row) > 4 else "")
+        try:
+            guild_id = int(row[6]) if len(row) > 6 and row[6] else DEFAULT_GUILD_ID
+        except ValueError:
+            guild_id = DEFAULT_GUILD_ID
+        sales = self.guilds.get(guild_id)
+        if sales is None:
+            sales = self.guilds[guild_id] = GuildSales()
+        sales.apply(items)
+
+    def advance(self, csv_path: str, offset: int):
+        """
+        Record that orders.csv has been folded in up to `offset` bytes.
+        """
+        self.csv_offset = offset
+        self.csv_checksum = self._checksum(csv_path, offset)
+
+    # --- persistence ---
+
+    @classmethod
+    def _checksum(cls, csv_path: str, offset: int) -> str:
+        if offset <= 0:
+            return ""
+        with open(csv_path, "rb") as f:
+            start = max(0, offset - cls.CHECKSUM_WINDOW)
+            f.seek(start)
+            return hashlib.sha256(f.read(offset - start)).hexdigest()
+
+    def snapshot(self, path: str):
+        data = {
+            "version": self.SNAPSHOT_VERSION,
+            "csv_offset": self.csv_offset,
+            "csv_checksum": self.csv_checksum,
+            "guilds": {str(guild_id): sales.to_dict() for guild_id, sales in self.guilds.items()},
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        self._last_snapshot = time.monotonic()
+
+    def snapshot_due(self) -> bool:
+        return time.monotonic() - self._last_snapshot >= SALES_SNAPSHOT_INTERVAL
+
+    @classmethod
+    def load(cls, path: str):
+        agg = cls()
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return agg
+        if data.get("version") != cls.SNAPSHOT_VERSION:
+            # Older layout: start over and fold the whole CSV in again
+            return agg
+        agg.csv_offset = data.get("csv_offset", 0)
+        agg.csv_checksum = data.get("csv_checksum", "")
+        agg.guilds = {int(guild_id): GuildSales(sales) for guild_id, sales in data.get("guilds", {}).items()}
+        return agg
+
+    def is_stale_for(self, csv_path: str) -> bool:
+        """
+        True if the snapshot no longer describes a prefix of orders.csv.
+        """
+        try:
+            size = os.path.getsize(csv_path)
+        except OSError:
+            return self.csv_offset > 0
+        if size < self.csv_offset:
+            return True
+        return self._checksum(csv_path, self.csv_offset) != self.csv_checksum
+
+    def catch_up(self, csv_path: str) -> int:
+        """
+        Fold in any rows appended to orders.csv after the snapshot offset.
+        Returns the number of rows applied.
+        """
+        if not os.path.isfile(csv_path):
+            return 0
+        with open(csv_path, "rb") as f:
+            f.seek(self.csv_offset)
+            tail = f.read()
+        # Only consume complete lines; a torn final write is picked up next time
+        end = tail.rfind(b"\n") + 1
+        if end == 0:
+            return 0
+        reader = csv.reader(io.StringIO(tail[:end].decode("utf-8"), newline=""))
+        applied = 0
+        for i, row in enumerate(reader):
+            if self.csv_offset == 0 and i == 0 and row == ORDER_CSV_HEADER:
+                continue
+            if not row:
+                continue
+            self.apply_row(row)
+            applied += 1
+        self.advance(csv_path, self.csv_offset + end)
+        return applied
+
+
+def open_sales_aggregates() -> SalesAggregates:
+    agg = SalesAggregates.load(SALES_SNAPSHOT_PATH)
+    if agg.is_stale_for(ORDER_CSV_PATH):
+        print("📊 Sales snapshot is stale, rebuilding from orders.csv")
+        agg = SalesAggregates()
+    applied = agg.catch_up(ORDER_CSV_PATH)
+    if applied or not os.path.isfile(SALES_SNAPSHOT_PATH):
+        print(f"📊 Folded {applied} new orders into sales aggregates")
+        agg.snapshot(SALES_SNAPSHOT_PATH)
+    return agg
+
+
+sales_aggregates = open_sales_aggregates()
+
+
+# -------------------------
+# Order writer
+# -------------------------
+
+def order_csv_row(order: dict) -> list:
+    items = order["items"]
+    return [
+        str(order["user_id"]),
+        order["username"],
+        order["created_at"].strftime(ORDER_CSV_DATE_FORMAT),
+        order["channel"],
+        " | ".join(f"{name} - {format_cents(price)}" for name, price in items),
+        format_cents(sum(price for _, price in items)),
+        str(order["guild_id"]),
+    ]
+
+
+class OrderWriter:
+    """
+    Single background task that owns every write to orders.csv and the ledger.
+
+    Exports queue an order and await a future. The task takes whatever has
+    queued up, writes the batch in a worker thread (one ledger transaction,
+    one CSV append, one fsync), then folds the rows into the sales
+    aggregates. Because only this task writes, the CSV header check can't
+    race between two exports.
+    """
+
+    def __init__(self):
+        self._queue = asyncio.Queue()
+        self.batches = 0
+        self.rows = 0
+
+    def submit(self, guild_id: int, user_id: int, username: str, created_at: datetime, channel: str,
+               items: list) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        order = {
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "username": username,
+            "created_at": created_at,
+            "channel": channel,
+            "items": items,
+        }
+        self._queue.put_nowait((order, future))
+        return future
+
+    def _write_batch(self, orders: list, rows: list) -> int:
+        """
+        The ledger and orders.csv get the batch together or not at all: the CSV
+        is appended inside the ledger transaction, and cut back to its old size
+        if the append or the commit fails.
+        """
+        csv_size = os.path.getsize(ORDER_CSV_PATH) if os.path.isfile(ORDER_CSV_PATH) else None
+        try:
+            with order_ledger.lock, order_ledger.conn:
+                for order in orders:
+                    order_ledger.record_order(
+                        order["guild_id"], order["user_id"], order["username"], order["created_at"], order["channel"], order["items"],
+                        commit=False
+                    )
+                return self._append_csv(rows, write_header=csv_size is None)
+        except BaseException:
+            if csv_size is None:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(ORDER_CSV_PATH)
             else:
-                await interaction.response.send_message(
-                    "❌ You don't have permission to close this cart.",
-                    ephemeral=True
-                )
-    except Exception as e:
-        # Avoid breaking other interactions
-        print(f"[on_interaction error] {e}")
+                with open(ORDER_CSV_PATH, "r+b") as f:
+                    f.truncate(csv_size)
+            raise
+
+    def _append_csv(self, rows: list, write_header: bool) -> int:
+        # Keep orders.csv as a compatibility export
+        with open(ORDER_CSV_PATH, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(ORDER_CSV_HEADER)
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    async def run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            orders = [order for order, _ in batch]
+            rows = [order_csv_row(order) for order in orders]
+            try:
+                csv_offset = await asyncio.to_thread(self._write_batch, orders, rows)
+            except Exception as e:
+                print(f"[order writer] failed to write {len(batch)} orders: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # Only this task touches the aggregates, so snapshotting in a thread is safe
+            for row in rows:
+                sales_aggregates.apply_row(row)
+            sales_aggregates.advance(ORDER_CSV_PATH, csv_offset)
+            if sales_aggregates.snapshot_due():
+                try:
+                    await asyncio.to_thread(sales_aggregates.snapshot, SALES_SNAPSHOT_PATH)
+                except OSError as e:
+                    print(f"[order writer] failed to snapshot sales stats: {e}")
+
+            self.batches += 1
+            self.rows += len(rows)
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+
+order_writer = OrderWriter()
+
+
+# -------------------------
+# Sales analytics (pandas)
+# -------------------------
+
+class SalesAnalytics:
+    """
+    orders.csv loaded into typed DataFrames for time-windowed reports.
+
+    `orders` has one row per order (order, guild_id, user_id, date); `items` has one row
+    per line item (exploded from the ' | '-joined Items column) with the
+    product as a category, price_cents as int64 and the order's calendar day
+    precomputed for the revenue series. The frames are cached and only refreshed when the
+    file's mtime or size changes; if the file only grew, just the appended
+    tail is parsed. All methods are blocking and meant for asyncio.to_thread.
+    """
+
+    def __init__(self, csv_path: str):
+        self.csv_path = csv_path
+        self.orders, self.items = self._parse(pd.DataFrame(columns=ORDER_CSV_HEADER, dtype=str), 0)
+        self._stat = None  # (mtime_ns, size) of the loaded file
+        self._lock = threading.Lock()
+
+    def _parse(self, raw: pd.DataFrame, first_order: int):
+        raw = raw.reset_index(drop=True)
+        orders = pd.DataFrame({
+            "order": pd.RangeIndex(first_order, first_order + len(raw)),
+            "guild_id": pd.to_numeric(raw["Guild ID"], errors="coerce").fillna(DEFAULT_GUILD_ID).astype("int64"),
+            "user_id": pd.to_numeric(raw["User ID"], errors="coerce").fillna(0).astype("int64"),
+            "date": pd.to_datetime(raw["Date"], format=ORDER_CSV_DATE_FORMAT, errors="coerce"),
+        })
+
+        exploded = raw["Items"].fillna("").str.split(" | ", regex=False).explode()
+        exploded = exploded[exploded.str.strip() != ""]
+        # Same split as parse_order_items: name is everything before the first ' - '
+        parts = exploded.str.split(" - ", n=1, expand=True).reindex(columns=[0, 1])
+        price = pd.to_numeric(
+            parts[1].fillna("").astype(str).str.replace(r"[€$\s]", "", regex=True).str.replace(",", ".", regex=False),
+            errors="coerce"
+        )
+        items = orders.loc[exploded.index, ["order", "guild_id", "user_id", "date"]].reset_index(drop=True)
+        items["day"] = items["date"].dt.normalize()
+        items["product"] = parts[0].fillna("").astype(str).reset_index(drop=True).astype("category")
+        items["price_cents"] = (price.fillna(0) * 100).round().astype("int64").reset_index(drop=True)
+        return orders, items
+
+    def _read(self, offset: int) -> pd.DataFrame:
+        if offset == 0:
+            return pd.read_csv(self.csv_path, dtype=str, keep_default_na=False)
+        with open(self.csv_path, "rb") as f:
+            f.seek(offset)
+            tail = f.read()
+        return pd.read_csv(io.BytesIO(tail), dtype=str, keep_default_na=False, header=None, names=ORDER_CSV_HEADER)
+
+    def refresh(self):
+        """
+        Reload if the file changed; returns the (orders, items) frames as of
+        now. Callers read those rather than self.orders / self.items, which a
+        concurrent refresh may replace. The frames are never mutated once
+        published.
+        """
+        with self._lock:
+            try:
+                st = os.stat(self.csv_path)
+            except OSError:
+                return self.orders, self.items
+            stat = (st.st_mtime_ns, st.st_size)
+            if stat == self._stat:
+                return self.orders, self.items
+            grew = self._stat is not None and st.st_size > self._stat[1]
+            if grew:
+                orders, items = self._parse(self._read(self._stat[1]), len(self.orders))
+                orders = pd.concat([self.orders, orders], ignore_index=True)
+                items = pd.concat([self.items, items], ignore_index=True)
+                items["product"] = items["product"].astype("category")
+            else:
+                orders, items = self._parse(self._read(0), 0)
+            self.orders, self.items, self._stat = orders, items, stat
+            return orders, items
+
+    def report(self, guild_id: int, start=None, end=None, period: str = "daily", top_n: int = 5,
+               customer_id: int = None) -> dict:
+        """
+        One guild's sales between [start, end) (naive datetimes, either may be
+        None): totals, a daily/weekly revenue series, top-N products and either
+        the top-N customers by lifetime value or one customer's lifetime value.
+        """
+        all_orders, all_items = self.refresh()
+        orders = all_orders[all_orders["guild_id"] == guild_id]
+        guild_items = items = all_items[all_items["guild_id"] == guild_id]
+
+        if start is not None:
+            orders, items = orders[orders["date"] >= start], items[items["date"] >= start]
+        if end is not None:
+            orders, items = orders[orders["date"] < end], items[items["date"] < end]
+
+        # Group on the precomputed day (weeks start on Monday), then fill empty buckets
+        bucket = items["day"]
+        if period == "weekly":
+            bucket = bucket - pd.to_timedelta(bucket.dt.dayofweek, unit="D")
+        series = items["price_cents"].groupby(bucket).sum()
+        if len(series):
+            series = series.asfreq("W-MON" if period == "weekly" else "D", fill_value=0)
+
+        top_products = (
+            items.groupby("product", sort=False, observed=True)["price_cents"].agg(["count", "sum"])
+            .nlargest(top_n, "count")
+        )
+
+        # Lifetime value is all-time, not limited to the window
+        ltv = guild_items.groupby("user_id", sort=False)["price_cents"].sum()
+        if customer_id is not None:
+            customers = ltv[ltv.index == customer_id]
+        else:
+            customers = ltv.nlargest(top_n)
+
+        return {
+            "orders": int(len(orders)),
+            "items": int(len(items)),
+            "revenue_cents": int(items["price_cents"].sum()),
+            "series": [(ts.to_pydatetime(), int(v)) for ts, v in series.items()],
+            "top_products": [(name, int(row["count"]), int(row["sum"])) for name, row in top_products.iterrows()],
+            "customers": [(int(uid), int(v)) for uid, v in customers.items()],
+        }
+
+
+sales_analytics = SalesAnalytics(ORDER_CSV_PATH)
+
+
+# -------------------------
+# Channel purge
+# -------------------------
+
+class ChannelPurge:
+    """
+    Streaming replacement for channel.purge().
+
+    History is read newest-first and matches are deleted in chunks of
+    CLEAR_CHUNK_SIZE, so memory stays bounded however long the channel is.
+    Messages younger than 14 days go through bulk delete; once the scan
+    reaches older ones (everything after that point is older too) they are
+    deleted one by one behind a token bucket. Progress is reported every few
+    seconds and the purge stops at the next message once cancelled.
+    """
+
+    def __init__(self, channel, check, limit: int = None, before: datetime = None, after: datetime = None):
+        self.channel = channel
+        self.check = check
+        self.limit = limit
+        self.before = before
+        self.after = after
+        self.scanned = 0
+        self.deleted = 0
+        self.cancelled = asyncio.Event()
+        self._bucket = TokenBucket(*CLEAR_SINGLE_DELETE_LIMIT)
+
+    async def _delete_chunk(self, chunk: list):
+        if len(chunk) == 1:
+            await chunk[0].delete()
+        else:
+            await self.channel.delete_messages(chunk)
+        self.deleted += len(chunk)
+
+    async def _delete_old(self, message: discord.Message):
+        delay = self._bucket.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        self._bucket.take()
+        try:
+            await message.delete()
+            self.deleted += 1
+        except discord.NotFound:
+            pass  # someone else got there first
+
+    async def run(self, progress=None):
+        """
+        Delete matching messages. `progress` is an async fn(purge) called at
+        most every CLEAR_PROGRESS_INTERVAL seconds.
+        """
+        bulk_cutoff = datetime.now(timezone.utc) - BULK_DELETE_MAX_AGE
+        chunk = []
+        last_report = time.monotonic()
+
+        async for message in self.channel.history(limit=None, before=self.before, after=self.after, oldest_first=False):
+            if self.cancelled.is_set():
+                break
+            self.scanned += 1
+            if not message.pinned and self.check(message):
+                if message.created_at > bulk_cutoff:
+                    chunk.append(message)
+                    if len(chunk) == CLEAR_CHUNK_SIZE:
+                        await self._delete_chunk(chunk)
+                        chunk = []
+                else:
+                    if chunk:
+                        await self._delete_chunk(chunk)
+                        chunk = []
+                    await self._delete_old(message)
+                if self.limit and self.deleted + len(chunk) >= self.limit:
+                    break
+
+            if progress and time.monotonic() - last_report >= CLEAR_PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await progress(self)
+
+        if chunk:
+            await self._delete_chunk(chunk)
+
+
+# Channel ID -> running ChannelPurge, one per channel
+active_purges = {}
+
+
+@bot.event
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    channel_index.add(channel)
+
+
+@bot.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    if before.name != after.name or before.overwrites != after.overwrites:
+        channel_index.update(after)
+
+
+@bot.event
+async def on_thread_update(before: discord.Thread, after: discord.Thread):
+    # Renaming a product thread renames the product; buttons keep working
+    if before.name != after.name:
+        product_catalog.rename(after.id, after.name)
+
+
+@bot.event
+async def on_raw_thread_delete(payload: discord.RawThreadDeleteEvent):
+    product_catalog.remove(payload.thread_id)
+
+
+@bot.event
+async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
+    await polls.on_add(payload)
+
+
+@bot.event
+async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
+    polls.on_remove(payload)
+
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    polls.forget(payload.message_id)
+
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    channel_index.remove(channel)
+    # Keep the cart registry in sync when a cart channel disappears
+    await cart_state.forget_channel(channel.guild.id, channel.id)
+    # Nothing left to auto-delete
+    scheduler.cancel(f"ticket:{channel.id}")
+    scheduler.cancel(f"order:{channel.id}")
+
+
+@bot.event
+async def on_guild_available(guild: discord.Guild):
+    # Fires per guild as each shard connects or recovers from an outage
+    channel_index.rebuild_guild(guild)
+
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    channel_index.rebuild_guild(guild)
+    print(f"🏬 Joined guild {guild.name} ({guild.id}); configure it with /configure")
+
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    channel_index.forget_guild(guild.id)
+    cart_registries.pop(guild.id, None)
 
 
 # -------------------------
@@ -118,36 +3745,20 @@ class WishlistButton(discord.ui.Button):
             row=0
         )
 
+    @instrumented("add_to_wishlist")
     async def callback(self, interaction: discord.Interaction):
-        if not interaction.message.attachments:
-            await interaction.response.send_message("⚠️ No product image found.", ephemeral=True)
+        product = await product_catalog.resolve(interaction.channel)
+        if product is None:
+            await interaction.response.send_message("⚠️ Product not found.", ephemeral=True)
             return
 
-        file = interaction.message.attachments[0]
-        parts = interaction.message.content.split(" - $")
-        product_name = parts[0] if parts else "Unnamed Product"
-        product_price = parts[1] if len(parts) > 1 else "Unknown"
-
-        embed = discord.Embed(title=f"💖 {product_name}", color=discord.Color.pink())
-        embed.add_field(name="💰 Price", value=product_price)
-        embed.set_image(url=file.url)
-        embed.set_footer(text="Click below to view the product on the server")
-
-        view_button = discord.ui.View()
-        view_button.add_item(discord.ui.Button(
-            label="🔗 View Product",
-            style=discord.ButtonStyle.link,
-            url=interaction.message.jump_url
-        ))
-
-        try:
-            await interaction.user.send("📥 Added to your wishlist:", embed=embed, view=view_button)
-            await interaction.response.send_message("✅ Sent to your wishlist in DM!", ephemeral=True)
-        except:
-            await interaction.response.send_message(
-                "⚠️ Could not send wishlist item to your DMs. Please check your privacy settings.",
-                ephemeral=True
-            )
+        if not wishlists.add(interaction.user, product.product_id):
+            await interaction.response.send_message("💖 Already on your wishlist.", ephemeral=True)
+            return
+        await interaction.response.send_message(
+            "✅ Added to your wishlist! You'll get a DM summary shortly; use /wishlist to browse it.",
+            ephemeral=True
+        )
 
 
 class AddToCartView(discord.ui.View):
@@ -161,10 +3772,12 @@ class AddToCartView(discord.ui.View):
         custom_id="persistent_addtocart",
         row=1
     )
+    @instrumented("add_to_cart")
     async def add_to_cart(self, interaction: discord.Interaction, button: discord.ui.Button):
         await interaction.response.defer(ephemeral=True)
 
-        if not interaction.message.attachments:
+        product = await product_catalog.resolve(interaction.channel)
+        if product is None or not product.image_urls:
             await interaction.followup.send("⚠️ No product image found.", ephemeral=True)
             return
 
@@ -172,88 +3785,36 @@ class AddToCartView(discord.ui.View):
         user_id = interaction.user.id
 
         # If cart channel was deleted, clear cart so user can add again
-        ensure_cart_channel_mapping_valid(guild, user_id)
-
-        file = interaction.message.attachments[0]
-        parts = interaction.message.content.split(" - $")
-        product_name = parts[0] if parts else "Unnamed Product"
-        product_price = parts[1] if len(parts) > 1 else "Unknown"
-
-        # Standardize to EUR display (keep your original logic)
-        if not str(product_price).endswith("€"):
-            product_price = f"{product_price}€"
+        await ensure_cart_channel_mapping_valid(guild, user_id)
 
-        embed = discord.Embed(title=product_name, color=discord.Color.orange())
-        embed.set_image(url=file.url)
-        embed.add_field(name="💰 Price", value=product_price)
-
-        if user_id not in carts:
-            carts[user_id] = []
+        item = CartItem(
+            product_id=product.product_id,
+            title=product.name,
+            price_cents=product.price_cents,
+            image_url=product.image_urls[0]
+        )
 
-        # Prevent duplicates (only within current in-memory cart)
-        if any(existing_embed.title == embed.title for existing_embed in carts[user_id]):
+        # Prevent duplicates (atomic in the shared state backend)
+        if not await cart_state.add_item(guild.id, user_id, item):
             await interaction.followup.send("⚠️ This item is already in your cart.", ephemeral=True)
-            return
-
-        carts[user_id].append(embed)
-
-        # Find or create cart channel
-        existing_channel = None
-        channel_name = f"cart-{interaction.user.name}"
-
-        # Prefer mapping if exists
-        mapped_id = cart_channels.get(user_id)
-        if mapped_id:
-            ch = guild.get_channel(mapped_id)
-            if isinstance(ch, discord.TextChannel):
-                existing_channel = ch
-
-        # Fallback by name
-        if existing_channel is None:
-            existing_channel = discord.utils.get(guild.text_channels, name=channel_name)
+            return
 
-        # Create if needed
+        # Find or create cart channel; concurrent clicks share one lookup/creation
+        existing_channel, _ = await cart_channel_flight.do(
+            (guild.id, user_id), open_cart_channel, guild, interaction.user, f"{WORKER_ID}:{interaction.id}"
+        )
         if existing_channel is None:
-            overwrites = {
-                guild.default_role: discord.PermissionOverwrite(read_messages=False),
-                interaction.user: discord.PermissionOverwrite(read_messages=True),
-            }
-            existing_channel = await guild.create_text_channel(
-                name=channel_name,
-                category=guild.get_channel(CART_CATEGORY_ID),
-                overwrites=overwrites
-            )
-
-        cart_channels[user_id] = existing_channel.id
+            await cart_state.remove_item(guild.id, user_id, item.product_id)
+            await interaction.followup.send("⚠️ Your cart is busy, please try again.", ephemeral=True)
+            return
 
         # Post item + remove button
         await existing_channel.send(
-            embed=embed,
-            view=RemoveFromCartView(user_id=user_id, index=len(carts[user_id]) - 1)
+            embed=item.to_embed(),
+            view=RemoveFromCartView(user_id=user_id, product_id=item.product_id)
         )
 
-        # Delete old summary messages
-        async for msg in existing_channel.history(limit=30):
-            if msg.author == bot.user and msg.embeds and msg.embeds[0].title == "🧾 Cart Summary":
-                try:
-                    await msg.delete()
-                except:
-                    pass
-
-        # Rebuild summary
-        total = 0.0
-        for e in carts.get(user_id, []):
-            for field in e.fields:
-                if field.name == "💰 Price":
-                    total += parse_price_to_float(field.value)
-
-        summary_embed = discord.Embed(
-            title="🧾 Cart Summary",
-            description=f"Total items: {len(carts[user_id])}",
-            color=discord.Color.blue()
-        )
-        summary_embed.add_field(name="Total", value=format_eur(total))
-        await existing_channel.send(embed=summary_embed, view=SummaryView(user_id=user_id))
+        await refresh_cart_summary(existing_channel, user_id)
 
         await interaction.followup.send("✅ Added to cart!", ephemeral=True)
 
@@ -263,25 +3824,39 @@ class TicketView(discord.ui.View):
         super().__init__(timeout=None)
 
     @discord.ui.button(label="Submit Ticket", style=discord.ButtonStyle.primary, custom_id="persistent_ticket", row=0)
+    @instrumented("submit_ticket")
     async def submit_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
         guild = interaction.guild
 
-        existing = discord.utils.get(guild.text_channels, name=f"ticket-{interaction.user.name}")
+        existing = channel_index.get(guild, "ticket", interaction.user.id)
         if existing:
             await interaction.response.send_message("⚠️ You already have an open ticket.", ephemeral=True)
             return
 
-        overwrites = {
-            guild.default_role: discord.PermissionOverwrite(read_messages=False),
-            interaction.user: discord.PermissionOverwrite(read_messages=True)
-        }
-        ticket_channel = await guild.create_text_channel(
-            name=f"ticket-{interaction.user.name}",
-            category=guild.get_channel(TICKET_CATEGORY_ID),
-            overwrites=overwrites
-        )
-        await ticket_channel.send("A staff member will assist you shortly", view=CloseTicketView())
-        await interaction.response.send_message("Ticket created!", ephemeral=True)
+        # Acknowledge first; channel creation may wait on the rate limiter
+        await interaction.response.defer(ephemeral=True)
+
+        # A double click joins the creation already in flight instead of making a second channel
+        _, shared = await ticket_channel_flight.do((guild.id, interaction.user.id), open_ticket_channel, guild, interaction.user)
+        if shared:
+            await interaction.followup.send("⚠️ You already have an open ticket.", ephemeral=True)
+            return
+        await interaction.followup.send("Ticket created!", ephemeral=True)
+
+
+async def open_ticket_channel(guild: discord.Guild, member: discord.Member) -> discord.TextChannel:
+    overwrites = {
+        guild.default_role: discord.PermissionOverwrite(read_messages=False),
+        member: discord.PermissionOverwrite(read_messages=True)
+    }
+    ticket_channel = await mutations.create_text_channel(
+        guild,
+        name=f"ticket-{member.name}",
+        category=guild.get_channel(guild_configs.get(guild.id).ticket_category_id),
+        overwrites=overwrites
+    )
+    await ticket_channel.send("A staff member will assist you shortly", view=CloseTicketView())
+    return ticket_channel
 
 
 class CloseTicketView(discord.ui.View):
@@ -289,38 +3864,42 @@ class CloseTicketView(discord.ui.View):
         super().__init__(timeout=None)
 
     @discord.ui.button(label="🔄 Reopen Ticket", style=discord.ButtonStyle.success, custom_id="reopen_ticket")
+    @instrumented("reopen_ticket")
     async def reopen_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
         channel_name = interaction.channel.name
         new_name = channel_name[len("closed-"):] if channel_name.startswith("closed-") else channel_name
 
+        scheduler.cancel(f"ticket:{interaction.channel.id}")
         await interaction.response.send_message("🔄 Ticket reopened.", ephemeral=True)
         # TextChannel.edit does not support archived/locked (those are thread params)
-        await interaction.channel.edit(name=new_name)
+        mutations.rename(interaction.channel, new_name)
 
     @discord.ui.button(label="🔒 Close Ticket", style=discord.ButtonStyle.secondary, custom_id="persistent___close_ticket")
+    @instrumented("close_ticket")
     async def close_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
-        log_channel = interaction.guild.get_channel(LOG_CHANNEL_ID)
+        # Answer within the 3-second window first; the log channel may be rate limited
+        await interaction.response.send_message("🔒 Ticket closed. You can reopen it within 3 hours.", ephemeral=True)
+
+        log_channel = log_channel_for(interaction.guild)
         if log_channel:
             await log_channel.send(f"🗑️ Ticket `{interaction.channel.name}` marked for deletion in 3 hours.")
 
-        await interaction.response.send_message("🔒 Ticket closed. You can reopen it within 3 hours.", ephemeral=True)
+        scheduler.schedule(
+            f"ticket:{interaction.channel.id}",
+            TICKET_DELETE_AFTER,
+            "delete_channel",
+            channel_id=interaction.channel.id,
+            log="🗑️ Ticket `{name}` deleted after 3 hours."
+        )
 
         original_name = interaction.channel.name
-        await interaction.channel.edit(name=f"closed-{original_name}")
-
-        await asyncio.sleep(10800)  # 3 hours
-        try:
-            log_channel = interaction.guild.get_channel(LOG_CHANNEL_ID)
-            if log_channel:
-                await log_channel.send(f"🗑️ Ticket `{interaction.channel.name}` deleted after 3 hours.")
-            await interaction.channel.delete()
-        except:
-            pass
+        mutations.rename(interaction.channel, f"closed-{original_name}")
 
     @discord.ui.button(label="❌ Force Close Ticket", style=discord.ButtonStyle.danger, custom_id="persistent___force_close_ticket")
+    @instrumented("force_close")
     async def force_close(self, interaction: discord.Interaction, button: discord.ui.Button):
         if interaction.user.guild_permissions.administrator:
-            await interaction.channel.delete()
+            await close_interaction_channel(interaction, "🗑️ Deleting ticket…")
         else:
             await interaction.response.send_message("You don’t have permission.", ephemeral=True)
 
@@ -330,13 +3909,20 @@ class ProductModal(discord.ui.Modal, title="Post New Product"):
     name = discord.ui.TextInput(label="Product Name")
     price = discord.ui.TextInput(label="Price")
 
+    @instrumented("product_modal")
     async def on_submit(self, interaction: discord.Interaction):
-        pending_products[interaction.user.id] = {
+        try:
+            parse_price_to_cents(self.price.value)
+        except ValueError:
+            await interaction.response.send_message(
+                f"❌ `{self.price.value}` isn't a price. Use e.g. 43, 43.50 or 1.299,00.", ephemeral=True
+            )
+            return
+        pending_inputs.expect_product(interaction.user.id, interaction.channel.id, {
             "forum_channel_id": self.forum_channel_id.value,
             "name": self.name.value,
             "price": self.price.value,
-            "channel_id": interaction.channel.id
-        }
+        })
         await interaction.response.send_message(
             "📷 Now send product images (with optional description) in this channel.",
             ephemeral=True
@@ -348,6 +3934,7 @@ class PostProductView(discord.ui.View):
         super().__init__(timeout=None)
 
     @discord.ui.button(label="➕ Post New Product", style=discord.ButtonStyle.success, custom_id="persistent_postproduct", row=0)
+    @instrumented("post_product")
     async def post_product(self, interaction: discord.Interaction, button: discord.ui.Button):
         if interaction.user.guild_permissions.administrator:
             await interaction.response.send_modal(ProductModal())
@@ -355,56 +3942,52 @@ class PostProductView(discord.ui.View):
             await interaction.response.send_message("Admin only.", ephemeral=True)
 
 
-# Remove From Cart View
-class RemoveFromCartView(discord.ui.View):
-    def __init__(self, user_id: int, index: int):
-        super().__init__(timeout=None)
+# Cart buttons are dynamic items: the owner / product live in the custom ID,
+# one handler per button type is registered in setup_hook, and the buttons
+# keep working after a restart. Their views are stopped before sending, so
+# discord.py's view store doesn't keep a copy per message.
+
+class RemoveFromCartButton(discord.ui.DynamicItem[discord.ui.Button], template=r"cart:remove:(?P<user_id>[0-9]+):(?P<product_id>[0-9]+)"):
+    def __init__(self, user_id: int, product_id: int):
+        super().__init__(discord.ui.Button(
+            label="❌ Remove from Cart",
+            style=discord.ButtonStyle.danger,
+            custom_id=f"cart:remove:{user_id}:{product_id}",
+            row=0
+        ))
         self.user_id = user_id
-        self.index = index
+        self.product_id = product_id
 
-    @discord.ui.button(label="❌ Remove from Cart", style=discord.ButtonStyle.danger, custom_id="persistent_remove_from_cart", row=0)
-    async def remove_item(self, interaction: discord.Interaction, button: discord.ui.Button):
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(int(match["user_id"]), int(match["product_id"]))
+
+    @instrumented("remove_item")
+    async def callback(self, interaction: discord.Interaction):
         if interaction.user.id != self.user_id:
             await interaction.response.send_message("❌ This item is not in your cart.", ephemeral=True)
             return
 
-        if self.user_id not in carts or not (0 <= self.index < len(carts[self.user_id])):
+        # Remove from cart + delete the product message
+        if not await cart_state.remove_item(interaction.guild.id, self.user_id, self.product_id):
             await interaction.response.send_message("❌ Couldn't remove item.", ephemeral=True)
             return
 
-        # Remove from cart + delete the product message
-        carts[self.user_id].pop(self.index)
         try:
             await interaction.message.delete()
         except:
             pass
 
-        cart_channel = interaction.channel
-
-        # Delete old summary
-        async for msg in cart_channel.history(limit=30):
-            if msg.author == bot.user and msg.embeds and msg.embeds[0].title == "🧾 Cart Summary":
-                try:
-                    await msg.delete()
-                except:
-                    pass
+        await refresh_cart_summary(interaction.channel, self.user_id)
 
-        # Rebuild summary
-        total = 0.0
-        for e in carts.get(self.user_id, []):
-            for field in e.fields:
-                if field.name == "💰 Price":
-                    total += parse_price_to_float(field.value)
+        await interaction.response.send_message("🗑️ Item removed from cart.", ephemeral=True)
 
-        summary = discord.Embed(
-            title="🧾 Cart Summary",
-            description=f"Total items: {len(carts.get(self.user_id, []))}",
-            color=discord.Color.blue()
-        )
-        summary.add_field(name="Total", value=format_eur(total))
-        await cart_channel.send(embed=summary, view=SummaryView(user_id=self.user_id))
 
-        await interaction.response.send_message("🗑️ Item removed from cart.", ephemeral=True)
+class RemoveFromCartView(discord.ui.View):
+    def __init__(self, user_id: int, product_id: int):
+        super().__init__(timeout=None)
+        self.add_item(RemoveFromCartButton(user_id, product_id))
+        self.stop()
 
 
 class CompleteOrderView(discord.ui.View):
@@ -413,6 +3996,7 @@ class CompleteOrderView(discord.ui.View):
         self.user = user
 
     @discord.ui.button(label="📁 Files Sent", style=discord.ButtonStyle.primary, custom_id="persistent___files_sent")
+    @instrumented("complete_order")
     async def complete_order(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("❌ You don't have permission.", ephemeral=True)
@@ -421,89 +4005,73 @@ class CompleteOrderView(discord.ui.View):
         await interaction.response.send_message("📦 Files have been sent to the user. Closing order...", ephemeral=True)
         await asyncio.sleep(2)
         try:
-            log_channel = interaction.guild.get_channel(LOG_CHANNEL_ID)
+            log_channel = log_channel_for(interaction.guild)
             if log_channel:
                 await log_channel.send(f"🗂️ Order channel `{interaction.channel.name}` deleted after files were sent.")
-            await interaction.channel.delete()
+            await mutations.delete(interaction.channel)
         except Exception as e:
             print(f"Failed to delete order channel: {e}")
 
     @discord.ui.button(label="📤 Export to CSV", style=discord.ButtonStyle.secondary, custom_id="persistent___export_to_csv")
+    @instrumented("export_csv")
     async def export_csv(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("❌ You don't have permission.", ephemeral=True)
             return
 
-        now = datetime.now(timezone.utc).strftime("%d/%m/%y %H:%M")
-        file_exists = os.path.isfile(ORDER_CSV_PATH)
-
-        # Build items + totals from in-memory cart
-        items = []
-        total_price = 0.0
-        for embed in carts.get(self.user.id, []):
-            price_val = next((f.value for f in embed.fields if f.name == "💰 Price"), "N/A")
-            items.append(f"{embed.title} - {price_val}")
-            total_price += parse_price_to_float(price_val)
-
-        row = [
-            str(self.user.id),
-            self.user.name,
-            now,
-            interaction.channel.name,
-            " | ".join(items),
-            format_eur(total_price),
-        ]
+        # Disk writes happen in the order writer; don't let a slow disk time out the interaction
+        await interaction.response.defer(ephemeral=True)
 
-        # Write CSV safely (writerow INSIDE with)
-        try:
-            with open(ORDER_CSV_PATH, "a", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-                if not file_exists:
-                    writer.writerow(["User ID", "Username", "Date", "Channel", "Items", "Total"])
-                writer.writerow(row)
+        line_items = [(item.title, item.price_cents) for item in await cart_state.items(interaction.guild.id, self.user.id)]
 
-            await interaction.response.send_message("✅ Order exported to CSV.", ephemeral=True)
+        try:
+            await order_writer.submit(
+                interaction.guild.id, self.user.id, self.user.name, datetime.now(timezone.utc), interaction.channel.name, line_items
+            )
+            await interaction.followup.send("✅ Order exported to CSV.", ephemeral=True)
         except Exception as e:
-            await interaction.response.send_message(f"❌ Failed to export CSV: {e}", ephemeral=True)
+            await interaction.followup.send(f"❌ Failed to export CSV: {e}", ephemeral=True)
 
 
 class UploadReceiptView(discord.ui.View):
     def __init__(self):
         super().__init__(timeout=None)
 
+    # Still registered for summaries posted before the cart:receipt button
     @discord.ui.button(label="📤 Upload Receipt", style=discord.ButtonStyle.primary, custom_id="persistent___upload_receipt")
+    @instrumented("upload_receipt")
     async def upload_receipt(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.send_message("📎 Please upload your receipt image or file.", ephemeral=True)
+        await upload_receipt_flow(interaction)
 
-        def check(m):
-            return (
-                m.author.id == interaction.user.id
-                and m.channel.id == interaction.channel.id
-                and m.attachments
-            )
 
-        try:
-            msg = await bot.wait_for("message", check=check, timeout=120)
-        except asyncio.TimeoutError:
-            await interaction.followup.send("⏰ Time expired. Please try again.", ephemeral=True)
-            return
+async def upload_receipt_flow(interaction: discord.Interaction):
+    await interaction.response.send_message("📎 Please upload your receipt image or file.", ephemeral=True)
 
-        receipt_channel = await interaction.guild.create_text_channel(
-            name=f"receipt-{interaction.user.name}",
-            category=interaction.guild.get_channel(RECEIPT_CATEGORY_ID),
-            overwrites={
-                interaction.guild.default_role: discord.PermissionOverwrite(read_messages=False),
-                interaction.user: discord.PermissionOverwrite(read_messages=True)
-            }
-        )
+    msg = await pending_inputs.wait_for_receipt(interaction.user.id, interaction.channel.id)
+    if msg is PendingInputs.SUPERSEDED:
+        await interaction.followup.send("🔁 Replaced by your newer upload request; use that one instead.", ephemeral=True)
+        return
+    if msg is None:
+        await interaction.followup.send("⏰ Time expired. Please try again.", ephemeral=True)
+        return
+
+    receipt_channel = await mutations.create_text_channel(
+        interaction.guild,
+        name=f"receipt-{interaction.user.name}",
+        category=interaction.guild.get_channel(guild_configs.get(interaction.guild.id).receipt_category_id),
+        overwrites={
+            interaction.guild.default_role: discord.PermissionOverwrite(read_messages=False),
+            interaction.user: discord.PermissionOverwrite(read_messages=True)
+        }
+    )
 
-        embed = discord.Embed(title="📥 New Receipt Submitted", color=discord.Color.orange())
-        embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
-        embed.set_image(url=msg.attachments[0].url)
-        embed.set_footer(text=f"User ID: {interaction.user.id}")
+    embed = discord.Embed(title="📥 New Receipt Submitted", color=discord.Color.orange())
+    embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
+    embed.set_image(url=msg.attachments[0].url)
+    embed.set_footer(text=f"User ID: {interaction.user.id}")
 
-        await receipt_channel.send(content="<@&admin>", embed=embed, view=ApproveOrderView())
-        await interaction.followup.send("✅ Receipt uploaded. Awaiting admin approval.", ephemeral=True)
+    await receipt_channel.send(content="<@&admin>", embed=embed, view=ApproveOrderView())
+    await interaction.followup.send("✅ Receipt uploaded. Awaiting admin approval.", ephemeral=True)
 
 
 class ApproveOrderView(discord.ui.View):
@@ -511,6 +4079,7 @@ class ApproveOrderView(discord.ui.View):
         super().__init__(timeout=None)
 
     @discord.ui.button(label="🗑️ Delete Receipt", style=discord.ButtonStyle.danger, custom_id="persistent____delete_receipt")
+    @instrumented("delete_receipt")
     async def delete_receipt(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("❌ You don't have permission to delete this receipt.", ephemeral=True)
@@ -519,22 +4088,28 @@ class ApproveOrderView(discord.ui.View):
         await interaction.response.send_message("🗑️ Receipt deleted.", ephemeral=True)
         await asyncio.sleep(1)
         try:
-            await interaction.channel.delete()
+            await mutations.delete(interaction.channel)
         except Exception as e:
             print(f"Failed to delete receipt channel: {e}")
 
     @discord.ui.button(label="✅ Approve", style=discord.ButtonStyle.success, custom_id="persistent___approve")
+    @instrumented("approve")
     async def approve(self, interaction: discord.Interaction, button: discord.ui.Button):
         if not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("❌ You don't have permission to approve.", ephemeral=True)
             return
 
+        # Acknowledge first; channel creation may wait on the rate limiter
+        await interaction.response.defer(ephemeral=True)
+
         user_id = int(interaction.message.embeds[0].footer.text.split(": ")[1])
         user = await interaction.guild.fetch_member(user_id)
 
-        order_channel = await interaction.guild.create_text_channel(
-            name=f"order-{user.name}",
-            category=interaction.guild.get_channel(ORDERS_CATEGORY_ID),
+        # Created already marked as approved, saving a rate-limited rename
+        order_channel = await mutations.create_text_channel(
+            interaction.guild,
+            name=f"✅-order-{user.name}",
+            category=interaction.guild.get_channel(guild_configs.get(interaction.guild.id).orders_category_id),
             overwrites={
                 interaction.guild.default_role: discord.PermissionOverwrite(read_messages=False),
                 user: discord.PermissionOverwrite(read_messages=True)
@@ -549,10 +4124,10 @@ class ApproveOrderView(discord.ui.View):
         embed.set_footer(text=f"User ID: {user.id}")
 
         await order_channel.send(embed=embed, view=CompleteOrderView(user))
-        await interaction.response.send_message("🟢 Order approved and order channel created.", ephemeral=True)
+        await interaction.followup.send("🟢 Order approved and order channel created.", ephemeral=True)
 
         # Notify user's cart channel
-        cart_channel = discord.utils.get(interaction.guild.text_channels, name=f"cart-{user.name}")
+        cart_channel = channel_index.get(interaction.guild, "cart", user.id)
         if cart_channel:
             msg_embed = discord.Embed(
                 title="✅ Receipt Reviewed",
@@ -561,23 +4136,11 @@ class ApproveOrderView(discord.ui.View):
             )
             await cart_channel.send(embed=msg_embed, view=CloseCartView())
 
-        # Mark channels as approved
-        try:
-            await order_channel.edit(name=f"✅-{order_channel.name}")
-        except:
-            pass
-
-        try:
-            await interaction.channel.edit(name=f"✅-{interaction.channel.name}")
-        except Exception as e:
-            print(f"Failed to rename receipt channel: {e}")
+        # Mark receipt channel as approved (queued; renames are heavily rate limited)
+        mutations.rename(interaction.channel, f"✅-{interaction.channel.name}")
 
         # Auto-delete order channel after 24h
-        try:
-            await asyncio.sleep(86400)
-            await order_channel.delete()
-        except Exception as e:
-            print(f"Failed to delete order channel: {e}")
+        scheduler.schedule(f"order:{order_channel.id}", ORDER_DELETE_AFTER, "delete_channel", channel_id=order_channel.id)
 
 
 class CloseCartView(discord.ui.View):
@@ -585,12 +4148,13 @@ class CloseCartView(discord.ui.View):
         super().__init__(timeout=None)
 
     @discord.ui.button(label="🛒 Close Cart", style=discord.ButtonStyle.success, custom_id="persistent_close_cart")
+    @instrumented("close_order")
     async def close_order(self, interaction: discord.Interaction, button: discord.ui.Button):
         if interaction.user.guild_permissions.administrator:
-            owner_id = infer_cart_owner_id_by_channel_id(interaction.channel.id)
+            owner_id = await infer_cart_owner_id_by_channel_id(interaction.guild.id, interaction.channel.id)
             if owner_id:
-                clear_user_cart(owner_id)
-            await interaction.channel.delete()
+                await clear_user_cart(interaction.guild.id, owner_id)
+            await close_interaction_channel(interaction, "🛒 Closing cart…")
         else:
             await interaction.response.send_message("❌ You don't have permission to close this order.", ephemeral=True)
 
@@ -607,28 +4171,94 @@ class SummaryView(discord.ui.View):
         ))
 
         # Upload receipt
-        for item in UploadReceiptView().children:
-            self.add_item(item)
+        self.add_item(UploadReceiptButton())
 
         # User close cart
         self.add_item(CloseCartButton(user_id=user_id))
+        self.stop()
+
+
+class UploadReceiptButton(discord.ui.DynamicItem[discord.ui.Button], template=r"cart:receipt"):
+    def __init__(self):
+        super().__init__(discord.ui.Button(
+            label="📤 Upload Receipt",
+            style=discord.ButtonStyle.primary,
+            custom_id="cart:receipt"
+        ))
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls()
+
+    @instrumented("upload_receipt")
+    async def callback(self, interaction: discord.Interaction):
+        await upload_receipt_flow(interaction)
 
 
-class CloseCartButton(discord.ui.Button):
+class CloseCartButton(discord.ui.DynamicItem[discord.ui.Button], template=r"cart:close:(?P<user_id>[0-9]+)"):
     def __init__(self, user_id: int):
-        super().__init__(
+        super().__init__(discord.ui.Button(
             label="🛑 Close Cart",
             style=discord.ButtonStyle.danger,
-            custom_id="close_cart_button"
-        )
+            custom_id=f"cart:close:{user_id}"
+        ))
         self.user_id = user_id
 
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(int(match["user_id"]))
+
+    @instrumented("close_cart")
     async def callback(self, interaction: discord.Interaction):
         if interaction.user.id != self.user_id:
             await interaction.response.send_message("❌ Αυτό δεν είναι το δικό σου καλάθι.", ephemeral=True)
             return
-        clear_user_cart(self.user_id)
-        await interaction.channel.delete()
+        await clear_user_cart(interaction.guild.id, self.user_id)
+        await close_interaction_channel(interaction, "🛑 Closing cart…")
+
+
+class WishlistPageView(discord.ui.View):
+    def __init__(self, user: discord.abc.User, product_ids: list):
+        super().__init__(timeout=300)
+        self.user = user
+        self.product_ids = product_ids
+        self.page = 0
+        self.pages = max(1, -(-len(product_ids) // WISHLIST_PAGE_SIZE))
+        self._update_buttons()
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.pages - 1
+
+    async def _show(self, interaction: discord.Interaction):
+        self._update_buttons()
+        await interaction.response.edit_message(
+            embed=build_wishlist_page_embed(self.user, self.product_ids, self.page), view=self
+        )
+
+    @discord.ui.button(label="◀️", style=discord.ButtonStyle.secondary)
+    @instrumented("wishlist_page")
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = max(0, self.page - 1)
+        await self._show(interaction)
+
+    @discord.ui.button(label="▶️", style=discord.ButtonStyle.secondary)
+    @instrumented("wishlist_page")
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = min(self.pages - 1, self.page + 1)
+        await self._show(interaction)
+
+
+class CancelClearView(discord.ui.View):
+    def __init__(self, purge: ChannelPurge):
+        super().__init__(timeout=None)
+        self.purge = purge
+
+    @discord.ui.button(label="⏹️ Stop", style=discord.ButtonStyle.danger)
+    @instrumented("cancel_clear")
+    async def cancel_clear(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.purge.cancelled.set()
+        await interaction.response.send_message("⏹️ Stopping…", ephemeral=True)
 
 
 # -------------------------
@@ -642,11 +4272,10 @@ async def on_message(message: discord.Message):
     if message.author.bot:
         return
 
-    if message.author.id not in pending_products:
+    data = pending_inputs.dispatch(message)
+    if data is None:
         return
 
-    data = pending_products.pop(message.author.id)
-
     if not message.attachments:
         await message.channel.send("⚠️ No image attached. Please try again.")
         return
@@ -660,19 +4289,21 @@ async def on_message(message: discord.Message):
         await message.channel.send("❌ Invalid Forum Channel ID.")
         return
 
-    # Create forum thread with initial post (content + image)
+    sources = [(a.url, a.filename) for a in message.attachments[:MAX_FILES_PER_MESSAGE]]
+    if len(message.attachments) > MAX_FILES_PER_MESSAGE:
+        await message.channel.send(f"⚠️ Only the first {MAX_FILES_PER_MESSAGE} attachments will be posted.")
+
+    # Create forum thread with initial post (content + every image)
+    files = []
     try:
-        file = await message.attachments[0].to_file()
-        thread = await forum_channel.create_thread(
-            name=data["name"],
-            content=f"{data['name']} - ${data['price']}",
-            files=[file],
-        )
-        # Add buttons in a follow-up message inside the thread
-        await thread.send("Use the buttons below:", view=AddToCartView())
+        files = await attachments.fetch_all(sources)
+        await publish_product(forum_channel, data["name"], data["price"], files)
         await message.channel.send("✅ Product posted successfully!")
     except Exception as e:
         await message.channel.send(f"❌ Failed to post product: {e}")
+    finally:
+        for file in files:
+            file.close()
 
 
 # -------------------------
@@ -681,6 +4312,7 @@ async def on_message(message: discord.Message):
 
 @bot.tree.command(name="poll", description="🗳️ Create a poll with up to 5 custom options")
 @app_commands.checks.has_permissions(administrator=True)
+@instrumented("poll")
 async def poll(
     interaction: discord.Interaction,
     question: str,
@@ -688,117 +4320,187 @@ async def poll(
     option2: str,
     option3: str = None,
     option4: str = None,
-    option5: str = None
+    option5: str = None,
+    duration_minutes: app_commands.Range[int, 1, 10080] = None
 ):
-    options = [option1, option2, option3, option4, option5]
-    emojis = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣"]
-    valid_options = [(emojis[i], opt) for i, opt in enumerate(options) if opt]
+    options = [opt for opt in (option1, option2, option3, option4, option5) if opt]
 
-    if len(valid_options) < 2:
+    if len(options) < 2:
         await interaction.response.send_message("❌ You must provide at least two options.", ephemeral=True)
         return
 
-    description = "\n".join([f"{emoji} {text}" for emoji, text in valid_options])
-    embed = discord.Embed(
-        title="🗳️ Poll",
-        description=f"**{question}**\n\n{description}",
-        color=discord.Color.teal()
-    )
-    embed.set_footer(text=f"Poll by {interaction.user.display_name}")
+    closes_at = time.time() + duration_minutes * 60 if duration_minutes else None
+    new_poll = Poll(0, interaction.channel.id, question, interaction.user.display_name, options, closes_at)
 
-    poll_message = await interaction.channel.send(embed=embed)
-    for emoji, _ in valid_options:
+    # Answer first; adding the reactions is rate limited and takes a moment
+    await interaction.response.send_message("✅ Poll created.", ephemeral=True)
+    poll_message = await interaction.channel.send(embed=build_poll_embed(new_poll))
+    new_poll.message_id = poll_message.id
+    polls.open(new_poll)
+
+    for emoji in POLL_EMOJIS[:len(options)]:
         await poll_message.add_reaction(emoji)
 
-    await interaction.response.send_message("✅ Poll created.", ephemeral=True)
+
+@bot.tree.command(name="wishlist", description="💖 Browse the products you saved")
+@instrumented("wishlist")
+async def wishlist(interaction: discord.Interaction):
+    product_ids = wishlists.items(interaction.user.id)
+    embed = build_wishlist_page_embed(interaction.user, product_ids, 0)
+    if len(product_ids) <= WISHLIST_PAGE_SIZE:
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=embed, view=WishlistPageView(interaction.user, product_ids), ephemeral=True)
 
 
 @bot.tree.command(name="server_stats", description="📈 View server-wide sales statistics")
 @app_commands.checks.has_permissions(administrator=True)
+@instrumented("server_stats")
 async def server_stats(interaction: discord.Interaction):
-    if not os.path.exists(ORDER_CSV_PATH):
+    stats = sales_aggregates.for_guild(interaction.guild.id)
+    if stats.orders == 0:
         await interaction.response.send_message("⚠️ No orders have been exported yet.", ephemeral=True)
         return
 
-    total_orders = 0
-    total_revenue = 0.0
-    total_items = 0
-    product_counter = {}
-
-    with open(ORDER_CSV_PATH, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            total_orders += 1
-            items = row.get("Items", "").split(" | ") if row.get("Items") else []
-            total_items += len([i for i in items if i.strip()])
-
-            for item in items:
-                name, _, price = item.partition(" - ")
-                total_revenue += parse_price_to_float(price)
-                product_counter[name] = product_counter.get(name, 0) + 1
-
-    top_product = max(product_counter.items(), key=lambda x: x[1])[0] if product_counter else "N/A"
-
     embed = discord.Embed(title="📈 Server Sales Stats", color=discord.Color.gold())
-    embed.add_field(name="🧾 Total Orders", value=str(total_orders))
-    embed.add_field(name="📦 Total Items Sold", value=str(total_items))
-    embed.add_field(name="💰 Total Revenue", value=format_eur(total_revenue))
-    embed.add_field(name="🔥 Top Product", value=top_product)
+    embed.add_field(name="🧾 Total Orders", value=str(stats.orders))
+    embed.add_field(name="📦 Total Items Sold", value=str(stats.items))
+    embed.add_field(name="💰 Total Revenue", value=format_cents(stats.revenue_cents))
+    embed.add_field(name="🔥 Top Product", value=stats.top_product or "N/A")
 
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 
 @bot.tree.command(name="user_stats", description="📊 View a specific user's purchase statistics")
 @app_commands.checks.has_permissions(administrator=True)
+@instrumented("user_stats")
 async def user_stats(interaction: discord.Interaction, user: discord.User):
-    user_id = str(user.id)
-    total_orders = 0
-    total_spent = 0.0
-    total_items = 0
-    products_counter = {}
-
-    if not os.path.exists(ORDER_CSV_PATH):
+    # Totals and top product come from the ledger in one read, so they always agree
+    stats = await asyncio.to_thread(order_ledger.user_stats, interaction.guild.id, user.id)
+    if stats is None:
         await interaction.response.send_message("⚠️ No orders have been recorded yet.", ephemeral=True)
         return
 
-    with open(ORDER_CSV_PATH, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row.get("User ID") != user_id:
-                continue
-            total_orders += 1
-            items = row.get("Items", "").split(" | ") if row.get("Items") else []
-            total_items += len([i for i in items if i.strip()])
+    embed = discord.Embed(title=f"📊 Stats for {user.display_name}", color=discord.Color.purple())
+    embed.add_field(name="🛍 Total Orders", value=str(stats["orders"]))
+    embed.add_field(name="📦 Items Purchased", value=str(stats["items"]))
+    embed.add_field(name="💰 Total Spent", value=format_cents(stats["spent_cents"]))
+    embed.add_field(name="🔥 Most Purchased Product", value=stats["top_product"] or "N/A")
 
-            for item in items:
-                name, _, price = item.partition(" - ")
-                total_spent += parse_price_to_float(price)
-                products_counter[name] = products_counter.get(name, 0) + 1
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
-    most_common = max(products_counter.items(), key=lambda x: x[1])[0] if products_counter else "N/A"
 
-    embed = discord.Embed(title=f"📊 Stats for {user.display_name}", color=discord.Color.purple())
-    embed.add_field(name="🛍 Total Orders", value=str(total_orders))
-    embed.add_field(name="📦 Items Purchased", value=str(total_items))
-    embed.add_field(name="💰 Total Spent", value=format_eur(total_spent))
-    embed.add_field(name="🔥 Most Purchased Product", value=most_common)
+@bot.tree.command(name="sales_report", description="📅 Sales report for a date range")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    start="First day (YYYY-MM-DD)",
+    end="Last day, inclusive (YYYY-MM-DD)",
+    period="Revenue series granularity",
+    top="How many products / customers to list",
+    customer="Only show this customer's lifetime value"
+)
+@app_commands.choices(period=[
+    app_commands.Choice(name="Daily", value="daily"),
+    app_commands.Choice(name="Weekly", value="weekly"),
+])
+@instrumented("sales_report")
+async def sales_report(
+    interaction: discord.Interaction,
+    start: str = None,
+    end: str = None,
+    period: app_commands.Choice[str] = None,
+    top: app_commands.Range[int, 1, 25] = 5,
+    customer: discord.User = None
+):
+    try:
+        start_dt = datetime.strptime(start, "%Y-%m-%d") if start else None
+        end_dt = datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1) if end else None
+    except ValueError:
+        await interaction.response.send_message("❌ Dates must look like 2025-01-31.", ephemeral=True)
+        return
 
-    await interaction.response.send_message(embed=embed, ephemeral=True)
+    if not os.path.exists(ORDER_CSV_PATH):
+        await interaction.response.send_message("⚠️ No orders have been exported yet.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+    period_value = period.value if period else "daily"
+    report = await asyncio.to_thread(
+        sales_analytics.report, interaction.guild.id, start_dt, end_dt, period_value, top,
+        customer.id if customer else None
+    )
+
+    window = f"{start or 'beginning'} → {end or 'today'}"
+    embed = discord.Embed(title="📅 Sales Report", description=window, color=discord.Color.gold())
+    embed.add_field(name="🧾 Orders", value=str(report["orders"]))
+    embed.add_field(name="📦 Items", value=str(report["items"]))
+    embed.add_field(name="💰 Revenue", value=format_cents(report["revenue_cents"]))
+
+    date_format = "%d/%m" if period_value == "daily" else "w/c %d/%m"
+    series = report["series"][-14:]  # most recent buckets fit in one field
+    embed.add_field(
+        name=f"📈 {period_value.capitalize()} revenue",
+        value="```" + "\n".join(f"{ts.strftime(date_format)}  {format_cents(v)}" for ts, v in series) + "```"
+        if series else "N/A",
+        inline=False
+    )
+    embed.add_field(
+        name=f"🔥 Top {top} products",
+        value="\n".join(f"{name} — {count}× ({format_cents(revenue)})" for name, count, revenue in report["top_products"])
+        or "N/A",
+        inline=False
+    )
+    if customer:
+        ltv = report["customers"][0][1] if report["customers"] else 0
+        embed.add_field(name=f"👤 {customer.display_name} lifetime value", value=format_cents(ltv), inline=False)
+    else:
+        embed.add_field(
+            name=f"👥 Top {top} customers (lifetime value)",
+            value="\n".join(f"<@{uid}> — {format_cents(v)}" for uid, v in report["customers"]) or "N/A",
+            inline=False
+        )
+
+    await interaction.followup.send(embed=embed, ephemeral=True)
 
 
 @bot.tree.command(name="download_orders")
 @app_commands.checks.has_permissions(administrator=True)
+@instrumented("download_orders")
 async def download_orders(interaction: discord.Interaction):
-    if not os.path.exists(ORDER_CSV_PATH):
-        await interaction.response.send_message("⚠️ No orders have been exported yet.", ephemeral=True)
+    await interaction.response.defer(ephemeral=True)
+    export = await asyncio.to_thread(guild_orders_csv, interaction.guild.id)
+    if export is None:
+        await interaction.followup.send("⚠️ No orders have been exported yet.", ephemeral=True)
         return
+    await interaction.followup.send(
+        "📄 Here is the exported CSV:", file=discord.File(export, filename="orders.csv"), ephemeral=True
+    )
+
 
-    await interaction.response.send_message("📄 Here is the exported CSV:", ephemeral=True)
-    await interaction.followup.send(file=discord.File(ORDER_CSV_PATH))
+def guild_orders_csv(guild_id: int):
+    """
+    This guild's rows of orders.csv as an in-memory CSV, or None if it has none.
+    """
+    if not os.path.exists(ORDER_CSV_PATH):
+        return None
+    guild = str(guild_id)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(ORDER_CSV_HEADER)
+    found = False
+    with open(ORDER_CSV_PATH, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) > 6 and row[6] == guild:
+                writer.writerow(row)
+                found = True
+    return io.BytesIO(out.getvalue().encode("utf-8")) if found else None
 
 
 @bot.tree.command(name="setup_ticket_button")
 @app_commands.checks.has_permissions(administrator=True)
+@instrumented("setup_ticket_button")
 async def setup_ticket_button(interaction: discord.Interaction):
     await interaction.channel.send("🎟️ Open a ticket:", view=TicketView())
     await interaction.response.send_message("Ticket system set up.", ephemeral=True)
@@ -806,54 +4508,365 @@ async def setup_ticket_button(interaction: discord.Interaction):
 
 @bot.tree.command(name="setup_post_product")
 @app_commands.checks.has_permissions(administrator=True)
+@instrumented("setup_post_product")
 async def setup_post_product(interaction: discord.Interaction):
     await interaction.channel.send("🛍️ Add a new product:", view=PostProductView())
     await interaction.response.send_message("Product system set up.", ephemeral=True)
 
 
+@bot.tree.command(name="import_products", description="📦 Post products in bulk from a CSV or JSON manifest")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(manifest="CSV or JSON with name, price, forum_id and image_urls")
+@instrumented("import_products")
+async def import_products(interaction: discord.Interaction, manifest: discord.Attachment):
+    if not manifest.filename.lower().endswith((".csv", ".json")):
+        await interaction.response.send_message("❌ The manifest must be a .csv or .json file.", ephemeral=True)
+        return
+    if interaction.guild.id in active_imports:
+        await interaction.response.send_message("⚠️ An import is already running in this server.", ephemeral=True)
+        return
+    # Hold the slot from here on, so a second invocation can't slip in while the manifest is read
+    active_imports[interaction.guild.id] = None
+
+    try:
+        await interaction.response.defer(ephemeral=True)
+        try:
+            rows, errors = parse_manifest(manifest.filename, await manifest.read())
+        except (UnicodeDecodeError, json.JSONDecodeError, csv.Error) as e:
+            await interaction.followup.send(f"❌ Could not read the manifest: {e}", ephemeral=True)
+            return
+        if not rows:
+            await interaction.followup.send("❌ No valid products in the manifest.\n" + "\n".join(errors[:10]), ephemeral=True)
+            return
+
+        job = CatalogImport(interaction.guild, rows)
+        active_imports[interaction.guild.id] = job
+        status = await interaction.followup.send(f"📦 Importing {len(rows)} products…", ephemeral=True, wait=True)
+
+        async def progress(j: CatalogImport):
+            try:
+                await status.edit(
+                    content=f"📦 {j.done}/{len(j.rows)} · posted {j.posted} · skipped {j.skipped} · "
+                            f"failed {len(j.failed)} · {j.rate * 60:.0f} products/min"
+                )
+            except discord.HTTPException:
+                pass  # the interaction token expires after 15 minutes; keep importing
+
+        await job.run(progress)
+    finally:
+        active_imports.pop(interaction.guild.id, None)
+
+    elapsed = time.monotonic() - job.started
+    problems = errors + job.failed
+    summary = (
+        f"✅ Imported {job.posted} products in {elapsed:.0f}s ({job.rate * 60:.0f}/min), "
+        f"skipped {job.skipped} already posted, {len(problems)} failed."
+    )
+    if problems:
+        summary += "\n" + "\n".join(problems[:10])
+        if len(problems) > 10:
+            summary += f"\n…and {len(problems) - 10} more. Fix them and run the import again to resume."
+    try:
+        await status.edit(content=summary[:2000])
+    except discord.HTTPException:
+        await interaction.channel.send(summary[:2000])
+
+
 @bot.tree.command(name="clear")
 @app_commands.checks.has_permissions(administrator=True)
-async def clear(interaction: discord.Interaction, amount: int = None):
-    await interaction.response.defer(ephemeral=True)
-    if amount:
-        deleted = await interaction.channel.purge(limit=amount, check=lambda m: not m.pinned)
-        msg = await interaction.followup.send(f"🧹 Deleted {len(deleted)} messages (excluding pinned).", ephemeral=True)
-    else:
-        deleted = await interaction.channel.purge(check=lambda m: not m.pinned)
-        msg = await interaction.followup.send(f"🧹 Cleared {len(deleted)} messages (excluding pinned).", ephemeral=True)
-    await asyncio.sleep(2)
+@app_commands.describe(
+    amount="Stop after deleting this many messages",
+    author="Only delete messages from this user",
+    after="Only messages from this day on (YYYY-MM-DD)",
+    before="Only messages up to this day (YYYY-MM-DD)",
+    attachments_only="Only delete messages with attachments"
+)
+@instrumented("clear")
+async def clear(
+    interaction: discord.Interaction,
+    amount: app_commands.Range[int, 1] = None,
+    author: discord.User = None,
+    after: str = None,
+    before: str = None,
+    attachments_only: bool = False
+):
+    try:
+        after_dt = datetime.strptime(after, "%Y-%m-%d").replace(tzinfo=timezone.utc) if after else None
+        before_dt = (
+            datetime.strptime(before, "%Y-%m-%d").replace(tzinfo=timezone.utc) + timedelta(days=1) if before else None
+        )
+    except ValueError:
+        await interaction.response.send_message("❌ Dates must look like 2025-01-31.", ephemeral=True)
+        return
+
+    channel = interaction.channel
+    if channel.id in active_purges:
+        await interaction.response.send_message("⚠️ A clear is already running in this channel.", ephemeral=True)
+        return
+
+    def check(m: discord.Message) -> bool:
+        return (author is None or m.author.id == author.id) and (not attachments_only or bool(m.attachments))
+
+    purge = ChannelPurge(channel, check, limit=amount, before=before_dt, after=after_dt)
+    active_purges[channel.id] = purge
+
+    view = CancelClearView(purge)
+    status = None
+
+    async def progress(p: ChannelPurge):
+        try:
+            await status.edit(content=f"🧹 Scanned {p.scanned} · deleted {p.deleted}…")
+        except discord.HTTPException:
+            pass  # the interaction token expires after 15 minutes; keep purging
+
+    try:
+        await interaction.response.defer(ephemeral=True)
+        status = await interaction.followup.send("🧹 Clearing…", view=view, ephemeral=True, wait=True)
+        await purge.run(progress)
+        verb = "Stopped after deleting" if purge.cancelled.is_set() else "Deleted"
+        summary = f"🧹 {verb} {purge.deleted} of {purge.scanned} scanned messages (excluding pinned)."
+    except discord.HTTPException as e:
+        summary = f"❌ Clear failed after deleting {purge.deleted} messages: {e}"
+        if status is None:
+            return  # couldn't even post the status message
+    finally:
+        # The view has no timeout, so it stays registered until stopped
+        active_purges.pop(channel.id, None)
+        view.stop()
+
     try:
-        await msg.delete()
-    except:
+        await status.edit(content=summary, view=None)
+        await status.delete(delay=10)
+    except discord.HTTPException:
         pass
 
 
 @bot.tree.command(name="force_sync", description="🔄 Force re-sync of slash commands")
-@app_commands.checks.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+@instrumented("force_sync")
 async def force_sync(interaction: discord.Interaction):
-    guild = discord.Object(id=1336017250813087877)
-    synced = await bot.tree.sync(guild=guild)
-    await interaction.response.send_message(f"✅ Synced {len(synced)} commands to this server.", ephemeral=True)
+    # Affects every guild the bot is in, so only the bot's owner may do it
+    if not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("❌ Only the bot owner can re-sync commands.", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True)
+    try:
+        results = await sync_command_scopes(force=True)
+    except discord.HTTPException as e:
+        await interaction.followup.send(f"❌ Sync failed: {e}", ephemeral=True)
+        return
+    lines = [
+        f"{'Global' if scope == 'global' else f'Guild {scope}'}: {len(synced)} commands"
+        for scope, synced in results.items()
+    ]
+    await interaction.followup.send("✅ Synced.\n" + "\n".join(lines), ephemeral=True)
+
+
+@bot.tree.command(name="configure", description="⚙️ Set this server's categories and log channel")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    ticket_category="Category for support tickets",
+    cart_category="Category for cart channels",
+    receipt_category="Category for receipt channels",
+    orders_category="Category for order channels",
+    log_channel="Channel for ticket and order logs",
+)
+@instrumented("configure")
+async def configure(
+    interaction: discord.Interaction,
+    ticket_category: discord.CategoryChannel = None,
+    cart_category: discord.CategoryChannel = None,
+    receipt_category: discord.CategoryChannel = None,
+    orders_category: discord.CategoryChannel = None,
+    log_channel: discord.TextChannel = None,
+):
+    changes = {
+        f"{name}_id": channel.id
+        for name, channel in (
+            ("ticket_category", ticket_category),
+            ("cart_category", cart_category),
+            ("receipt_category", receipt_category),
+            ("orders_category", orders_category),
+            ("log_channel", log_channel),
+        )
+        if channel is not None
+    }
+    if changes:
+        config = guild_configs.update(interaction.guild.id, **changes)
+    else:
+        config = guild_configs.get(interaction.guild.id)
+
+    embed = discord.Embed(title="⚙️ Server Config", color=discord.Color.blurple())
+    for field in GuildConfig.__slots__[1:]:
+        channel_id = getattr(config, field)
+        embed.add_field(
+            name=field.removesuffix("_id").replace("_", " ").title(),
+            value=f"<#{channel_id}>" if channel_id else "—",
+        )
+    await interaction.response.send_message(
+        "✅ Config updated." if changes else None, embed=embed, ephemeral=True
+    )
+
+
+@bot.tree.command(name="bot_metrics", description="⏱️ Handler latency, errors and Discord API usage")
+@app_commands.checks.has_permissions(administrator=True)
+@instrumented("bot_metrics")
+async def bot_metrics(interaction: discord.Interaction):
+    embed = discord.Embed(title="⏱️ Bot Metrics", color=discord.Color.blurple())
+    uptime = int(time.time() - metrics.started)
+    embed.description = f"Up {uptime // 3600}h {uptime % 3600 // 60}m · {metrics.rest_calls} REST calls in total"
+
+    # Busiest handlers first; an embed holds at most 25 fields
+    busiest = sorted(metrics.handlers.items(), key=lambda kv: kv[1].count, reverse=True)[:22]
+    for name, h in busiest:
+        embed.add_field(
+            name=name,
+            value=(
+                f"{h.count} calls · {h.errors} errors\n"
+                f"p50 ≤ {h.quantile(0.5) * 1000:g} ms · p95 ≤ {h.quantile(0.95) * 1000:g} ms\n"
+                f"{h.rest_calls / h.count:.1f} REST/call"
+            ),
+        )
+
+    queue = mutations.stats()
+    embed.add_field(
+        name="🧱 Mutation queue",
+        value=f"{queue['depth']} queued · {queue['completed']} done · {queue['failed']} failed\n"
+              f"wait avg {queue['wait_avg'] * 1000:.0f} ms · max {queue['wait_max'] * 1000:.0f} ms",
+        inline=False,
+    )
+    embed.add_field(
+        name="📤 Order writer",
+        value=f"{order_writer.rows} orders in {order_writer.batches} batches",
+        inline=False,
+    )
+    embed.add_field(
+        name="🔀 Deduplication",
+        value="\n".join(
+            f"{f.name}: {f.merged} of {f.calls} merged" for f in (cart_channel_flight, ticket_channel_flight)
+        ) + f"\ncart locks: {len(cart_locks)} live · {cart_locks.contended} of {cart_locks.acquired} waited",
+        inline=False,
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
 
 # -------------------------
-# Ready
+# Command sync
 # -------------------------
 
-@bot.event
-async def on_ready():
-    await bot.wait_until_ready()
+# Scope ("global" or guild ID) -> hash of the command tree last synced there
+command_hashes = {}
+
+
+def command_tree_hash(guild: discord.abc.Snowflake = None) -> str:
+    """
+    Stable hash of the commands registered for a scope, as sent to Discord.
+    """
+    payload = sorted(
+        (cmd.to_dict(tree) for cmd in tree.get_commands(guild=guild)),
+        key=lambda c: (c.get("type", 1), c["name"])
+    )
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
 
-    synced = await tree.sync()
-    print(f"🌐 Synced {len(synced)} GLOBAL commands: {[cmd.name for cmd in synced]}")
 
-    # Register persistent views
+def scope_commands():
+    """
+    In guild mode move every global command onto the COMMAND_SYNC_GUILD_IDS
+    guilds; the global scope is then synced empty, clearing commands left
+    over from global mode.
+    """
+    if not COMMAND_SYNC_GUILD_IDS:
+        return
+    for guild_id in COMMAND_SYNC_GUILD_IDS:
+        tree.copy_global_to(guild=discord.Object(id=guild_id))
+    tree.clear_commands(guild=None)
+
+
+async def sync_command_scopes(force: bool = False) -> dict:
+    """
+    Sync the global scope and each COMMAND_SYNC_GUILD_IDS guild.
+    Scope -> synced commands, or None when that scope was unchanged.
+    """
+    results = {"global": await sync_commands(force=force)}
+    for guild_id in COMMAND_SYNC_GUILD_IDS:
+        results[str(guild_id)] = await sync_commands(discord.Object(id=guild_id), force=force)
+    return results
+
+
+async def sync_commands(guild: discord.abc.Snowflake = None, force: bool = False):
+    """
+    Sync global (or one guild's) commands if they changed since the last
+    sync. Returns the synced commands, or None when nothing changed.
+    """
+    scope = str(guild.id) if guild else "global"
+    digest = command_tree_hash(guild)
+    if not force and command_hashes.get(scope) == digest:
+        return None
+    synced = await tree.sync(guild=guild)
+    command_hashes[scope] = digest
+    state_store.put_command_hash(scope, digest)
+    return synced
+
+
+# -------------------------
+# Startup / Ready
+# -------------------------
+
+@bot.event
+async def setup_hook():
+    # Runs once, before the gateway connects (and so before on_ready)
+    started = time.perf_counter()
+    print(f"⚙️ Loaded config for {guild_configs.load()} guilds")
+    restored = state_store.load_into(carts_for)
+    print(f"💾 Restored {restored} cart items in {(time.perf_counter() - started) * 1000:.1f} ms")
+    print(f"🗄️ Cart state backend: {STATE_BACKEND} (worker {WORKER_ID})")
+    print(f"📷 Resumed {pending_inputs.load()} pending product posts")
+    print(f"⏰ Resumed {scheduler.load()} pending timers")
+    print(f"🗳️ Resumed {polls.load()} open polls")
+    print(f"🛍️ Loaded {product_catalog.load()} catalog products")
+    print(f"💖 Loaded {wishlists.load()} wishlist items")
+    print(f"🖼️ Indexed {attachments.load()} cached image URLs")
+    import_checkpoints.update(state_store.load_import_checkpoints())
+    bot.loop.create_task(state_store.run())
+    bot.loop.create_task(scheduler.run())
+    bot.loop.create_task(order_writer.run())
+    bot.loop.create_task(metrics.run_writer())
+    mutations.start()
+
+    # Persistent views only need registering once per process
     bot.add_view(UploadReceiptView())
     bot.add_view(ApproveOrderView())
     bot.add_view(TicketView())
     bot.add_view(PostProductView())
     bot.add_view(AddToCartView())
     bot.add_view(CloseCartView())
+    bot.add_dynamic_items(RemoveFromCartButton, UploadReceiptButton, CloseCartButton)
+
+    # Logged in by now, so the application ID is known; on_ready also fires on reconnects
+    command_hashes.update(state_store.load_command_hashes())
+    scope_commands()
+    try:
+        results = await sync_command_scopes()
+    except discord.HTTPException as e:
+        # Keep running with whatever commands Discord already has
+        print(f"[command sync] failed: {e}")
+        return
+    for scope, synced in results.items():
+        label = "GLOBAL" if scope == "global" else f"guild {scope}"
+        if synced is None:
+            print(f"🌐 Commands for {label} unchanged, skipped sync")
+        else:
+            print(f"🌐 Synced {len(synced)} commands to {label}: {[cmd.name for cmd in synced]}")
+
+
+@bot.event
+async def on_ready():
+    # Guilds are indexed one by one in on_guild_available
+    print(f"🗂️ Indexed {len(channel_index)} user channels in {len(bot.guilds)} guilds")
+
+    if not product_catalog.warmed:
+        bot.loop.create_task(product_catalog.warm(bot.guilds))
 
     print(f"✅ Logged in as {bot.user}")
 
@@ -862,8 +4875,28 @@ async def on_ready():
 # Run
 # -------------------------
 
-TOKEN = os.environ.get("TOKEN")
-if not TOKEN:
-    raise RuntimeError("TOKEN env var is missing")
+def claim_worker_dir():
+    """
+    Exclusive lock on WORKER_DIR for the life of the process, so two workers
+    never append to the same orders.csv or overwrite each other's snapshots.
+    """
+    lock_file = open(worker_path(".lock"), "w")
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise RuntimeError(f"{os.path.abspath(WORKER_DIR)} is in use by another worker; set a different WORKER_NAME")
+    return lock_file
+
+
+# Guarded so bench.py can import the module without starting the bot
+if __name__ == "__main__":
+    TOKEN = os.environ.get("TOKEN")
+    if not TOKEN:
+        raise RuntimeError("TOKEN env var is missing")
+    worker_lock = claim_worker_dir()
+
+    bot.run(TOKEN)
 
-bot.run(TOKEN)
+    # Write out anything the state writer had not committed yet
+    state_store.flush()